@@ -1,519 +1,3649 @@
-def get_image_hash_bypath(filepath: str, size: int, color_format: str = 'bnw'):
+def _get_color_format_params(color_format: str):
     """
-        Генерация перцептивного хэша изображения по пути в файловой системе
+        Получение параметров формата хэша по названию формата цвета
         args:
-            filepath: путь до файла
-            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
             color_format: 
                             'bnw' - Ч/Б формат
                             'grs' - Оттенки серого
-                            'RGB' - Цветной формат
+                            'rgb' - Цветной формат
+                            'dhash' - Разностный хэш (градиент яркости соседних пикселей)
+                            'phash' - Перцептивный хэш на основе DCT
         returns:
-            bytearray(bytea) - Перцептивный хэш
-            None(NULL) - Если файл не существует
-            0 - Ошибка чтения файла
+            tuple - (режим изображения PIL, код формата для записи в первые 2 байта хэша)
     """
 
-    # Проверка на корректный путь до файла
-    import os
-    if not os.path.exists(filepath): 
-        # Если не существует -- вернуть None(NULL)
-        return None
+    if color_format == 'grs':
+        return 'L', 2
+    elif color_format == 'rgb':
+        return 'RGB', 3
+    elif color_format == 'dhash':
+        return 'L', 4
+    elif color_format == 'phash':
+        return 'L', 5
+    # 'bnw' и любой неизвестный формат - Ч/Б
+    return '1', 1
 
-    # Импорт модулей
-    import io
-    from PIL import Image
 
-    # Настройка параметров формата хэша:
-    #   1. color_format - формат цвета
-    #   2. color_format_to_write - байтовое значение формата для записи в первые 2 байта хэша
-    if color_format == 'bnw':
-        color_format = '1'
-        color_format_to_write = int(1).to_bytes(2, byteorder="little")
-    elif color_format == 'grs':
-        color_format = 'L'
-        color_format_to_write = int(2).to_bytes(2, byteorder="little")
-    elif color_format == 'rgb':
-        color_format = 'RGB'
-        color_format_to_write = int(3).to_bytes(2, byteorder="little")
-    else:
-        color_format = '1'
-        color_format_to_write = int(1).to_bytes(2, byteorder="little")
+# Таблица перевода интенсивности после порога (0/255) в символы битов ('0'/'1')
+_BITS_TABLE = bytes(ord('1') if i == 255 else ord('0') for i in range(256))
 
-    # Загрузка файла
-    with open(filepath, 'rb') as fr:
-        try:
-            img_to_analize = Image.open(                      # 3. Create Image object
-                                    io.BytesIO(               # 2. Create BytesIO format
-                                            fr.read()         # 1. Read file
-                                            )
-                                    ).resize((size, size)     # 4. Resize Image
-                                ).convert(color_format)       # 5. Convert to color format
-        except:
-            return 0
-    
-    # Загрузка первого пикселя для анализа
-    #   Если указан формат Ч/Б или оттенки серого - 
-    #       будет всего 1 значения интенсивности цвета на пиксель
-    #       и такое значение нужно укомпоновать в список - в целях однотипности переменных
-    #   Если указан цветной формат - пропустить шаг, т.к.
-    #       для такого пикселя уже будет список 3 значений интенсивности:
-    #       для красного, зеленого и синего
-    first_pixel_val = img_to_analize.getpixel((0,0))
-    if first_pixel_val.__class__ == int:
-        first_pixel_val = [first_pixel_val]
-
-    # Нахождение среднего значения интенсивности для каждого типа интенсивности
-    avg_val = [0 for _ in first_pixel_val]
-    for i in range(size):
-        for j in range(size):
-
-            pixel_val_rgb = img_to_analize.getpixel((i,j))
-            if pixel_val_rgb.__class__ == int: 
-                pixel_val_rgb = [pixel_val_rgb]
-            for k, val in enumerate(pixel_val_rgb):
-                avg_val[k] += val
-
-    for n in range(len(avg_val)):         
-        avg_val[n] /= size ** 2
-
-    # Запись в первые 2 байта служебной информации
-    values = [color_format_to_write, '']
-    # Двойной цикл по каждому пикселю изображения
-    for i in range(size):
-        for j in range(size):
-            pixel_val_rgb = img_to_analize.getpixel((i,j))
-            if pixel_val_rgb.__class__ == int: 
-                pixel_val_rgb = [pixel_val_rgb]
-            
-            # Цикл по каждому значению интенсивности пикселя
-            for n, pixel_val in enumerate(pixel_val_rgb):
-                # Сравнение интенсивности пискеля с соответствующим значением средней интенсивности
-                #   и создание бита 1/0
-                if pixel_val >= avg_val[n]:
-                    k = '1'
-                else:
-                    k = '0'
-
-                # Если длина последнего элемента списка равна 8 - перевод битов в байты
-                #   и внесение нового бита в отлельный элемент
-                if len(values[-1]) == 8:
-                    values[-1] = int(values[-1], 2).to_bytes(2, byteorder="little")
-                    values.append(k)
-                else: 
-                    # Иначе - дополнение последнего элемента новым битом
-                    values[-1] += k
-
-    # Генерация байтов из последних необработанных битов
-    values[-1] = int(values[-1], 2).to_bytes(2, byteorder="little")
-
-    # Возврат 1 элемента bytearray из списка составленных элементов bytes
-    return bytearray(b''.join(values))
-
-
-def get_image_hash_byurl(url: str, size: int, color_format: str = 'bnw'):
+
+def _get_average_hash(img_to_analize, color_format_code: int, hash_version: int = 1):
     """
-        Генерация перцептивного хэша изображения по простому url
+        Генерация перцептивного хэша (average hash) из сжатого и конвертированного изображения
+        Все операции над пикселями выполняются пакетно средствами PIL:
+            гистограмма -> среднее, таблица point() -> порог, tobytes() -> упаковка битов
         args:
-            url: ссылка на файл
-            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
-            color_format: 
-                            'bnw' - Ч/Б формат
-                            'grs' - Оттенки серого
-                            'RGB' - Цветной формат
+            img_to_analize: объект PIL.Image размером size x size в режиме '1', 'L' или 'RGB'
+            color_format_code: код формата (1 - bnw, 2 - grs, 3 - rgb)
+            hash_version: версия формата хэша (1 или 2)
         returns:
             bytearray(bytea) - Перцептивный хэш
-            None(NULL) - Если файл не существует
-            0 - Ошибка чтения файла
     """
 
-    # Импорт модулей
-    import io
-    from requests import get
     from PIL import Image
 
-    # Настройка параметров формата хэша:
-    #   1. color_format - формат цвета
-    #   2. color_format_to_write - байтовое значение формата для записи в первые 2 байта хэша
-    if color_format == 'bnw':
-        color_format = '1'
-        color_format_to_write = int(1).to_bytes(2, byteorder="little")
-    elif color_format == 'grs':
-        color_format = 'L'
-        color_format_to_write = int(2).to_bytes(2, byteorder="little")
-    elif color_format == 'rgb':
-        color_format = 'RGB'
-        color_format_to_write = int(3).to_bytes(2, byteorder="little")
-    else:
-        color_format = '1'
-        color_format_to_write = int(1).to_bytes(2, byteorder="little")
+    # Для Ч/Б формата интенсивность пикселя - 0 или 255 (как возвращает getpixel)
+    if img_to_analize.mode == '1':
+        img_to_analize = img_to_analize.convert('L')
 
-    # Загрузка файла
-    try:
-        response = get(url)
-        img_to_analize = Image.open(                      # 3. Create Image object
-                                io.BytesIO(               # 2. Create BytesIO format
-                                        response.content  # 1. Read file
-                                        )
-                                ).resize((size, size)     # 4. Resize Image
-                            ).convert(color_format)       # 5. Convert to color format
-    except:
-        return 0
-    
-    # Загрузка первого пикселя для анализа
-    #   Если указан формат Ч/Б или оттенки серого - 
-    #       будет всего 1 значения интенсивности цвета на пиксель
-    #       и такое значение нужно укомпоновать в список - в целях однотипности переменных
-    #   Если указан цветной формат - пропустить шаг, т.к.
-    #       для такого пикселя уже будет список 3 значений интенсивности:
-    #       для красного, зеленого и синего
-    first_pixel_val = img_to_analize.getpixel((0,0))
-    if first_pixel_val.__class__ == int:
-        first_pixel_val = [first_pixel_val]
-
-    # Нахождение среднего значения интенсивности для каждого типа интенсивности
-    avg_val = [0 for _ in first_pixel_val]
-    for i in range(size):
-        for j in range(size):
-
-            pixel_val_rgb = img_to_analize.getpixel((i,j))
-            if pixel_val_rgb.__class__ == int: 
-                pixel_val_rgb = [pixel_val_rgb]
-            for k, val in enumerate(pixel_val_rgb):
-                avg_val[k] += val
-
-    for n in range(len(avg_val)):         
-        avg_val[n] /= size ** 2
-
-    # Запись в первые 2 байта служебной информации
-    values = [color_format_to_write, '']
-    # Двойной цикл по каждому пикселю изображения
-    for i in range(size):
-        for j in range(size):
-            pixel_val_rgb = img_to_analize.getpixel((i,j))
-            if pixel_val_rgb.__class__ == int: 
-                pixel_val_rgb = [pixel_val_rgb]
-            
-            # Цикл по каждому значению интенсивности пикселя
-            for n, pixel_val in enumerate(pixel_val_rgb):
-                # Сравнение интенсивности пискеля с соответствующим значением средней интенсивности
-                #   и создание бита 1/0
-                if pixel_val >= avg_val[n]:
-                    k = '1'
-                else:
-                    k = '0'
-
-                # Если длина последнего элемента списка равна 8 - перевод битов в байты
-                #   и внесение нового бита в отлельный элемент
-                if len(values[-1]) == 8:
-                    values[-1] = int(values[-1], 2).to_bytes(2, byteorder="little")
-                    values.append(k)
-                else: 
-                    # Иначе - дополнение последнего элемента новым битом
-                    values[-1] += k
-
-    # Генерация байтов из последних необработанных битов
-    values[-1] = int(values[-1], 2).to_bytes(2, byteorder="little")
-
-    # Возврат 1 элемента bytearray из списка составленных элементов bytes
-    return bytearray(b''.join(values))
-
-
-def get_image_hash_byrequest(domain: str, qpath:str, method: str, payload:str, schema:str, size: int, color_format: str = 'bnw'):
+    count_pixels = img_to_analize.size[0] * img_to_analize.size[1]
+    count_bands = len(img_to_analize.getbands())
+    histogram = img_to_analize.histogram()
+
+    # Нахождение среднего значения интенсивности для каждого канала по гистограмме
+    #   и составление таблицы порога: 255 - бит 1, 0 - бит 0
+    threshold_table = []
+    for n in range(count_bands):
+        band_histogram = histogram[n * 256:(n + 1) * 256]
+        avg_val = sum(val * count for val, count in enumerate(band_histogram)) / count_pixels
+        threshold_table.extend(255 if val >= avg_val else 0 for val in range(256))
+
+    # Биты идут по столбцам (x - внешний цикл, y - внутренний), а внутри пикселя - по каналам,
+    #   поэтому изображение транспонируется перед чтением буфера
+    bits = img_to_analize.point(threshold_table).transpose(
+                                                    Image.Transpose.TRANSPOSE
+                                                ).tobytes().translate(_BITS_TABLE)
+
+    return _get_hash_from_bits(bits, color_format_code, img_to_analize.size[0], hash_version)
+
+
+def _get_hash_from_bits(bits: bytes, color_format_code: int, size: int, hash_version: int = 1):
     """
-        Генерация перцептивного хэша изображения по сложносоставному запросу
+        Запись битов хэша в формате bytea выбранной версии
         args:
-            domain: доменное имя
-            qpath: путь ссылки
-            method: метод запроса - GET/POST
-            payload: полезнаая нагрузка запроса
-            schema: http/https/ws
-            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
-            color_format: 
-                            'bnw' - Ч/Б формат
-                            'grs' - Оттенки серого
-                            'RGB' - Цветной формат
+            bits: строка символов битов ('0'/'1')
+            color_format_code: код формата
+            size: размер сжатия (записывается в заголовок v2)
+            hash_version: версия формата хэша (1 или 2)
         returns:
             bytearray(bytea) - Перцептивный хэш
-            None(NULL) - Если файл не существует
-            0 - Ошибка чтения файла
     """
 
-    # Импорт модулей
-    import io
-    from requests import request
-    from PIL import Image
+    metrics = _METRICS
+    if metrics is not None:
+        metrics.begin('pack')
 
-    # Настройка параметров формата хэша:
-    #   1. color_format - формат цвета
-    #   2. color_format_to_write - байтовое значение формата для записи в первые 2 байта хэша
-    if color_format == 'bnw':
-        color_format = '1'
-        color_format_to_write = int(1).to_bytes(2, byteorder="little")
-    elif color_format == 'grs':
-        color_format = 'L'
-        color_format_to_write = int(2).to_bytes(2, byteorder="little")
-    elif color_format == 'rgb':
-        color_format = 'RGB'
-        color_format_to_write = int(3).to_bytes(2, byteorder="little")
+    # Формат v2 - 8 бит на байт, последний байт дополняется нулевыми битами справа
+    if hash_version == HASH_VERSION_V2:
+        values = _get_hash_v2_header(color_format_code, size) + _pack_bits(bits)
     else:
-        color_format = '1'
-        color_format_to_write = int(1).to_bytes(2, byteorder="little")
+        # Упаковка полных байтов одним вызовом int(); неполный последний байт
+        #   записывается без дополнения справа, как в исходном формате
+        count_bits = len(bits)
+        count_full_bytes, count_tail_bits = divmod(count_bits, 8)
+        packed = bytearray(int(bits[:count_full_bytes * 8] or b'0', 2).to_bytes(count_full_bytes, byteorder="big"))
+        if count_tail_bits:
+            packed.append(int(bits[count_full_bytes * 8:], 2))
 
-    # Загрузка файла
-    try:
-        if payload != '':
-            response = request(
-                url=f"{schema}://{domain}/{qpath}",
-                method=method,
-                payload=payload
-            )
-        else:
-            response = request(
-                url=f"{schema}://{domain}/{qpath}",
-                method=method
-            )
-        img_to_analize = Image.open(                      # 3. Create Image object
-                                io.BytesIO(               # 2. Create BytesIO format
-                                        response.content  # 1. Read file
-                                        )
-                                ).resize((size, size)     # 4. Resize Image
-                            ).convert(color_format)       # 5. Convert to color format
-    except:
-        return 0
-    
-    # Загрузка первого пикселя для анализа
-    #   Если указан формат Ч/Б или оттенки серого - 
-    #       будет всего 1 значения интенсивности цвета на пиксель
-    #       и такое значение нужно укомпоновать в список - в целях однотипности переменных
-    #   Если указан цветной формат - пропустить шаг, т.к.
-    #       для такого пикселя уже будет список 3 значений интенсивности:
-    #       для красного, зеленого и синего
-    first_pixel_val = img_to_analize.getpixel((0,0))
-    if first_pixel_val.__class__ == int:
-        first_pixel_val = [first_pixel_val]
-
-    # Нахождение среднего значения интенсивности для каждого типа интенсивности
-    avg_val = [0 for _ in first_pixel_val]
-    for i in range(size):
-        for j in range(size):
-
-            pixel_val_rgb = img_to_analize.getpixel((i,j))
-            if pixel_val_rgb.__class__ == int: 
-                pixel_val_rgb = [pixel_val_rgb]
-            for k, val in enumerate(pixel_val_rgb):
-                avg_val[k] += val
-
-    for n in range(len(avg_val)):         
-        avg_val[n] /= size ** 2
-
-    # Запись в первые 2 байта служебной информации
-    values = [color_format_to_write, '']
-    # Двойной цикл по каждому пикселю изображения
-    for i in range(size):
-        for j in range(size):
-            pixel_val_rgb = img_to_analize.getpixel((i,j))
-            if pixel_val_rgb.__class__ == int: 
-                pixel_val_rgb = [pixel_val_rgb]
-            
-            # Цикл по каждому значению интенсивности пикселя
-            for n, pixel_val in enumerate(pixel_val_rgb):
-                # Сравнение интенсивности пискеля с соответствующим значением средней интенсивности
-                #   и создание бита 1/0
-                if pixel_val >= avg_val[n]:
-                    k = '1'
-                else:
-                    k = '0'
-
-                # Если длина последнего элемента списка равна 8 - перевод битов в байты
-                #   и внесение нового бита в отлельный элемент
-                if len(values[-1]) == 8:
-                    values[-1] = int(values[-1], 2).to_bytes(2, byteorder="little")
-                    values.append(k)
-                else: 
-                    # Иначе - дополнение последнего элемента новым битом
-                    values[-1] += k
-
-    # Генерация байтов из последних необработанных битов
-    values[-1] = int(values[-1], 2).to_bytes(2, byteorder="little")
-
-    # Возврат 1 элемента bytearray из списка составленных элементов bytes
-    return bytearray(b''.join(values))
-
-
-def get_image_hash_bybase64(base64str: str, size: int, color_format: str = 'bnw'):
+        # Каждый байт хэша записывается как 2 байта little endian (значение, 0)
+        values = bytearray(2 + 2 * len(packed))
+        values[0:2] = color_format_code.to_bytes(2, byteorder="little")
+        values[2::2] = packed
+
+    return values
+
+
+def _get_difference_hash(img_to_analize, color_format_code: int, hash_version: int = 1):
     """
-        Генерация перцептивного хэша изображения из base64
+        Генерация разностного хэша (dHash): бит 1, если пиксель ярче соседнего справа
+        Биты идут по строкам слева направо
         args:
-            base64str: строка изображения в base64
-            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
-            color_format: 
-                            'bnw' - Ч/Б формат
-                            'grs' - Оттенки серого
-                            'RGB' - Цветной формат
+            img_to_analize: объект PIL.Image размером (size + 1) x size в режиме 'L'
+            color_format_code: код формата (4 - dhash)
+            hash_version: версия формата хэша (1 или 2)
         returns:
             bytearray(bytea) - Перцептивный хэш
-            None(NULL) - Если файл не существует
-            0 - Ошибка чтения файла
     """
 
-    # Импорт модулей
-    import io
-    from base64 import b64decode
+    from PIL import ImageChops
+
+    width, size = img_to_analize.size
+
+    # Вычитание с насыщением: (левый - правый) > 0 только если левый пиксель ярче
+    gradient = ImageChops.subtract(
+                    img_to_analize.crop((0, 0, width - 1, size)),
+                    img_to_analize.crop((1, 0, width, size))
+                )
+    bits = gradient.point(_GRADIENT_TABLE).tobytes().translate(_BITS_TABLE)
+
+    return _get_hash_from_bits(bits, color_format_code, size, hash_version)
+
+
+# Таблица порога разности: любая положительная разность - бит 1
+_GRADIENT_TABLE = [0] + [255] * 255
+
+# Во сколько раз изображение для DCT больше размера хэша (pHash: 32 x 32 для хэша 8 x 8)
+_PHASH_FACTOR = 4
+
+# Кэш таблиц косинусов DCT по (размер изображения, размер хэша)
+_DCT_TABLES = {}
+
+
+def _get_dct_table(count_pixels: int, size: int):
+    """
+        Таблица косинусов DCT-II: первые size частот для count_pixels отсчетов
+    """
+
+    key = (count_pixels, size)
+    if key not in _DCT_TABLES:
+        from math import cos, pi
+        _DCT_TABLES[key] = [
+            [cos(pi * k * (2 * n + 1) / (2 * count_pixels)) for n in range(count_pixels)] for k in range(size)
+        ]
+    return _DCT_TABLES[key]
+
+
+def _get_dct_hash(img_to_analize, color_format_code: int, hash_version: int = 1):
+    """
+        Генерация перцептивного хэша на основе DCT (pHash): двумерное DCT-II изображения,
+        из него берутся size x size низших частот, бит 1 - если коэффициент больше медианы
+        Вычисляются только нужные частоты: DCT строк, затем DCT столбцов полученной матрицы
+        Биты идут по строкам частот
+        args:
+            img_to_analize: объект PIL.Image размером (size * _PHASH_FACTOR) x (size * _PHASH_FACTOR) в режиме 'L'
+            color_format_code: код формата (5 - phash)
+            hash_version: версия формата хэша (1 или 2)
+        returns:
+            bytearray(bytea) - Перцептивный хэш
+    """
+
+    coefficients, size = _get_dct_coefficients(img_to_analize)
+    return _get_hash_from_bits(_get_dct_bits(coefficients), color_format_code, size, hash_version)
+
+
+def _get_dct_coefficients(img_to_analize):
+    """
+        size x size низших частот двумерного DCT-II изображения для pHash
+        returns:
+            tuple - (коэффициенты по строкам частот, size)
+    """
+
+    from operator import mul
+
+    count_pixels = img_to_analize.size[0]
+    size = count_pixels // _PHASH_FACTOR
+    table = _get_dct_table(count_pixels, size)
+    pixels = img_to_analize.tobytes()
+
+    # DCT каждой строки изображения (только size низших частот)
+    rows = [pixels[y * count_pixels:(y + 1) * count_pixels] for y in range(count_pixels)]
+    rows_dct = [[sum(map(mul, row, cosines)) for cosines in table] for row in rows]
+
+    # DCT по столбцам: коэффициент (v, u) = сумма по y cos_v[y] * rows_dct[y][u]
+    columns = list(zip(*rows_dct))
+    return [sum(map(mul, column, cosines)) for cosines in table for column in columns], size
+
+
+def _get_dct_bits(coefficients: list):
+    """
+        Биты pHash: 1 - если коэффициент больше медианы коэффициентов
+    """
+
+    # Медиана коэффициентов низших частот - порог битов
+    ordered = sorted(coefficients)
+    middle = len(ordered) // 2
+    median = ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+    return bytes(49 if coefficient > median else 48 for coefficient in coefficients)
+
+
+def _get_resize_size(size: int, color_format_code: int):
+    """
+        Размер сжатого изображения для алгоритма хэширования
+        returns:
+            tuple - (ширина, высота)
+    """
+
+    if color_format_code == 4:
+        return size + 1, size
+    elif color_format_code == 5:
+        return size * _PHASH_FACTOR, size * _PHASH_FACTOR
+    return size, size
+
+
+def _get_image_hash(img_to_analize, color_format_code: int, hash_version: int = 1, metrics=None):
+    """
+        Генерация хэша из сжатого изображения алгоритмом, соответствующим коду формата
+        (metrics - объект _Metrics при инструментировании: отметка этапа hash)
+    """
+
+    if metrics is not None:
+        metrics.begin('hash')
+    if color_format_code == 4:
+        return _get_difference_hash(img_to_analize, color_format_code, hash_version)
+    elif color_format_code == 5:
+        return _get_dct_hash(img_to_analize, color_format_code, hash_version)
+    return _get_average_hash(img_to_analize, color_format_code, hash_version)
+
+
+# Во сколько раз уменьшенное при декодировании изображение должно быть больше размера сжатия
+_FAST_DECODE_FACTOR = 4
+
+# Режимы изображений, поддерживаемые Image.reduce
+_REDUCE_MODES = ('L', 'LA', 'La', 'RGB', 'RGBA', 'RGBa', 'RGBX', 'CMYK', 'YCbCr', 'I', 'F')
+
+
+def _get_reduced_image(img, min_size: int):
+    """
+        Уменьшение усреднением блоков (reduce) до размера не меньше min_size по каждой стороне
+    """
+
+    if img.mode in _REDUCE_MODES:
+        factor = (max(img.size[0] // min_size, 1), max(img.size[1] // min_size, 1))
+        if factor != (1, 1):
+            img = img.reduce(factor)
+    return img
+
+
+def _get_decoded_image(img, size: int, fast_decode: bool = False, preprocess: int = 0):
+    """
+        Подготовка декодирования изображения
+        args:
+            img: открытый объект PIL.Image (еще не декодированный)
+            size: наибольший размер сжатия, для которого будет использовано изображение
+            fast_decode: декодирование в уменьшенном разрешении - не меньше
+                         size * _FAST_DECODE_FACTOR по каждой стороне:
+                            JPEG - масштабирование DCT при декодировании (draft)
+                            остальные форматы - уменьшение усреднением блоков (reduce)
+            preprocess: флаги нормализации PREPROCESS_* - если заданы, изображение приводится
+                        к режиму 'L' / 'LA' / 'RGB' / 'RGBA' и всегда уменьшается (reduce),
+                        чтобы нормализация (_get_preprocessed_image) шла на уменьшенном изображении
+        returns:
+            PIL.Image - изображение для сжатия
+    """
+
+    min_size = size * _FAST_DECODE_FACTOR
+    if fast_decode and img.format == 'JPEG':
+        img.draft(img.mode, (min_size, min_size))
+    _check_pixels(img)
+
+    if preprocess:
+        if img.mode not in _PREPROCESS_MODES:
+            if img.mode == '1':
+                img = img.convert('L')
+            elif img.mode in ('PA', 'La', 'RGBa') or 'transparency' in img.info:
+                img = img.convert('RGBA')
+            else:
+                img = img.convert('RGB')
+        return _get_reduced_image(img, min_size)
+
+    if fast_decode and img.format != 'JPEG':
+        img = _get_reduced_image(img, min_size)
+
+    return img
+
+
+# Флаги нормализации изображения перед хэшированием (параметр preprocess - сумма флагов)
+PREPROCESS_EXIF = 1         # Поворот/отражение по тегу EXIF Orientation
+PREPROCESS_ALPHA = 2        # Наложение прозрачного изображения на фон _PREPROCESS_BACKGROUND
+PREPROCESS_AUTOCROP = 4     # Обрезка однотонных полей
+PREPROCESS_EQUALIZE = 8     # Выравнивание гистограммы
+PREPROCESS_ALL = PREPROCESS_EXIF | PREPROCESS_ALPHA | PREPROCESS_AUTOCROP | PREPROCESS_EQUALIZE
+
+# Режимы, к которым приводится изображение перед нормализацией
+_PREPROCESS_MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+# Цвет фона для прозрачных изображений
+_PREPROCESS_BACKGROUND = (255, 255, 255)
+
+# Отличие от цвета угла, начиная с которого пиксель не считается полем (поглощает шум JPEG)
+_AUTOCROP_TOLERANCE = 16
+_AUTOCROP_TABLE = [0] * (_AUTOCROP_TOLERANCE + 1) + [255] * (255 - _AUTOCROP_TOLERANCE)
+
+# Тег EXIF Orientation и соответствующие ему преобразования (Image.Transpose)
+_EXIF_ORIENTATION = 0x0112
+_EXIF_TRANSPOSE = {
+    2: 'FLIP_LEFT_RIGHT', 3: 'ROTATE_180', 4: 'FLIP_TOP_BOTTOM', 5: 'TRANSPOSE',
+    6: 'ROTATE_270', 7: 'TRANSVERSE', 8: 'ROTATE_90',
+}
+
+
+def _get_preprocessed_image(img, preprocess: int):
+    """
+        Нормализация уменьшенного изображения (после _get_decoded_image с тем же preprocess)
+        Шаги выполняются в порядке: EXIF -> прозрачность -> поля -> гистограмма
+        args:
+            img: объект PIL.Image в режиме 'L' / 'LA' / 'RGB' / 'RGBA'
+            preprocess: флаги PREPROCESS_*
+        returns:
+            PIL.Image - изображение в режиме 'L' или 'RGB'
+    """
+
+    from functools import reduce
+    from PIL import Image, ImageChops, ImageOps
+
+    _check_deadline()
+    if preprocess & PREPROCESS_EXIF:
+        method = _EXIF_TRANSPOSE.get(img.getexif().get(_EXIF_ORIENTATION))
+        if method is not None:
+            img = img.transpose(getattr(Image.Transpose, method))
+
+    if img.mode in ('LA', 'RGBA'):
+        if preprocess & PREPROCESS_ALPHA:
+            background = Image.new('RGBA', img.size, _PREPROCESS_BACKGROUND + (255,))
+            background.alpha_composite(img.convert('RGBA'))
+            img = background.convert(img.mode[:-1])
+        else:
+            # Без наложения прозрачность отбрасывается, как при обычной конвертации
+            img = img.convert(img.mode[:-1])
+
+    if preprocess & PREPROCESS_AUTOCROP:
+        # Поле - пиксели, отличающиеся от цвета левого верхнего угла не больше чем на _AUTOCROP_TOLERANCE
+        difference = ImageChops.difference(img, Image.new(img.mode, img.size, img.getpixel((0, 0))))
+        box = reduce(ImageChops.lighter, difference.split()).point(_AUTOCROP_TABLE).getbbox()
+        if box is not None and box != (0, 0) + img.size:
+            img = img.crop(box)
+
+    if preprocess & PREPROCESS_EQUALIZE:
+        img = ImageOps.equalize(img)
+
+    return img
+
+
+# Фильтры сжатия изображения перед хэшированием (set_resize_pipeline):
+#   'reduce' - уменьшение усреднением блоков в целое число раз (Image.reduce) с запасом не меньше
+#   двух размеров сжатия и досжатие фильтром 'bilinear' (запас 1 или досжатие 'box' заметно менее устойчивы)
+RESIZE_FILTERS = ('nearest', 'box', 'bilinear', 'hamming', 'bicubic', 'lanczos', 'reduce')
+
+# Конвейер сжатия и конвертации (set_resize_pipeline); значения по умолчанию воспроизводят
+#   прежние хэши: сжатие фильтром Pillow по умолчанию, затем конвертация, 'bnw' - с дизерингом
+_RESIZE_FILTER = None
+_RESIZE_CONVERT_FIRST = False
+_RESIZE_DITHER = True
+# Аргументы Image.resize для текущего фильтра
+_RESIZE_PARAMS = {}
+
+# Быстрый конвейер: время и отличие хэшей от режима совместимости - в README (bench.py --groups pipeline)
+RESIZE_PIPELINE_FAST = {'resample': 'reduce', 'convert_first': True, 'dither': False}
+
+
+def set_resize_pipeline(resample: str = None, convert_first: bool = False, dither: bool = True):
+    """
+        Конвейер сжатия и конвертации изображения перед хэшированием в текущем процессе
+        (set_resize_pipeline() - режим совместимости: хэши совпадают с прежними версиями)
+        Хэши, полученные с разными настройками, имеют тот же формат, но отличаются
+        (для 'bnw' при смене dither - почти полностью), поэтому коллекция хэшируется одним конвейером;
+        настройки учитываются в ключах HashCache и параметрах манифеста sync_image_hashes
+        args:
+            resample: фильтр сжатия из RESIZE_FILTERS (None - фильтр Pillow по умолчанию:
+                      'bicubic', для режимов '1' и 'P' - 'nearest')
+            convert_first: конвертация в режим хэша до сжатия ('bnw' - в 'L'), если она уменьшает
+                           количество каналов или заменяет палитру - сжимается один канал вместо трех
+            dither: дизеринг Флойда-Стейнберга при конвертации в 'bnw'
+                    (False - порог 128 по яркости, без шума дизеринга)
+        returns:
+            True - настройки применены
+            -2 - для неизвестного фильтра
+    """
+
+    global _RESIZE_FILTER, _RESIZE_CONVERT_FIRST, _RESIZE_DITHER, _RESIZE_PARAMS
+
+    if resample is not None and resample not in RESIZE_FILTERS:
+        return -2
+
+    params = {}
+    if resample is not None:
+        from PIL import Image
+
+        if resample == 'reduce':
+            params = {'resample': Image.Resampling.BILINEAR, 'reducing_gap': 2.0}
+        else:
+            params = {'resample': getattr(Image.Resampling, resample.upper())}
+
+    _RESIZE_FILTER = resample
+    _RESIZE_CONVERT_FIRST = bool(convert_first)
+    _RESIZE_DITHER = bool(dither)
+    _RESIZE_PARAMS = params
+    return True
+
+
+def get_resize_pipeline():
+    """
+        Текущий конвейер сжатия и конвертации (см. set_resize_pipeline)
+        returns:
+            dict - {'resample', 'convert_first', 'dither'}
+    """
+
+    return {'resample': _RESIZE_FILTER, 'convert_first': _RESIZE_CONVERT_FIRST, 'dither': _RESIZE_DITHER}
+
+
+def _get_resize_pipeline_code():
+    """
+        Код конвейера для ключей кэша и манифеста: 0 - режим совместимости
+        (биты 0-3 - номер фильтра в RESIZE_FILTERS + 1, бит 4 - convert_first, бит 5 - без дизеринга)
+    """
+
+    code = RESIZE_FILTERS.index(_RESIZE_FILTER) + 1 if _RESIZE_FILTER is not None else 0
+    return code | _RESIZE_CONVERT_FIRST << 4 | (not _RESIZE_DITHER) << 5
+
+
+def _get_resize_mode(img_mode: str, mode: str):
+    """
+        Режим, в котором изображение сжимается для режима хэша mode
+    """
+
+    if not _RESIZE_CONVERT_FIRST:
+        return img_mode
+
     from PIL import Image
 
-    # Настройка параметров формата хэша:
-    #   1. color_format - формат цвета
-    #   2. color_format_to_write - байтовое значение формата для записи в первые 2 байта хэша
-    if color_format == 'bnw':
-        color_format = '1'
-        color_format_to_write = int(1).to_bytes(2, byteorder="little")
-    elif color_format == 'grs':
-        color_format = 'L'
-        color_format_to_write = int(2).to_bytes(2, byteorder="little")
-    elif color_format == 'rgb':
-        color_format = 'RGB'
-        color_format_to_write = int(3).to_bytes(2, byteorder="little")
-    else:
-        color_format = '1'
-        color_format_to_write = int(1).to_bytes(2, byteorder="little")
+    # Ч/Б сжимается в оттенках серого: сжатие в режиме '1' - только 'nearest'
+    resize_mode = 'L' if mode == '1' else mode
+    if img_mode == resize_mode:
+        return img_mode
+    # Конвертация до сжатия не должна добавлять каналы (кроме палитры и Ч/Б, сжимаемых без усреднения)
+    if img_mode not in ('1', 'P', 'PA') and Image.getmodebands(img_mode) < Image.getmodebands(resize_mode):
+        return img_mode
+    return resize_mode
+
+
+def _get_resize_source(img, mode: str):
+    """
+        Изображение, приведенное к режиму сжатия для режима хэша mode (см. _get_resize_mode)
+    """
+
+    resize_mode = _get_resize_mode(img.mode, mode)
+    return img if resize_mode == img.mode else img.convert(resize_mode)
+
+
+def _get_scaled_image(img, size: tuple, box: tuple = None):
+    """
+        Сжатие изображения фильтром конвейера (box - область исходного изображения)
+    """
+
+    return img.resize(size, box=box, **_RESIZE_PARAMS)
+
+
+def _get_converted_image(img, mode: str):
+    """
+        Конвертация сжатого изображения в режим хэша ('bnw' - с дизерингом или по порогу)
+    """
+
+    if mode == '1' and not _RESIZE_DITHER:
+        from PIL import Image
+        return img.convert('1', dither=Image.Dither.NONE)
+    return img.convert(mode)
+
+
+def _get_resized_image(img, size, color_format: str, fast_decode: bool = False, preprocess: int = 0, metrics=None):
+    """
+        Сжатие и конвертация изображения перед хэшированием
+        args:
+            img: открытый объект PIL.Image (еще не декодированный)
+            size: размер сжатия изображения - int (квадрат) или (ширина, высота)
+            color_format: режим изображения PIL ('1', 'L', 'RGB')
+            fast_decode: декодирование в уменьшенном разрешении (см. _get_decoded_image)
+            preprocess: флаги нормализации PREPROCESS_* (0 - без нормализации)
+            metrics: объект _Metrics при инструментировании - отметки этапов decode, preprocess,
+                     resize, convert (None - без замеров)
+        returns:
+            PIL.Image - сжатое изображение в режиме color_format
+    """
+
+    if size.__class__ == int:
+        size = (size, size)
+    if metrics is not None:
+        metrics.begin('decode')
+    img = _get_decoded_image(img, max(size), fast_decode, preprocess)
+    img.load()
+    _check_deadline()
+    if preprocess:
+        if metrics is not None:
+            metrics.begin('preprocess')
+        img = _get_preprocessed_image(img, preprocess)
+    if metrics is not None:
+        metrics.begin('resize')
+    img = _get_scaled_image(_get_resize_source(img, color_format), size)
+    _check_deadline()
+    if metrics is not None:
+        metrics.begin('convert')
+    return _get_converted_image(img, color_format)
+
+
+# Версии формата хэша:
+#   v1 - заголовок 2 байта (код формата, 0), каждый байт хэша записан как 2 байта (значение, 0)
+#   v2 - заголовок 4 байта (код формата, версия, размер uint16 little endian), 8 бит на байт
+HASH_VERSION_V1 = 1
+HASH_VERSION_V2 = 2
+
+# Количество бит на пиксель сжатого изображения по коду формата хэша
+#   1 - bnw, 2 - grs, 3 - rgb (average hash), 4 - dhash, 5 - phash
+_HASH_FORMAT_BANDS = {1: 1, 2: 1, 3: 3, 4: 1, 5: 1}
+_HASH_V1_HEADER_LEN = 2
+_HASH_V2_HEADER_LEN = 4
+
+
+def _pack_bits(bits: bytes):
+    """
+        Упаковка строки символов битов ('0'/'1') по 8 бит в байт, старший бит первым
+        Неполный последний байт дополняется нулевыми битами справа
+    """
+
+    count_bytes = (len(bits) + 7) // 8
+    if not count_bytes:
+        return bytearray()
+    return bytearray((int(bits, 2) << (count_bytes * 8 - len(bits))).to_bytes(count_bytes, byteorder="big"))
+
+
+def _get_hash_v2_header(color_format_code: int, size: int):
+    """
+        Генерация 4 байт заголовка хэша формата v2
+    """
+
+    return bytearray((color_format_code, HASH_VERSION_V2)) + bytearray(size.to_bytes(2, byteorder="little"))
+
+
+def _get_hash_header(a: bytearray):
+    """
+        Разбор заголовка хэша любой версии
+        args:
+            a - хэш (bytea)
+        returns:
+            tuple - (версия, код формата, размер сжатия, количество бит хэша)
+            None - если хэш не распознан
+    """
+
+    if len(a) < _HASH_V1_HEADER_LEN or a[0] not in _HASH_FORMAT_BANDS:
+        return None
+    count_bands = _HASH_FORMAT_BANDS[a[0]]
+
+    if a[1] == 0:
+        # v1 - размер не записан, восстанавливается по количеству байт
+        count_bytes, odd = divmod(len(a) - _HASH_V1_HEADER_LEN, 2)
+        if odd:
+            return None
+        from math import isqrt
+        size = isqrt(count_bytes * 8 // count_bands)
+        if (size * size * count_bands + 7) // 8 != count_bytes:
+            return None
+        return HASH_VERSION_V1, a[0], size, size * size * count_bands
+
+    if a[1] == HASH_VERSION_V2 and len(a) >= _HASH_V2_HEADER_LEN:
+        size = int.from_bytes(a[2:4], byteorder="little")
+        count_bits = size * size * count_bands
+        if len(a) - _HASH_V2_HEADER_LEN != (count_bits + 7) // 8:
+            return None
+        return HASH_VERSION_V2, a[0], size, count_bits
+
+    return None
+
+
+def convert_hash_v1_to_v2(a: bytearray):
+    """
+        Конвертация хэша из формата v1 в компактный формат v2
+        args:
+            a - хэш формата v1 (bytea)
+        returns:
+            bytearray(bytea) - хэш формата v2
+            -2 - для хэша нераспознанного формата
+    """
+
+    header = _get_hash_header(a)
+    if header is None:
+        return -2
+    version, color_format_code, size, count_bits = header
+    if version == HASH_VERSION_V2:
+        return bytearray(a)
+
+    # Значимые байты v1 - каждый второй; неполный последний байт выравнивается влево
+    packed = bytearray(a[_HASH_V1_HEADER_LEN::2])
+    count_tail_bits = count_bits % 8
+    if count_tail_bits:
+        packed[-1] = (packed[-1] << (8 - count_tail_bits)) & 0xFF
+
+    return _get_hash_v2_header(color_format_code, size) + packed
+
+
+def convert_hash_v2_to_v1(a: bytearray):
+    """
+        Конвертация хэша из компактного формата v2 в формат v1
+        args:
+            a - хэш формата v2 (bytea)
+        returns:
+            bytearray(bytea) - хэш формата v1
+            -2 - для хэша нераспознанного формата
+    """
+
+    header = _get_hash_header(a)
+    if header is None:
+        return -2
+    version, color_format_code, size, count_bits = header
+    if version == HASH_VERSION_V1:
+        return bytearray(a)
+
+    # Неполный последний байт v1 хранится выровненным вправо
+    packed = bytearray(a[_HASH_V2_HEADER_LEN:])
+    count_tail_bits = count_bits % 8
+    if count_tail_bits:
+        packed[-1] >>= 8 - count_tail_bits
+
+    values = bytearray(_HASH_V1_HEADER_LEN + 2 * len(packed))
+    values[0] = color_format_code
+    values[_HASH_V1_HEADER_LEN::2] = packed
+    return values
+
+
+def _get_hash_v1(a: bytearray):
+    """
+        Приведение хэша любой версии к формату v1 для функций расстояния
+        Хэш v1 и нераспознанный хэш возвращаются без изменений
+    """
+
+    if len(a) >= _HASH_V1_HEADER_LEN and a[1] == HASH_VERSION_V2:
+        converted = convert_hash_v2_to_v1(a)
+        if converted != -2:
+            return converted
+    return a
+
+
+# Ограничения ресурсов одного вызова хэширования (см. set_limits): 0 - без ограничения
+_LIMIT_BYTES = 0
+_LIMIT_PIXELS = 0
+_LIMIT_SECONDS = 0
+
+# Результат хэширования при превышении ограничения ресурсов (отличается от 0 - ошибки чтения)
+LIMIT_EXCEEDED = -3
+
+# Сроки текущих вызовов по идентификатору потока (только при ограничении времени)
+_LIMIT_DEADLINES = {}
+
+
+class _LimitExceeded(Exception):
+    """
+        Превышение ограничения ресурсов (аргумент - имя ограничения)
+        Точки входа возвращают вместо исключения LIMIT_EXCEEDED
+    """
+
+
+def set_limits(max_bytes: int = 0, max_pixels: int = 0, max_seconds: float = 0):
+    """
+        Ограничения ресурсов одного вызова get_image_hash_* / get_image_hashes_* в текущем процессе
+        (0 - без ограничения, set_limits() снимает все ограничения)
+        При превышении вызов возвращает LIMIT_EXCEEDED вместо хэша
+        args:
+            max_bytes: размер входных данных - проверяется до чтения файла (размер файла),
+                       по заголовку Content-Length и во время потоковой загрузки по url,
+                       по длине текста base64 и во время потокового декодирования base64
+            max_pixels: количество декодируемых пикселей - проверяется по заголовку изображения
+                        до декодирования (для JPEG с fast_decode - после уменьшения draft)
+            max_seconds: время вызова - таймаут запросов по url и проверка между этапами
+                         (загрузка частями, декодирование, нормализация);
+                         время самого декодирования ограничено через max_pixels
+    """
+
+    global _LIMIT_BYTES, _LIMIT_PIXELS, _LIMIT_SECONDS
+    _LIMIT_BYTES = max_bytes
+    _LIMIT_PIXELS = max_pixels
+    _LIMIT_SECONDS = max_seconds
+
+
+def get_limits():
+    """
+        Текущие ограничения ресурсов (см. set_limits)
+        returns:
+            dict - {'max_bytes', 'max_pixels', 'max_seconds'}
+    """
+
+    return {'max_bytes': _LIMIT_BYTES, 'max_pixels': _LIMIT_PIXELS, 'max_seconds': _LIMIT_SECONDS}
+
+
+def _limited(function):
+    """
+        Точка входа хэширования с ограничением времени вызова: срок хранится для текущего потока,
+        вложенные вызовы (например, bybytes -> byfile) используют срок внешнего вызова
+    """
+
+    from functools import wraps
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _LIMIT_SECONDS:
+            return function(*args, **kwargs)
+
+        import threading
+        from time import monotonic
+
+        thread_id = threading.get_ident()
+        if thread_id in _LIMIT_DEADLINES:
+            return function(*args, **kwargs)
+        _LIMIT_DEADLINES[thread_id] = monotonic() + _LIMIT_SECONDS
+        try:
+            return function(*args, **kwargs)
+        finally:
+            del _LIMIT_DEADLINES[thread_id]
+
+    return wrapper
+
+
+def _check_bytes(count_bytes: int):
+    if _LIMIT_BYTES and count_bytes > _LIMIT_BYTES:
+        raise _LimitExceeded('max_bytes')
+
+
+def _check_pixels(img):
+    if _LIMIT_PIXELS and img.size[0] * img.size[1] > _LIMIT_PIXELS:
+        raise _LimitExceeded('max_pixels')
+
+
+def _check_deadline():
+    if _LIMIT_SECONDS:
+        import threading
+        from time import monotonic
+
+        deadline = _LIMIT_DEADLINES.get(threading.get_ident())
+        if deadline is not None and monotonic() > deadline:
+            raise _LimitExceeded('max_seconds')
+
+
+def _read_file(fr):
+    """
+        Чтение открытого файла целиком с проверкой размера до чтения
+    """
+
+    import os
+
+    if _LIMIT_BYTES:
+        _check_bytes(os.fstat(fr.fileno()).st_size)
+    return fr.read()
+
+
+def _check_file_bytes(fileobj):
+    """
+        Проверка размера непрочитанной части файлового объекта с произвольным доступом (seek/tell)
+        Размер потока без seek не проверяется - его ограничивает max_pixels
+    """
+
+    if _LIMIT_BYTES:
+        try:
+            position = fileobj.tell()
+            end = fileobj.seek(0, 2)
+            fileobj.seek(position)
+        except Exception:
+            return
+        _check_bytes(end - position)
+
+
+def _read_response(response):
+    """
+        Чтение тела ответа requests (stream=True): при ограничениях - частями с ранним отказом
+        по Content-Length, размеру загруженного и сроку вызова
+    """
+
+    if not _LIMIT_BYTES and not _LIMIT_SECONDS:
+        return response.content
+
+    content_length = response.headers.get('Content-Length', '')
+    if content_length.isdigit():
+        _check_bytes(int(content_length))
+
+    chunks = []
+    count_bytes = 0
+    for chunk in response.iter_content(chunk_size=65536):
+        count_bytes += len(chunk)
+        _check_bytes(count_bytes)
+        _check_deadline()
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def _get_url_content(url: str):
+    """
+        Загрузка файла по url с учетом ограничений ресурсов (см. set_limits)
+    """
+
+    from requests import get
+
+    with get(url, stream=True, timeout=_LIMIT_SECONDS or None) as response:
+        return _read_response(response)
+
+
+def _get_request_content(domain: str, qpath: str, method: str, payload: str, schema: str):
+    """
+        Загрузка файла по сложносоставному запросу с учетом ограничений ресурсов (см. set_limits)
+    """
+
+    from requests import request
+
+    if payload != '':
+        response = request(
+            url=f"{schema}://{domain}/{qpath}",
+            method=method,
+            payload=payload,
+            stream=True,
+            timeout=_LIMIT_SECONDS or None
+        )
+    else:
+        response = request(
+            url=f"{schema}://{domain}/{qpath}",
+            method=method,
+            stream=True,
+            timeout=_LIMIT_SECONDS or None
+        )
+    # Соединение закрывается и при досрочном отказе загрузки по ограничению
+    with response:
+        return _read_response(response)
+
+
+# Инструментирование хэширования (см. enable_metrics): None - выключено,
+#   точки входа проверяют только это имя и идут по обычному пути
+_METRICS = None
+
+
+class _Metrics:
+    """
+        Времена этапов и счетчики вызовов get_image_hash_* (потокобезопасно)
+        Этапы вызова (нс):
+            read - получение байтов файла (чтение, загрузка по url, декодирование base64)
+            open - разбор заголовка изображения
+            decode - декодирование пикселей (с draft/reduce при fast_decode)
+            preprocess - нормализация изображения (только при preprocess)
+            resize - сжатие
+            convert - конвертация в режим формата цвета
+            hash - расчет битов хэша (без упаковки)
+            pack - упаковка битов в формат хэша
+    """
+
+    def __init__(self, callback=None):
+        import threading
+        from time import perf_counter_ns
+
+        self.callback = callback
+        self.clock = perf_counter_ns
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._calls = {}
+            self._results = {}
+            self._errors = {}
+            self._formats = {}
+            self._stages = {}
+            self._bytes = 0
+            self._pixels = 0
+            self._max_width = 0
+            self._max_height = 0
+
+    def start(self, entry: str):
+        """
+            Начало записи вызова точки входа entry в текущем потоке
+        """
+
+        record = {
+            'entry': entry, 'result': 'ok', 'error': None, 'stage': None, 'bytes': 0,
+            'format': None, 'mode': None, 'width': 0, 'height': 0, 'stages': {}, 'total': 0,
+        }
+        self._local.record = record
+        self._local.stage = None
+        return record
+
+    def begin(self, stage: str):
+        """
+            Начало этапа текущего вызова потока: время предыдущего этапа добавляется к записи
+            (вне вызова get_image_hash_* - игнорируется)
+        """
+
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            now = self.clock()
+            self._end_stage(record, now)
+            self._local.stage = stage
+            self._local.previous = now
+
+    def get_stage(self):
+        """
+            Текущий этап вызова потока (None - вне вызова или до первого этапа)
+        """
+
+        return getattr(self._local, 'stage', None)
+
+    def _end_stage(self, record: dict, now: int):
+        stage = self._local.stage
+        if stage is not None:
+            record['stages'][stage] = record['stages'].get(stage, 0) + now - self._local.previous
+
+    def finish(self, record: dict, start: int = None):
+        """
+            Завершение записи вызова: добавление в сводку и передача в callback
+        """
+
+        now = self.clock()
+        if start is not None:
+            record['total'] = now - start
+        if getattr(self._local, 'record', None) is record:
+            self._end_stage(record, now)
+        self._local.record = None
+        self._local.stage = None
+
+        with self._lock:
+            entry, result = record['entry'], record['result']
+            self._calls[entry] = self._calls.get(entry, 0) + 1
+            self._results[result] = self._results.get(result, 0) + 1
+            if record['error'] is not None:
+                key = (record['stage'], record['error'])
+                self._errors[key] = self._errors.get(key, 0) + 1
+            if record['format'] is not None:
+                self._formats[record['format']] = self._formats.get(record['format'], 0) + 1
+            self._bytes += record['bytes']
+            self._pixels += record['width'] * record['height']
+            self._max_width = max(self._max_width, record['width'])
+            self._max_height = max(self._max_height, record['height'])
+            for stage, duration in record['stages'].items():
+                count, total, maximum = self._stages.get(stage, (0, 0, 0))
+                self._stages[stage] = (count + 1, total + duration, max(maximum, duration))
+
+        if self.callback is not None:
+            self.callback(record)
+
+    def add_missing(self, entry: str):
+        """
+            Учет вызова для несуществующего файла
+        """
+
+        record = self.start(entry)
+        record['result'] = 'missing'
+        self.finish(record)
+
+    def snapshot(self):
+        """
+            Сводка по всем вызовам с момента включения или сброса
+        """
+
+        with self._lock:
+            return {
+                'calls': dict(self._calls),
+                'results': dict(self._results),
+                'errors': [
+                    {'stage': stage, 'error': error, 'count': count}
+                    for (stage, error), count in self._errors.items()
+                ],
+                'formats': dict(self._formats),
+                'bytes_read': self._bytes,
+                'pixels_decoded': self._pixels,
+                'max_width': self._max_width,
+                'max_height': self._max_height,
+                'stages': {
+                    stage: {'count': count, 'total_ms': total / 1e6, 'mean_us': total / count / 1e3,
+                            'max_us': maximum / 1e3}
+                    for stage, (count, total, maximum) in self._stages.items()
+                },
+            }
+
+
+def enable_metrics(callback=None):
+    """
+        Включение инструментирования функций get_image_hash_* и get_image_hashes_* в текущем процессе
+        (в процессах пула get_image_hash_bypaths с workers > 1 не действует)
+        Выключенное инструментирование стоит одной проверки глобального имени на вызов
+        args:
+            callback: функция, вызываемая после каждого вызова с записью (dict):
+                        entry - точка входа ('bypath', 'byurl', ...)
+                        result - 'ok' / 'error' / 'missing'
+                        error, stage - имя типа исключения и этап, на котором оно возникло
+                        bytes - размер файла
+                        format, mode, width, height - формат, режим и размер исходного изображения
+                        stages - {этап: время, нс} (см. _Metrics)
+                        total - полное время вызова, нс
+                      None - только сводка (get_metrics)
+    """
+
+    global _METRICS
+    _METRICS = _Metrics(callback)
+
+
+def disable_metrics():
+    """
+        Выключение инструментирования
+        returns:
+            dict - итоговая сводка (как get_metrics)
+            None - если инструментирование не было включено
+    """
+
+    global _METRICS
+    metrics, _METRICS = _METRICS, None
+    return metrics.snapshot() if metrics is not None else None
+
+
+def get_metrics(reset: bool = False):
+    """
+        Сводка инструментирования: количество вызовов по точкам входа и результатам,
+        ошибки декодирования по этапу и типу исключения, форматы, прочитанные байты,
+        размеры изображений и времена этапов (count, total_ms, mean_us, max_us)
+        args:
+            reset: сбросить счетчики после получения сводки
+        returns:
+            dict - сводка
+            None - если инструментирование выключено
+    """
+
+    metrics = _METRICS
+    if metrics is None:
+        return None
+    snapshot = metrics.snapshot()
+    if reset:
+        metrics.reset()
+    return snapshot
+
+
+def _get_measured(metrics: _Metrics, entry: str, read, get_image, get_hash=None):
+    """
+        Вызов точки входа с замером этапов - путь при включенном инструментировании
+        Здесь замеряются только чтение и разбор заголовка; остальные этапы отмечают функции обычного пути
+        (_get_resized_image, _get_image_hashes, _get_image_hash с аргументом metrics), поэтому хэши совпадают
+        args:
+            metrics: объект _Metrics
+            entry: имя точки входа
+            read: функция без аргументов, возвращающая байты файла или файловый объект
+            get_image: функция от открытого PIL.Image - ошибки перехватываются, как в обычном пути
+            get_hash: функция от результата get_image - ошибки не перехватываются, как в обычном пути
+        returns:
+            результат get_hash (или get_image)
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    import io
+    from PIL import Image
+
+    record = metrics.start(entry)
+    start = metrics.clock()
+    try:
+        metrics.begin('read')
+        data = read()
+        if hasattr(data, 'read'):
+            fileobj = data
+            _check_file_bytes(fileobj)
+        else:
+            record['bytes'] = len(data)
+            _check_bytes(len(data))
+            fileobj = io.BytesIO(data) if isinstance(data, bytes) else _BufferReader(data)
+
+        metrics.begin('open')
+        img = Image.open(fileobj)
+        record.update(format=img.format, mode=img.mode, width=img.size[0], height=img.size[1])
+
+        result = get_image(img)
+        if not record['bytes']:
+            try:
+                record['bytes'] = fileobj.tell()
+            except Exception:
+                pass
+    except _LimitExceeded as error:
+        record.update(result='limit', error=str(error), stage=metrics.get_stage())
+        metrics.finish(record, start)
+        return LIMIT_EXCEEDED
+    except BaseException as error:
+        record.update(result='error', error=type(error).__name__, stage=metrics.get_stage())
+        metrics.finish(record, start)
+        return 0
+
+    if get_hash is not None:
+        try:
+            result = get_hash(result)
+        except BaseException as error:
+            record.update(result='error', error=type(error).__name__, stage=metrics.get_stage())
+            metrics.finish(record, start)
+            raise
+
+    metrics.finish(record, start)
+    return result
+
+
+def _get_image_hash_measured(metrics: _Metrics, entry: str, read, size: int, color_format: str,
+                             color_format_code: int, hash_version: int = 1, fast_decode: bool = False,
+                             preprocess: int = 0):
+    """
+        Хэширование одного формата с замером этапов (см. _get_measured)
+        args:
+            color_format: режим изображения PIL
+        returns:
+            bytearray(bytea) - Перцептивный хэш
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    return _get_measured(
+                metrics, entry, read,
+                lambda img: _get_resized_image(
+                                img, _get_resize_size(size, color_format_code), color_format, fast_decode, preprocess,
+                                metrics
+                            ),
+                lambda img: _get_image_hash(img, color_format_code, hash_version, metrics)
+            )
+
+
+def _get_image_hashes_measured(metrics: _Metrics, entry: str, read, formats: list, hash_version: int = 1,
+                               fast_decode: bool = False, preprocess: int = 0):
+    """
+        Набор хэшей за одно декодирование с замером этапов (см. _get_measured)
+        returns:
+            dict - {(формат цвета, размер сжатия): bytearray(bytea)}
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    return _get_measured(
+                metrics, entry, read,
+                lambda img: _get_image_hashes(img, formats, hash_version, fast_decode, preprocess, metrics)
+            )
+
+
+@_limited
+def get_image_hash_bypath(filepath: str, size: int, color_format: str = 'bnw', hash_version: int = 1, fast_decode: bool = False, preprocess: int = 0):
+    """
+        Генерация перцептивного хэша изображения по пути в файловой системе
+        args:
+            filepath: путь до файла
+            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
+            color_format: 
+                            'bnw' - Ч/Б формат
+                            'grs' - Оттенки серого
+                            'RGB' - Цветной формат
+                            'dhash' - Разностный хэш
+                            'phash' - Перцептивный хэш на основе DCT
+            hash_version: версия формата хэша:
+                            1 - исходный формат (по умолчанию)
+                            2 - компактный формат с размером в заголовке
+            fast_decode: декодирование в уменьшенном разрешении (draft для JPEG, reduce для остальных)
+                            False - полное декодирование, хэш совпадает с прежним (по умолчанию)
+                            True - быстрее и экономнее по памяти, хэш может отличаться на несколько бит
+            preprocess: нормализация изображения перед сжатием - сумма флагов PREPROCESS_*:
+                            PREPROCESS_EXIF - поворот по тегу EXIF Orientation
+                            PREPROCESS_ALPHA - наложение прозрачности на белый фон
+                            PREPROCESS_AUTOCROP - обрезка однотонных полей
+                            PREPROCESS_EQUALIZE - выравнивание гистограммы
+                            0 - без нормализации, хэш совпадает с прежним (по умолчанию)
+        returns:
+            bytearray(bytea) - Перцептивный хэш
+            None(NULL) - Если файл не существует
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    # Проверка на корректный путь до файла
+    import os
+    if not os.path.exists(filepath): 
+        # Если не существует -- вернуть None(NULL)
+        if _METRICS is not None:
+            _METRICS.add_missing('bypath')
+        return None
+
+    # Импорт модулей
+    import io
+    from PIL import Image
+
+    # Настройка параметров формата хэша
+    color_format, color_format_code = _get_color_format_params(color_format)
+
+    # Загрузка файла
+    with open(filepath, 'rb') as fr:
+        if _METRICS is not None:
+            return _get_image_hash_measured(
+                        _METRICS, 'bypath', lambda: _read_file(fr), size, color_format, color_format_code, hash_version,
+                        fast_decode, preprocess
+                    )
+        try:
+            img_to_analize = _get_resized_image(
+                Image.open(                                   # 3. Create Image object
+                        io.BytesIO(                           # 2. Create BytesIO format
+                                _read_file(fr)                # 1. Read file
+                                )
+                        ),
+                _get_resize_size(size, color_format_code),    # 4. Resize Image
+                color_format,                                 # 5. Convert to color format
+                fast_decode,                                  # 0. Reduced decoding (draft/reduce)
+                preprocess                                    # 0. Normalization (exif/alpha/crop/equalize)
+            )
+        except _LimitExceeded:
+            return LIMIT_EXCEEDED
+        except:
+            return 0
+
+    return _get_image_hash(img_to_analize, color_format_code, hash_version)
+
+
+@_limited
+def get_image_hash_byurl(url: str, size: int, color_format: str = 'bnw', hash_version: int = 1, fast_decode: bool = False, preprocess: int = 0):
+    """
+        Генерация перцептивного хэша изображения по простому url
+        args:
+            url: ссылка на файл
+            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
+            color_format: 
+                            'bnw' - Ч/Б формат
+                            'grs' - Оттенки серого
+                            'RGB' - Цветной формат
+                            'dhash' - Разностный хэш
+                            'phash' - Перцептивный хэш на основе DCT
+            hash_version: версия формата хэша:
+                            1 - исходный формат (по умолчанию)
+                            2 - компактный формат с размером в заголовке
+            fast_decode: декодирование в уменьшенном разрешении (draft для JPEG, reduce для остальных)
+                            False - полное декодирование, хэш совпадает с прежним (по умолчанию)
+                            True - быстрее и экономнее по памяти, хэш может отличаться на несколько бит
+            preprocess: нормализация изображения (см. get_image_hash_bypath)
+        returns:
+            bytearray(bytea) - Перцептивный хэш
+            None(NULL) - Если файл не существует
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    # Импорт модулей
+    import io
+    from PIL import Image
+
+    # Настройка параметров формата хэша
+    color_format, color_format_code = _get_color_format_params(color_format)
+
+    if _METRICS is not None:
+        return _get_image_hash_measured(
+                    _METRICS, 'byurl', lambda: _get_url_content(url), size, color_format, color_format_code,
+                    hash_version, fast_decode, preprocess
+                )
+
+    # Загрузка файла
+    try:
+        img_to_analize = _get_resized_image(
+            Image.open(                                   # 3. Create Image object
+                    io.BytesIO(                           # 2. Create BytesIO format
+                            _get_url_content(url)         # 1. Read file
+                            )
+                    ),
+            _get_resize_size(size, color_format_code),    # 4. Resize Image
+            color_format,                                 # 5. Convert to color format
+            fast_decode,                                  # 0. Reduced decoding (draft/reduce)
+            preprocess                                    # 0. Normalization (exif/alpha/crop/equalize)
+        )
+    except _LimitExceeded:
+        return LIMIT_EXCEEDED
+    except:
+        return 0
+
+    return _get_image_hash(img_to_analize, color_format_code, hash_version)
+
+
+@_limited
+def get_image_hash_byrequest(domain: str, qpath:str, method: str, payload:str, schema:str, size: int, color_format: str = 'bnw', hash_version: int = 1, fast_decode: bool = False, preprocess: int = 0):
+    """
+        Генерация перцептивного хэша изображения по сложносоставному запросу
+        args:
+            domain: доменное имя
+            qpath: путь ссылки
+            method: метод запроса - GET/POST
+            payload: полезнаая нагрузка запроса
+            schema: http/https/ws
+            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
+            color_format: 
+                            'bnw' - Ч/Б формат
+                            'grs' - Оттенки серого
+                            'RGB' - Цветной формат
+                            'dhash' - Разностный хэш
+                            'phash' - Перцептивный хэш на основе DCT
+            hash_version: версия формата хэша:
+                            1 - исходный формат (по умолчанию)
+                            2 - компактный формат с размером в заголовке
+            fast_decode: декодирование в уменьшенном разрешении (draft для JPEG, reduce для остальных)
+                            False - полное декодирование, хэш совпадает с прежним (по умолчанию)
+                            True - быстрее и экономнее по памяти, хэш может отличаться на несколько бит
+            preprocess: нормализация изображения (см. get_image_hash_bypath)
+        returns:
+            bytearray(bytea) - Перцептивный хэш
+            None(NULL) - Если файл не существует
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    # Импорт модулей
+    import io
+    from PIL import Image
+
+    # Настройка параметров формата хэша
+    color_format, color_format_code = _get_color_format_params(color_format)
+
+    if _METRICS is not None:
+        def read():
+            return _get_request_content(domain, qpath, method, payload, schema)
+
+        return _get_image_hash_measured(
+                    _METRICS, 'byrequest', read, size, color_format, color_format_code, hash_version, fast_decode,
+                    preprocess
+                )
+
+    # Загрузка файла
+    try:
+        img_to_analize = _get_resized_image(
+            Image.open(                                   # 3. Create Image object
+                    io.BytesIO(                           # 2. Create BytesIO format
+                            _get_request_content(         # 1. Read file
+                                domain, qpath, method, payload, schema
+                            )
+                            )
+                    ),
+            _get_resize_size(size, color_format_code),    # 4. Resize Image
+            color_format,                                 # 5. Convert to color format
+            fast_decode,                                  # 0. Reduced decoding (draft/reduce)
+            preprocess                                    # 0. Normalization (exif/alpha/crop/equalize)
+        )
+    except _LimitExceeded:
+        return LIMIT_EXCEEDED
+    except:
+        return 0
+
+    return _get_image_hash(img_to_analize, color_format_code, hash_version)
+
+
+@_limited
+def get_image_hash_bybase64(base64str: str, size: int, color_format: str = 'bnw', hash_version: int = 1, fast_decode: bool = False, preprocess: int = 0):
+    """
+        Генерация перцептивного хэша изображения из base64
+        args:
+            base64str: строка изображения в base64
+            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
+            color_format: 
+                            'bnw' - Ч/Б формат
+                            'grs' - Оттенки серого
+                            'RGB' - Цветной формат
+                            'dhash' - Разностный хэш
+                            'phash' - Перцептивный хэш на основе DCT
+            hash_version: версия формата хэша:
+                            1 - исходный формат (по умолчанию)
+                            2 - компактный формат с размером в заголовке
+            fast_decode: декодирование в уменьшенном разрешении (draft для JPEG, reduce для остальных)
+                            False - полное декодирование, хэш совпадает с прежним (по умолчанию)
+                            True - быстрее и экономнее по памяти, хэш может отличаться на несколько бит
+            preprocess: нормализация изображения (см. get_image_hash_bypath)
+        returns:
+            bytearray(bytea) - Перцептивный хэш
+            None(NULL) - Если файл не существует
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    # Импорт модулей
+    import io
+    from base64 import b64decode
+    from PIL import Image
+
+    # Настройка параметров формата хэша
+    color_format, color_format_code = _get_color_format_params(color_format)
+
+    if _METRICS is not None:
+        return _get_image_hash_measured(
+                    _METRICS, 'bybase64', lambda: b64decode(base64str), size, color_format, color_format_code,
+                    hash_version, fast_decode, preprocess
+                )
+
+    # Размер декодированных данных - 3/4 длины текста base64
+    if _LIMIT_BYTES and len(base64str) * 3 // 4 > _LIMIT_BYTES:
+        return LIMIT_EXCEEDED
+
+    # Загрузка файла
+    try:
+        img_to_analize = _get_resized_image(
+            Image.open(                                   # 3. Create Image object
+                    io.BytesIO(                           # 2. Create BytesIO format
+                            b64decode(base64str)          # 1. Read file
+                            )
+                    ),
+            _get_resize_size(size, color_format_code),    # 4. Resize Image
+            color_format,                                 # 5. Convert to color format
+            fast_decode,                                  # 0. Reduced decoding (draft/reduce)
+            preprocess                                    # 0. Normalization (exif/alpha/crop/equalize)
+        )
+    except _LimitExceeded:
+        return LIMIT_EXCEEDED
+    except:
+        return 0
+
+    return _get_image_hash(img_to_analize, color_format_code, hash_version)
+
+
+class _BufferReader:
+    """
+        Файловый объект только для чтения поверх буфера (bytes/bytearray/memoryview/bytea) без копирования
+        Копируются только запрошенные при чтении части
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast('B')
+        self._position = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset: int, whence: int = 0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += len(self._view)
+        self._position = max(offset, 0)
+        return self._position
+
+    def read(self, count: int = -1):
+        end = len(self._view) if count is None or count < 0 else min(self._position + count, len(self._view))
+        chunk = bytes(self._view[self._position:end])
+        self._position = max(end, self._position)
+        return chunk
+
+    def readline(self, count: int = -1):
+        # Нужен модулям PIL, проверяющим текстовый заголовок (например, IM) при подборе формата
+        end = len(self._view) if count is None or count < 0 else min(self._position + count, len(self._view))
+        line = bytearray()
+        while self._position < end:
+            chunk = bytes(self._view[self._position:min(self._position + 1024, end)])
+            newline = chunk.find(b'\n')
+            if newline >= 0:
+                chunk = chunk[:newline + 1]
+            line += chunk
+            self._position += len(chunk)
+            if newline >= 0:
+                break
+        return bytes(line)
+
+    def close(self):
+        self._view.release()
+
+
+@_limited
+def get_image_hash_bybytes(data, size: int, color_format: str = 'bnw', hash_version: int = 1, fast_decode: bool = False, preprocess: int = 0):
+    """
+        Генерация перцептивного хэша изображения из байтов файла без промежуточных копий
+        args:
+            data: содержимое файла - bytes / bytearray / memoryview / bytea
+            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
+            color_format: 
+                            'bnw' - Ч/Б формат
+                            'grs' - Оттенки серого
+                            'RGB' - Цветной формат
+                            'dhash' - Разностный хэш
+                            'phash' - Перцептивный хэш на основе DCT
+            hash_version: версия формата хэша (1 или 2)
+            fast_decode: декодирование в уменьшенном разрешении (см. get_image_hash_bypath)
+            preprocess: нормализация изображения (см. get_image_hash_bypath)
+        returns:
+            bytearray(bytea) - Перцептивный хэш
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    if _METRICS is not None:
+        return _get_image_hash_measured(
+                    _METRICS, 'bybytes', lambda: data, size, *_get_color_format_params(color_format), hash_version,
+                    fast_decode, preprocess
+                )
+
+    # Недопустимый тип данных (не буфер) - ошибка чтения, как в остальных get_image_hash_by*
+    try:
+        fileobj = _BufferReader(data)
+    except:
+        return 0
+
+    if _LIMIT_BYTES and len(fileobj) > _LIMIT_BYTES:
+        return LIMIT_EXCEEDED
+
+    return get_image_hash_byfile(fileobj, size, color_format, hash_version, fast_decode, preprocess)
+
+
+@_limited
+def get_image_hash_byfile(fileobj, size: int, color_format: str = 'bnw', hash_version: int = 1, fast_decode: bool = False, preprocess: int = 0):
+    """
+        Генерация перцептивного хэша изображения из открытого файлового объекта
+        args:
+            fileobj: файловый объект в бинарном режиме (read/seek/tell);
+                     несжимаемый поток без seek PIL прочитает в память целиком
+            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
+            color_format: 
+                            'bnw' - Ч/Б формат
+                            'grs' - Оттенки серого
+                            'RGB' - Цветной формат
+                            'dhash' - Разностный хэш
+                            'phash' - Перцептивный хэш на основе DCT
+            hash_version: версия формата хэша (1 или 2)
+            fast_decode: декодирование в уменьшенном разрешении (см. get_image_hash_bypath)
+            preprocess: нормализация изображения (см. get_image_hash_bypath)
+        returns:
+            bytearray(bytea) - Перцептивный хэш
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    from PIL import Image
+
+    # Настройка параметров формата хэша
+    color_format, color_format_code = _get_color_format_params(color_format)
+
+    if _METRICS is not None:
+        return _get_image_hash_measured(
+                    _METRICS, 'byfile', lambda: fileobj, size, color_format, color_format_code, hash_version,
+                    fast_decode, preprocess
+                )
+
+    try:
+        _check_file_bytes(fileobj)
+        img_to_analize = _get_resized_image(
+                            Image.open(fileobj), _get_resize_size(size, color_format_code), color_format, fast_decode,
+                            preprocess
+                        )
+    except _LimitExceeded:
+        return LIMIT_EXCEEDED
+    except:
+        return 0
+
+    return _get_image_hash(img_to_analize, color_format_code, hash_version)
+
+
+# Размер части текста base64 для потокового декодирования (кратен 4)
+_BASE64_CHUNK_SIZE = 64 * 1024
+
+# Таблица замены символов URL-safe алфавита base64 (-_) на символы стандартного (+/)
+_BASE64_URLSAFE_TABLE = bytes.maketrans(b'-_', b'+/')
+
+# Символы, удаляемые перед декодированием: вне стандартного и URL-safe алфавитов (переводы строк, пробелы и т.п.)
+_BASE64_DELETE_CHARS = bytes(
+    set(range(256)) - set(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=-_')
+)
+
+
+def _iter_base64_chunks(base64data, chunk_size: int = _BASE64_CHUNK_SIZE):
+    """
+        Обход текста base64 частями
+        args:
+            base64data: str / bytes / memoryview, файловый объект (read) или итерируемый объект частей
+        yields:
+            bytes / memoryview - часть текста base64 в кодировке ascii
+    """
+
+    if isinstance(base64data, str):
+        for start in range(0, len(base64data), chunk_size):
+            yield base64data[start:start + chunk_size].encode('ascii')
+    elif isinstance(base64data, (bytes, bytearray, memoryview)):
+        view = memoryview(base64data).cast('B')
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+    elif hasattr(base64data, 'read'):
+        while True:
+            chunk = base64data.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk.encode('ascii') if isinstance(chunk, str) else chunk
+    else:
+        for chunk in base64data:
+            yield chunk.encode('ascii') if isinstance(chunk, str) else chunk
+
+
+def _decode_base64_stream(base64data, chunk_size: int = _BASE64_CHUNK_SIZE):
+    """
+        Потоковое декодирование base64 частями - без копии всего текста в ascii
+        и без лишних копий декодированных байтов
+        Принимаются стандартный и URL-safe (-_) алфавиты; прочие символы (переводы строк, пробелы) пропускаются
+        returns:
+            bytearray - декодированные байты
+    """
+
+    from binascii import a2b_base64
+
+    decoded = bytearray()
+    tail = b''
+    for chunk in _iter_base64_chunks(base64data, chunk_size):
+        # Символы вне алфавита удаляются, URL-safe символы заменяются стандартными,
+        #   неполная четверка символов переносится в следующую часть
+        chunk = tail + bytes(chunk).translate(_BASE64_URLSAFE_TABLE, _BASE64_DELETE_CHARS)
+        count_full = len(chunk) - len(chunk) % 4
+        decoded += a2b_base64(chunk[:count_full])
+        tail = chunk[count_full:]
+        _check_bytes(len(decoded))
+        _check_deadline()
+    if tail:
+        decoded += a2b_base64(tail + b'=' * (-len(tail) % 4))
+
+    return decoded
+
+
+@_limited
+def get_image_hash_bybase64_stream(base64data, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                                   fast_decode: bool = False, preprocess: int = 0):
+    """
+        Генерация перцептивного хэша изображения из большого текста base64 с потоковым декодированием
+        args:
+            base64data: текст base64 - str / bytes / memoryview,
+                        файловый объект (read) или итерируемый объект частей (например, из курсора БД)
+            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
+            color_format: 
+                            'bnw' - Ч/Б формат
+                            'grs' - Оттенки серого
+                            'RGB' - Цветной формат
+                            'dhash' - Разностный хэш
+                            'phash' - Перцептивный хэш на основе DCT
+            hash_version: версия формата хэша (1 или 2)
+            fast_decode: декодирование в уменьшенном разрешении (см. get_image_hash_bypath)
+            preprocess: нормализация изображения (см. get_image_hash_bypath)
+        returns:
+            bytearray(bytea) - Перцептивный хэш
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    if _METRICS is not None:
+        return _get_image_hash_measured(
+                    _METRICS, 'bybase64_stream', lambda: _decode_base64_stream(base64data), size,
+                    *_get_color_format_params(color_format), hash_version, fast_decode, preprocess
+                )
+
+    try:
+        data = _decode_base64_stream(base64data)
+    except _LimitExceeded:
+        return LIMIT_EXCEEDED
+    except:
+        return 0
+
+    return get_image_hash_bybytes(data, size, color_format, hash_version, fast_decode, preprocess)
+
+
+def _get_image_hashes(img, formats: list, hash_version: int = 1, fast_decode: bool = False, preprocess: int = 0,
+                      metrics=None):
+    """
+        Генерация набора перцептивных хэшей из одного декодированного изображения
+        Изображение декодируется один раз, сжимается один раз на каждый размер сжатого изображения,
+        а для каждого формата цвета конвертируется уже сжатое изображение -
+        так же, как в get_image_hash_bypath, поэтому хэши совпадают с отдельными вызовами
+        args:
+            img: открытый объект PIL.Image (еще не декодированный)
+            formats: список пар (формат цвета, размер сжатия)
+            hash_version: версия формата хэша (1 или 2)
+            fast_decode: декодирование в уменьшенном разрешении для наибольшего размера
+            preprocess: нормализация изображения (см. get_image_hash_bypath)
+            metrics: объект _Metrics при инструментировании (см. _get_resized_image)
+        returns:
+            dict - {(формат цвета, размер сжатия): bytearray(bytea)}
+    """
+
+    formats = list(dict.fromkeys((color_format, size) for color_format, size in formats))
+    if not formats:
+        return {}
+
+    params = {
+        (color_format, size): _get_color_format_params(color_format) for color_format, size in formats
+    }
+    resize_sizes = {key: _get_resize_size(key[1], code) for key, (_, code) in params.items()}
+
+    if metrics is not None:
+        metrics.begin('decode')
+    img = _get_decoded_image(
+            img, max(max(resize_size) for resize_size in resize_sizes.values()), fast_decode, preprocess
+        )
+    img.load()
+    _check_deadline()
+    if preprocess:
+        if metrics is not None:
+            metrics.begin('preprocess')
+        img = _get_preprocessed_image(img, preprocess)
+
+    hashes = {}
+    sources = {}
+    resized = {}
+    for key, (mode, color_format_code) in params.items():
+        resize_mode = _get_resize_mode(img.mode, mode)
+        resized_key = (resize_sizes[key], resize_mode)
+        if resized_key not in resized:
+            if metrics is not None:
+                metrics.begin('resize')
+            if resize_mode not in sources:
+                sources[resize_mode] = _get_resize_source(img, mode)
+            resized[resized_key] = _get_scaled_image(sources[resize_mode], resize_sizes[key])
+        if metrics is not None:
+            metrics.begin('convert')
+        converted = _get_converted_image(resized[resized_key], mode)
+        hashes[key] = _get_image_hash(converted, color_format_code, hash_version, metrics)
+
+    return hashes
+
+
+@_limited
+def get_image_hashes_bypath(filepath: str, formats: list, hash_version: int = 1, fast_decode: bool = False, preprocess: int = 0):
+    """
+        Генерация набора перцептивных хэшей изображения по пути в файловой системе за одно декодирование
+        args:
+            filepath: путь до файла
+            formats: список пар (формат цвета, размер сжатия), например
+                        [('bnw', 8), ('grs', 16), ('rgb', 32)]
+            hash_version: версия формата хэша (1 или 2)
+            fast_decode: декодирование в уменьшенном разрешении для наибольшего размера
+            preprocess: нормализация изображения (см. get_image_hash_bypath)
+                         (хэши меньших размеров могут отличаться от отдельных вызовов)
+        returns:
+            dict - {(формат цвета, размер сжатия): bytearray(bytea)} - хэши совпадают
+                   с результатами get_image_hash_bypath для каждой пары
+            None(NULL) - Если файл не существует
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    # Проверка на корректный путь до файла
+    import os
+    if not os.path.exists(filepath):
+        if _METRICS is not None:
+            _METRICS.add_missing('hashes_bypath')
+        return None
+
+    import io
+    from PIL import Image
+
+    with open(filepath, 'rb') as fr:
+        if _METRICS is not None:
+            return _get_image_hashes_measured(
+                        _METRICS, 'hashes_bypath', lambda: _read_file(fr), formats, hash_version, fast_decode, preprocess
+                    )
+        try:
+            return _get_image_hashes(Image.open(io.BytesIO(_read_file(fr))), formats, hash_version, fast_decode, preprocess)
+        except _LimitExceeded:
+            return LIMIT_EXCEEDED
+        except:
+            return 0
+
+
+@_limited
+def get_image_hashes_bybase64(base64str: str, formats: list, hash_version: int = 1, fast_decode: bool = False, preprocess: int = 0):
+    """
+        Генерация набора перцептивных хэшей изображения из base64 за одно декодирование
+        args:
+            base64str: строка изображения в base64
+            formats: список пар (формат цвета, размер сжатия)
+            hash_version: версия формата хэша (1 или 2)
+            fast_decode: декодирование в уменьшенном разрешении для наибольшего размера
+            preprocess: нормализация изображения (см. get_image_hash_bypath)
+        returns:
+            dict - {(формат цвета, размер сжатия): bytearray(bytea)}
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    import io
+    from base64 import b64decode
+    from PIL import Image
+
+    if _METRICS is not None:
+        return _get_image_hashes_measured(
+                    _METRICS, 'hashes_bybase64', lambda: b64decode(base64str), formats, hash_version, fast_decode,
+                    preprocess
+                )
+
+    if _LIMIT_BYTES and len(base64str) * 3 // 4 > _LIMIT_BYTES:
+        return LIMIT_EXCEEDED
+
+    try:
+        return _get_image_hashes(
+                    Image.open(io.BytesIO(b64decode(base64str))), formats, hash_version, fast_decode, preprocess
+                )
+    except _LimitExceeded:
+        return LIMIT_EXCEEDED
+    except:
+        return 0
+
+
+# Преобразования, меняющие местами оси изображения
+_SWAP_TRANSFORMS = ('ROTATE_90', 'ROTATE_270', 'TRANSPOSE', 'TRANSVERSE')
+
+
+def _get_dct_transform(coefficients: list, size: int, transform: str):
+    """
+        Коэффициенты DCT преобразованного изображения из коэффициентов исходного:
+        отражение по оси меняет знак нечетных частот этой оси, перестановка осей транспонирует матрицу
+    """
+
+    if transform is None:
+        return coefficients
+
+    # Направления осей после преобразования - по сетке 2 x 2: пиксели (0, 0), (1, 0), (0, 1)
+    (x0, y0), (x1, y1), (x2, y2) = [(source % 2, source // 2) for source in _get_transform_sources(2, transform)[:3]]
+    if y1 == y0:
+        # Без перестановки осей: C'(v, u) = (-1)^(u * flip_x + v * flip_y) * C(v, u)
+        sign_u, sign_v = (-1 if x1 < x0 else 1), (-1 if y2 < y0 else 1)
+        return [
+            coefficients[v * size + u] * sign_u ** u * sign_v ** v for v in range(size) for u in range(size)
+        ]
+    # С перестановкой осей: C'(v, u) = (-1)^(v * flip_y' + u * flip_x') * C(u, v)
+    sign_u, sign_v = (-1 if y1 < y0 else 1), (-1 if x2 < x0 else 1)
+    return [coefficients[u * size + v] * sign_u ** u * sign_v ** v for v in range(size) for u in range(size)]
+
+
+def _get_image_hash_transforms(img, size: int, color_format: str, color_format_code: int, hash_version: int = 1,
+                               fast_decode: bool = False, preprocess: int = 0):
+    """
+        Хэши 8 вариантов изображения (HASH_TRANSFORMS) за одно декодирование:
+            grs, rgb - перестановка бит хэша (get_hash_transforms)
+            phash - знаки и транспонирование коэффициентов одного DCT, порог по медиане для каждого варианта
+            bnw, dhash - отражения и повороты сжатой сетки до конвертации; неквадратная сетка dhash
+                    для вариантов с перестановкой осей сжимается второй раз в размер size x (size + 1)
+        args:
+            img: открытый объект PIL.Image (еще не декодированный)
+        returns:
+            list - 8 хэшей
+    """
+
+    from PIL import Image
+
+    resize_size = _get_resize_size(size, color_format_code)
+    img = _get_decoded_image(img, max(resize_size), fast_decode, preprocess)
+    img.load()
+    _check_deadline()
+    if preprocess:
+        img = _get_preprocessed_image(img, preprocess)
+    img = _get_resize_source(img, color_format)
+    resized = _get_scaled_image(img, resize_size)
+
+    if color_format_code == 5:
+        coefficients, size = _get_dct_coefficients(_get_converted_image(resized, color_format))
+        return [
+            _get_hash_from_bits(
+                _get_dct_bits(_get_dct_transform(coefficients, size, transform)), color_format_code, size, hash_version
+            )
+            for transform in HASH_TRANSFORMS
+        ]
+
+    if color_format_code in (1, 4):
+        swapped = resized if resize_size[0] == resize_size[1] else None
+        hashes = []
+        for transform in HASH_TRANSFORMS:
+            grid = resized
+            if transform in _SWAP_TRANSFORMS:
+                if swapped is None:
+                    swapped = _get_scaled_image(img, resize_size[::-1])
+                grid = swapped
+            if transform is not None:
+                grid = grid.transpose(getattr(Image.Transpose, transform))
+            hashes.append(_get_image_hash(_get_converted_image(grid, color_format), color_format_code, hash_version))
+        return hashes
+
+    return get_hash_transforms(
+        _get_image_hash(_get_converted_image(resized, color_format), color_format_code, hash_version)
+    )
+
+
+@_limited
+def get_image_hash_transforms_bypath(filepath: str, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                                     fast_decode: bool = False, preprocess: int = 0):
+    """
+        Хэши 8 вариантов изображения по пути в файловой системе (повороты и отражения, см. HASH_TRANSFORMS)
+        за одно декодирование - для поиска повернутых и отраженных копий по одному хранимому хэшу
+        (get_transform_hamming_distance(s))
+        Варианты могут отличаться на несколько бит от хэша преобразованного изображения
+        из-за округления при сжатии (сжатие идет по строкам, затем по столбцам);
+        'bnw' с дизерингом (режим совместимости set_resize_pipeline) отличается сильнее - до 15% бит
+        (36 из 256 для size 16): дизеринг распространяет ошибку вправо и вниз, и его направление
+        меняется вместе с преобразованием; без дизеринга (dither=False) - также несколько бит
+        args:
+            filepath: путь до файла
+            size, color_format, hash_version, fast_decode, preprocess: см. get_image_hash_bypath
+        returns:
+            list - 8 хэшей, первый совпадает с get_image_hash_bypath
+            None(NULL) - Если файл не существует
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    import os
+    if not os.path.exists(filepath):
+        return None
+
+    import io
+    from PIL import Image
+
+    color_format, color_format_code = _get_color_format_params(color_format)
+
+    with open(filepath, 'rb') as fr:
+        try:
+            return _get_image_hash_transforms(
+                        Image.open(io.BytesIO(_read_file(fr))), size, color_format, color_format_code, hash_version,
+                        fast_decode, preprocess
+                    )
+        except _LimitExceeded:
+            return LIMIT_EXCEEDED
+        except:
+            return 0
+
+
+@_limited
+def get_image_hash_transforms_bybytes(data, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                                      fast_decode: bool = False, preprocess: int = 0):
+    """
+        Хэши 8 вариантов изображения из байтов файла (см. get_image_hash_transforms_bypath)
+        returns:
+            list - 8 хэшей
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    from PIL import Image
+
+    color_format, color_format_code = _get_color_format_params(color_format)
+
+    try:
+        fileobj = _BufferReader(data)
+    except:
+        return 0
+
+    if _LIMIT_BYTES and len(fileobj) > _LIMIT_BYTES:
+        return LIMIT_EXCEEDED
+
+    try:
+        return _get_image_hash_transforms(
+                    Image.open(fileobj), size, color_format, color_format_code, hash_version,
+                    fast_decode, preprocess
+                )
+    except _LimitExceeded:
+        return LIMIT_EXCEEDED
+    except:
+        return 0
+
+
+def _get_image_frame_hashes(img, size: int, color_format: str, color_format_code: int, hash_version: int = 1,
+                            fast_decode: bool = False, preprocess: int = 0, stride: int = 1, max_frames: int = 0,
+                            keyframe_distance: int = 0):
+    """
+        Хэши кадров многокадрового изображения (GIF, APNG, WebP, TIFF, MPO) с выборкой
+        Кадры обходятся по одному через ImageSequence (seek) - в памяти только текущий кадр
+        и сжатые изображения; каждый кадр обрабатывается как в get_image_hash_bypath
+        args:
+            img: открытый объект PIL.Image (еще не декодированный)
+        returns:
+            tuple - (список (номер кадра, хэш), сигнатура последовательности)
+    """
+
+    from itertools import count
+    from PIL import ImageSequence
+
+    resize_size = _get_resize_size(size, color_format_code)
+    frames = ImageSequence.Iterator(img)
+    frame_hashes = []
+    previous = None
+    for index in count(0, max(stride, 1)):
+        try:
+            frame = frames[index]
+        except IndexError:
+            break
+        a = _get_image_hash(
+                _get_resized_image(frame, resize_size, color_format, fast_decode, preprocess), color_format_code,
+                hash_version
+            )
+
+        # Ключевые кадры - кадры, отличающиеся от предыдущего сохраненного больше чем на keyframe_distance бит
+        if previous is not None and keyframe_distance > 0 and get_hamming_distance(a, previous)[0] <= keyframe_distance:
+            continue
+        frame_hashes.append((index, a))
+        previous = a
+        if 0 < max_frames <= len(frame_hashes):
+            break
+
+    return frame_hashes, get_sequence_signature(frame_hashes)
+
+
+@_limited
+def get_image_frame_hashes_bypath(filepath: str, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                                  fast_decode: bool = False, preprocess: int = 0, stride: int = 1,
+                                  max_frames: int = 0, keyframe_distance: int = 0):
+    """
+        Хэши кадров анимации или многостраничного изображения по пути в файловой системе
+        Для однокадрового изображения - один кадр, хэш совпадает с get_image_hash_bypath
+        args:
+            filepath: путь до файла
+            size, color_format, hash_version, fast_decode, preprocess: см. get_image_hash_bypath
+            stride: шаг выборки кадров (1 - каждый кадр, 5 - каждый пятый)
+            max_frames: максимальное количество хэшей кадров (0 - без ограничения)
+            keyframe_distance: если > 0, кадр пропускается, если его хэш отличается от хэша
+                               предыдущего сохраненного кадра не больше чем на keyframe_distance бит
+        returns:
+            tuple - (список (номер кадра, bytearray(bytea)), сигнатура последовательности -
+                     см. get_sequence_signature)
+            None(NULL) - Если файл не существует
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    import os
+    if not os.path.exists(filepath):
+        return None
+
+    from PIL import Image
+
+    color_format, color_format_code = _get_color_format_params(color_format)
+
+    # Файл читается PIL по мере обхода кадров, а не целиком
+    with open(filepath, 'rb') as fr:
+        try:
+            _check_file_bytes(fr)
+            return _get_image_frame_hashes(
+                        Image.open(fr), size, color_format, color_format_code, hash_version, fast_decode, preprocess,
+                        stride, max_frames, keyframe_distance
+                    )
+        except _LimitExceeded:
+            return LIMIT_EXCEEDED
+        except:
+            return 0
+
+
+@_limited
+def get_image_frame_hashes_bybytes(data, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                                   fast_decode: bool = False, preprocess: int = 0, stride: int = 1,
+                                   max_frames: int = 0, keyframe_distance: int = 0):
+    """
+        Хэши кадров анимации или многостраничного изображения из байтов файла
+        (см. get_image_frame_hashes_bypath)
+        returns:
+            tuple - (список (номер кадра, bytearray(bytea)), сигнатура последовательности)
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    from PIL import Image
+
+    color_format, color_format_code = _get_color_format_params(color_format)
+
+    try:
+        fileobj = _BufferReader(data)
+    except:
+        return 0
+
+    if _LIMIT_BYTES and len(fileobj) > _LIMIT_BYTES:
+        return LIMIT_EXCEEDED
+
+    try:
+        return _get_image_frame_hashes(
+                    Image.open(fileobj), size, color_format, color_format_code, hash_version, fast_decode,
+                    preprocess, stride, max_frames, keyframe_distance
+                )
+    except _LimitExceeded:
+        return LIMIT_EXCEEDED
+    except:
+        return 0
+
+
+def _get_tile_boxes(width: int, height: int, grid: int, overlap: bool = True):
+    """
+        Области тайлов сетки grid x grid
+        При overlap тайлы сдвигаются на половину тайла - (2 * grid - 1)^2 тайлов, чтобы фрагмент,
+        не совпадающий с границами сетки, целиком попадал хотя бы в один тайл
+        yields:
+            tuple - (столбец, строка, (left, top, right, bottom)); столбец и строка - в шагах сдвига
+    """
+
+    tile_width = width / grid
+    tile_height = height / grid
+    steps = 2 * grid - 1 if overlap else grid
+    step_width = tile_width / 2 if overlap else tile_width
+    step_height = tile_height / 2 if overlap else tile_height
+    for row in range(steps):
+        for column in range(steps):
+            left = column * step_width
+            top = row * step_height
+            yield column, row, (left, top, left + tile_width, top + tile_height)
+
+
+def _get_image_tile_hashes(img, size: int, color_format: str, color_format_code: int, hash_version: int = 1,
+                           fast_decode: bool = False, preprocess: int = 0, grids: tuple = (1, 2, 4),
+                           overlap: bool = True):
+    """
+        Хэши тайлов изображения на нескольких масштабах сетки за одно декодирование
+        Тайл сжимается напрямую из области декодированного изображения (resize с box), без копирования
+        args:
+            img: открытый объект PIL.Image (еще не декодированный)
+        returns:
+            list - (размер сетки, столбец, строка, хэш); тайл сетки 1 совпадает с get_image_hash_bypath
+    """
+
+    resize_size = _get_resize_size(size, color_format_code)
+    # Каждый тайл самой мелкой сетки должен остаться не меньше size * _FAST_DECODE_FACTOR
+    img = _get_decoded_image(img, max(resize_size) * max(grids), fast_decode, preprocess)
+    img.load()
+    _check_deadline()
+    if preprocess:
+        img = _get_preprocessed_image(img, preprocess)
+    img = _get_resize_source(img, color_format)
+
+    tile_hashes = []
+    for grid in grids:
+        for column, row, box in _get_tile_boxes(img.size[0], img.size[1], grid, overlap):
+            tile_hashes.append((grid, column, row, _get_image_hash(
+                _get_converted_image(_get_scaled_image(img, resize_size, box), color_format), color_format_code,
+                hash_version
+            )))
+        _check_deadline()
+
+    return tile_hashes
+
+
+@_limited
+def get_image_tile_hashes_bypath(filepath: str, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                                 fast_decode: bool = False, preprocess: int = 0, grids: tuple = (1, 2, 4),
+                                 overlap: bool = True):
+    """
+        Хэши тайлов изображения по пути в файловой системе - для поиска фрагментов, кадрирования
+        и наложений (TileIndex, get_tile_similarity)
+        args:
+            filepath: путь до файла
+            size, color_format, hash_version, fast_decode, preprocess: см. get_image_hash_bypath
+            grids: размеры сеток (масштабы) - 1 - все изображение, 4 - сетка 4 x 4
+            overlap: тайлы с перекрытием на половину тайла ((2 * grid - 1)^2 тайлов на сетку)
+        returns:
+            list - (размер сетки, столбец, строка, bytearray(bytea)); при overlap столбец и строка -
+                   в половинах тайла
+            None(NULL) - Если файл не существует
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    import os
+    if not os.path.exists(filepath):
+        return None
+
+    import io
+    from PIL import Image
+
+    color_format, color_format_code = _get_color_format_params(color_format)
+
+    with open(filepath, 'rb') as fr:
+        try:
+            return _get_image_tile_hashes(
+                        Image.open(io.BytesIO(_read_file(fr))), size, color_format, color_format_code, hash_version,
+                        fast_decode, preprocess, grids, overlap
+                    )
+        except _LimitExceeded:
+            return LIMIT_EXCEEDED
+        except:
+            return 0
+
+
+@_limited
+def get_image_tile_hashes_bybytes(data, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                                  fast_decode: bool = False, preprocess: int = 0, grids: tuple = (1, 2, 4),
+                                  overlap: bool = True):
+    """
+        Хэши тайлов изображения из байтов файла (см. get_image_tile_hashes_bypath)
+        returns:
+            list - (размер сетки, столбец, строка, bytearray(bytea))
+            0 - Ошибка чтения файла
+            LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+    """
+
+    from PIL import Image
+
+    color_format, color_format_code = _get_color_format_params(color_format)
+
+    try:
+        fileobj = _BufferReader(data)
+    except:
+        return 0
+
+    if _LIMIT_BYTES and len(fileobj) > _LIMIT_BYTES:
+        return LIMIT_EXCEEDED
+
+    try:
+        return _get_image_tile_hashes(
+                    Image.open(fileobj), size, color_format, color_format_code, hash_version, fast_decode,
+                    preprocess, grids, overlap
+                )
+    except _LimitExceeded:
+        return LIMIT_EXCEEDED
+    except:
+        return 0
+
+
+# Расширения файлов изображений для пакетного хэширования директорий
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def _iter_image_paths(paths, extensions: tuple = IMAGE_EXTENSIONS, recursive: bool = True):
+    """
+        Обход путей к файлам: директория раскрывается в файлы с подходящим расширением,
+        пути к файлам из списка возвращаются без фильтрации
+        args:
+            paths: путь до директории/файла или список путей
+            extensions: допустимые расширения файлов в директориях (в нижнем регистре)
+            recursive: обходить поддиректории
+        yields:
+            str - путь до файла
+    """
+
+    import os
+
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        if recursive:
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if os.path.splitext(filename)[1].lower() in extensions:
+                        yield os.path.join(dirpath, filename)
+        else:
+            for filename in sorted(os.listdir(path)):
+                filepath = os.path.join(path, filename)
+                if os.path.isfile(filepath) and os.path.splitext(filename)[1].lower() in extensions:
+                    yield filepath
+
+
+def _get_worker_settings():
+    """
+        Настройки текущего процесса для процессов-обработчиков пула (initargs _set_worker_settings):
+        при запуске spawn/forkserver глобальные настройки модуля не наследуются
+    """
+
+    return get_resize_pipeline(), get_limits()
+
+
+def _set_worker_settings(pipeline: dict, limits: dict):
+    """
+        Применение настроек родительского процесса в процессе-обработчике (initializer пула)
+    """
+
+    set_resize_pipeline(**pipeline)
+    set_limits(**limits)
+
+
+def _get_image_hashes_chunk(filepaths: list, size: int, color_format: str, hash_version: int, fast_decode: bool,
+                            preprocess: int = 0):
+    """
+        Хэширование части списка файлов в процессе-обработчике
+        returns:
+            list - (путь до файла, результат get_image_hash_bypath)
+    """
+
+    return [
+        (filepath, get_image_hash_bypath(filepath, size, color_format, hash_version, fast_decode, preprocess))
+        for filepath in filepaths
+    ]
+
+
+def get_image_hash_bypaths(paths, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                           fast_decode: bool = False, workers: int = None, chunk_size: int = 16,
+                           extensions: tuple = IMAGE_EXTENSIONS, recursive: bool = True, preprocess: int = 0):
+    """
+        Параллельная генерация перцептивных хэшей для списка файлов и/или директорий
+        args:
+            paths: путь до директории/файла или список путей
+            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
+            color_format: 
+                            'bnw' - Ч/Б формат
+                            'grs' - Оттенки серого
+                            'RGB' - Цветной формат
+                            'dhash' - Разностный хэш
+                            'phash' - Перцептивный хэш на основе DCT
+            hash_version: версия формата хэша (1 или 2)
+            fast_decode: декодирование в уменьшенном разрешении (см. get_image_hash_bypath)
+            preprocess: нормализация изображения (см. get_image_hash_bypath)
+            workers: количество процессов (None - по числу ядер, <= 1 - без пула процессов;
+                     конвейер set_resize_pipeline и ограничения set_limits
+                     передаются процессам пула)
+            chunk_size: количество файлов, передаваемых процессу за раз
+            extensions: допустимые расширения файлов в директориях (в нижнем регистре)
+            recursive: обходить поддиректории
+        yields:
+            tuple - (путь до файла, результат как у get_image_hash_bypath):
+                        bytearray(bytea) - Перцептивный хэш
+                        None(NULL) - Если файл не существует
+                        0 - Ошибка чтения файла
+                        LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+            Результаты возвращаются по мере готовности, порядок не гарантируется
+    """
+
+    from itertools import islice
+
+    filepaths = _iter_image_paths(paths, extensions, recursive)
+
+    # Без пула процессов - последовательная обработка в текущем процессе
+    if workers is not None and workers <= 1:
+        for filepath in filepaths:
+            yield filepath, get_image_hash_bypath(filepath, size, color_format, hash_version, fast_decode, preprocess)
+        return
+
+    import os
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+    workers = workers or os.cpu_count() or 1
+    settings = _get_worker_settings()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_set_worker_settings, initargs=settings) as executor:
+        # Количество частей в обработке ограничено, чтобы не читать весь список путей заранее
+        max_pending = workers * 2
+        pending = set()
+        while True:
+            while len(pending) < max_pending:
+                chunk = list(islice(filepaths, chunk_size))
+                if not chunk:
+                    break
+                pending.add(
+                    executor.submit(
+                        _get_image_hashes_chunk, chunk, size, color_format, hash_version, fast_decode, preprocess
+                    )
+                )
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+
+class _HashSink:
+    """
+        Основа приемников результатов sync_image_hashes: файл открывается на дозапись,
+        так что файл накапливает журнал изменений всех синхронизаций
+        Приемником может быть любой объект с методом write(rows), где rows - список
+        (путь до файла, статус, хэш):
+            статус 'added' / 'changed' - bytearray(bytea), 'deleted' - None, 'error' - 0 / LIMIT_EXCEEDED
+    """
+
+    def __init__(self, file):
+        """
+            args:
+                file - путь до файла или открытый текстовый файловый объект
+        """
+
+        import os
+
+        self._owned = isinstance(file, (str, os.PathLike))
+        self._file = open(file, 'a', newline='', encoding='utf-8') if self._owned else file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+        else:
+            self._file.flush()
+
+    @staticmethod
+    def _get_hash_text(a):
+        return a.hex() if a.__class__ == bytearray else None
+
+
+class CsvHashSink(_HashSink):
+    """
+        Приемник результатов sync_image_hashes в CSV: path,status,hash (hex, пусто для deleted/error)
+        Заголовок пишется только в пустой файл или в поток без позиционирования (stdout, pipe)
+    """
+
+    def __init__(self, file):
+        import csv
+
+        super().__init__(file)
+        self._writer = csv.writer(self._file)
+        if not self._file.seekable() or self._file.tell() == 0:
+            self._writer.writerow(('path', 'status', 'hash'))
+
+    def write(self, rows: list):
+        self._writer.writerows((path, status, self._get_hash_text(a) or '') for path, status, a in rows)
+        self._file.flush()
+
+
+class JsonlHashSink(_HashSink):
+    """
+        Приемник результатов sync_image_hashes в JSON Lines: {"path", "status", "hash"} (hex или null)
+    """
+
+    def write(self, rows: list):
+        from json import dumps
+
+        self._file.write(''.join(
+            dumps({'path': path, 'status': status, 'hash': self._get_hash_text(a)}, ensure_ascii=False) + '\n'
+            for path, status, a in rows
+        ))
+        self._file.flush()
+
+
+def _get_sync_params(size: int, color_format: str, hash_version: int, fast_decode: bool, preprocess: int):
+    """
+        Строка параметров хэширования манифеста - при их изменении все файлы хэшируются заново
+    """
+
+    params = '%d:%d:%d:%d:%d' % (
+        size, _get_color_format_params(color_format)[1], hash_version, int(bool(fast_decode)), preprocess
+    )
+    # Код конвейера добавляется, только если он отличен от режима совместимости,
+    #   чтобы манифесты прежних версий оставались действительными
+    pipeline_code = _get_resize_pipeline_code()
+    return params + ':%d' % pipeline_code if pipeline_code else params
+
+
+def sync_image_hashes(paths, manifest_path: str, sink, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                      fast_decode: bool = False, preprocess: int = 0, workers: int = None, chunk_size: int = 16,
+                      batch_size: int = 1000, extensions: tuple = IMAGE_EXTENSIONS, recursive: bool = True):
+    """
+        Инкрементальная синхронизация хэшей директорий с приемником результатов
+        Дерево сравнивается с манифестом предыдущего запуска (путь, размер, mtime):
+        хэшируются только новые и измененные файлы (get_image_hash_bypaths - ограниченный пул процессов),
+        файлы манифеста, которых больше нет, передаются как удаленные
+        Результаты передаются приемнику частями по batch_size; манифест обновляется после
+        каждой части, поэтому прерванная синхронизация при повторе продолжается с места остановки
+        args:
+            paths: путь до директории/файла или список путей (все файлы манифеста должны быть под ними)
+            manifest_path: путь до файла манифеста SQLite (создается при первом запуске)
+            sink: приемник результатов - CsvHashSink, JsonlHashSink или любой объект с методом write(rows)
+            size, color_format, hash_version, fast_decode, preprocess: см. get_image_hash_bypath;
+                при изменении параметров все файлы передаются как измененные
+            workers, chunk_size, extensions, recursive: см. get_image_hash_bypaths
+            batch_size: количество результатов в одной части
+        returns:
+            dict - счетчики файлов {'added', 'changed', 'deleted', 'unchanged', 'errors'}
+                   (для файлов с ошибкой чтения, stat - кроме отсутствующего файла - или превышением
+                   ограничений set_limits запись манифеста не обновляется, и они повторяются
+                   при следующем запуске; файл, входящий в несколько путей paths, обрабатывается один раз)
+    """
+
+    import os
+    import sqlite3
+
+    connection = sqlite3.connect(manifest_path)
+    connection.executescript(
+        """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                file_size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS params (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """
+    )
+    params = _get_sync_params(size, color_format, hash_version, fast_decode, preprocess)
+    row = connection.execute("SELECT value FROM params WHERE name = 'hash'").fetchone()
+    if row is None or row[0] != params:
+        # При изменении параметров все записи помечаются устаревшими (размер -1) одной транзакцией
+        #   с новыми параметрами: прерванная синхронизация при повторе хэширует только необработанные файлы
+        with connection:
+            connection.execute("UPDATE files SET file_size = -1")
+            connection.execute("INSERT OR REPLACE INTO params VALUES ('hash', ?)", (params,))
+
+    # Записи манифеста, не найденные в дереве к концу обхода, - удаленные файлы
+    known = {path: (file_size, mtime_ns) for path, file_size, mtime_ns in connection.execute("SELECT * FROM files")}
+    counts = {'added': 0, 'changed': 0, 'deleted': 0, 'unchanged': 0, 'errors': 0}
+    pending = {}
+    # Файлы, для которых не удалось получить stat (кроме отсутствующих): ошибка, запись манифеста сохраняется
+    stat_errors = []
+
+    # Пути, уже обработанные обходом: один файл может входить в несколько путей paths
+    seen = set()
+
+    def iter_changed_paths():
+        for filepath in _iter_image_paths(paths, extensions, recursive):
+            key = os.path.normpath(os.fspath(filepath))
+            if key in seen:
+                continue
+            seen.add(key)
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                continue
+            except OSError:
+                known.pop(filepath, None)
+                stat_errors.append(filepath)
+                continue
+            entry = (stat.st_size, stat.st_mtime_ns)
+            previous = known.pop(filepath, None)
+            if previous == entry:
+                counts['unchanged'] += 1
+                continue
+            pending[filepath] = entry + ('added' if previous is None else 'changed',)
+            yield filepath
+
+    def flush(batch):
+        sink.write([(filepath, status, a) for filepath, status, a, _ in batch])
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                [(filepath,) + entry for filepath, status, _, entry in batch if status in ('added', 'changed')]
+            )
+            # При ошибке запись манифеста сохраняется: файл повторяется при следующем запуске как измененный
+            connection.executemany(
+                "DELETE FROM files WHERE path = ?",
+                [(filepath,) for filepath, status, _, _ in batch if status == 'deleted']
+            )
+        for filepath, status, _, _ in batch:
+            counts['errors' if status == 'error' else status] += 1
+        batch.clear()
+
+    batch = []
+    try:
+        for filepath, result in get_image_hash_bypaths(
+                                    iter_changed_paths(), size, color_format, hash_version, fast_decode, workers,
+                                    chunk_size, extensions, recursive, preprocess
+                                ):
+            file_size, mtime_ns, status = pending.pop(filepath)
+            if result is None:
+                # Файл удален во время синхронизации
+                if status == 'added':
+                    continue
+                status = 'deleted'
+            elif result in (0, LIMIT_EXCEEDED):
+                status = 'error'
+            batch.append((filepath, status, result, (file_size, mtime_ns)))
+            if len(batch) >= batch_size:
+                flush(batch)
+
+        for filepath in stat_errors:
+            batch.append((filepath, 'error', 0, None))
+            if len(batch) >= batch_size:
+                flush(batch)
+        for filepath in known:
+            batch.append((filepath, 'deleted', None, None))
+            if len(batch) >= batch_size:
+                flush(batch)
+        if batch:
+            flush(batch)
+    finally:
+        connection.close()
+
+    return counts
+
+
+# HTTP статусы, при которых загрузка повторяется
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _download_url(session, url: str, timeout: float, max_bytes: int):
+    """
+        Потоковая загрузка файла по url с ограничением размера
+        returns:
+            tuple - (HTTP статус, байты файла или None для статусов повтора)
+        raises:
+            _LimitExceeded - если файл больше max_bytes
+    """
+
+    with session.get(url, timeout=timeout, stream=True) as response:
+        if response.status_code in _RETRY_STATUSES:
+            return response.status_code, None
+
+        # Ранний отказ по заголовку Content-Length
+        content_length = response.headers.get('Content-Length', '')
+        if max_bytes > 0 and content_length.isdigit() and int(content_length) > max_bytes:
+            raise _LimitExceeded('max_bytes')
+
+        chunks = []
+        count_bytes = 0
+        for chunk in response.iter_content(chunk_size=65536):
+            count_bytes += len(chunk)
+            if max_bytes > 0 and count_bytes > max_bytes:
+                raise _LimitExceeded('max_bytes')
+            chunks.append(chunk)
+
+        return response.status_code, b''.join(chunks)
+
+
+async def get_image_hash_byurls_async(urls, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                                      fast_decode: bool = False, concurrency: int = 16, per_host: int = 4,
+                                      timeout: float = 10, retries: int = 2, backoff: float = 0.5,
+                                      max_bytes: int = 50 * 1024 * 1024, executor=None, preprocess: int = 0):
+    """
+        Асинхронная генерация перцептивных хэшей изображений по списку url
+        Загрузка идет через одну сессию requests с пулом keep-alive соединений,
+        декодирование и хэширование - в пуле обработчиков
+        args:
+            urls: итерируемый объект ссылок на файлы
+            size: размер сжатия изображения - >= 4 и должна быть одной из степени 2
+            color_format: 'bnw' / 'grs' / 'rgb'
+            hash_version: версия формата хэша (1 или 2)
+            fast_decode: декодирование в уменьшенном разрешении (см. get_image_hash_bypath)
+            preprocess: нормализация изображения (см. get_image_hash_bypath)
+            concurrency: максимальное количество одновременных загрузок
+            per_host: максимальное количество одновременных загрузок с одного хоста
+            timeout: таймаут соединения и чтения, секунд
+            retries: количество повторов при ошибке соединения, таймауте, статусе 429/5xx
+            backoff: пауза перед первым повтором, секунд (удваивается с каждым повтором)
+            max_bytes: максимальный размер файла (<= 0 - без ограничения; не больше max_bytes из set_limits)
+            executor: пул для декодирования и хэширования (например, ProcessPoolExecutor);
+                      None - пул потоков цикла событий по умолчанию
+        yields:
+            tuple - (url, результат как у get_image_hash_byurl):
+                        bytearray(bytea) - Перцептивный хэш
+                        0 - Ошибка загрузки или чтения файла
+                        LIMIT_EXCEEDED - Файл больше max_bytes или другое ограничение set_limits
+            Результаты возвращаются по мере готовности, порядок не гарантируется
+    """
+
+    import asyncio
+    from urllib.parse import urlsplit
+    from requests import Session, RequestException
+    from requests.adapters import HTTPAdapter
+
+    if _LIMIT_BYTES and (max_bytes <= 0 or max_bytes > _LIMIT_BYTES):
+        max_bytes = _LIMIT_BYTES
+
+    loop = asyncio.get_running_loop()
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    limit = asyncio.Semaphore(concurrency)
+    host_limits = {}
+
+    async def fetch_and_hash(url):
+        host = urlsplit(url).netloc
+        if host not in host_limits:
+            host_limits[host] = asyncio.Semaphore(per_host)
+
+        data = None
+        for attempt in range(retries + 1):
+            if attempt:
+                await asyncio.sleep(backoff * 2 ** (attempt - 1))
+            try:
+                async with host_limits[host], limit:
+                    status, data = await asyncio.to_thread(_download_url, session, url, timeout, max_bytes)
+            except RequestException:
+                continue
+            except _LimitExceeded:
+                return url, LIMIT_EXCEEDED
+            except Exception:
+                return url, 0
+            if status not in _RETRY_STATUSES:
+                break
+            data = None
+
+        if data is None:
+            return url, 0
+        return url, await loop.run_in_executor(
+                                executor, get_image_hash_bybytes, data, size, color_format, hash_version, fast_decode,
+                                preprocess
+                            )
+
+    urls = iter(urls)
+    pending = set()
+    try:
+        while True:
+            # Количество задач в обработке ограничено, чтобы не читать весь список ссылок заранее
+            for url in urls:
+                pending.add(asyncio.ensure_future(fetch_and_hash(url)))
+                if len(pending) >= concurrency * 2:
+                    break
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        session.close()
+
+
+def get_image_hash_byurls(urls, size: int, color_format: str = 'bnw', hash_version: int = 1, **kwargs):
+    """
+        Синхронная обертка над get_image_hash_byurls_async (аргументы те же)
+        yields:
+            tuple - (url, bytearray(bytea) / 0) по мере готовности
+    """
+
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    results = get_image_hash_byurls_async(urls, size, color_format, hash_version, **kwargs)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
+
+
+# Кэш количества значащих бит хэша по (код формата, версия, длина хэша)
+_HASH_COUNT_BITS_CACHE = {}
+
+
+def _get_hash_count_bits(a: bytearray):
+    """
+        Количество значащих бит хэша (с кэшированием по заголовку и длине)
+        returns:
+            int - количество бит
+            -1 - если хэш не распознан
+    """
+
+    key = (a[0], a[1], len(a)) if len(a) >= _HASH_V1_HEADER_LEN else None
+    count_bits = _HASH_COUNT_BITS_CACHE.get(key)
+    if count_bits is None:
+        header = _get_hash_header(a)
+        count_bits = header[3] if header is not None else -1
+        if key is not None:
+            _HASH_COUNT_BITS_CACHE[key] = count_bits
+    return count_bits
+
+
+def _get_hash_int(a: bytearray):
+    """
+        Приведение хэша любой версии к целому числу из значащих бит (порядок бит как в v2)
+        args:
+            a - хэш (bytea)
+        returns:
+            tuple - (код формата, размер сжатия, число, количество бит)
+            None - если хэш не распознан
+    """
+
+    header = _get_hash_header(a)
+    if header is None:
+        return None
+    version, color_format_code, size, count_bits = header
+
+    if version == HASH_VERSION_V2:
+        value = int.from_bytes(a[_HASH_V2_HEADER_LEN:], byteorder="big") >> (-count_bits % 8)
+    else:
+        # В v1 значащие байты - каждый второй, неполный последний байт выровнен вправо
+        packed = a[_HASH_V1_HEADER_LEN::2]
+        count_tail_bits = count_bits % 8
+        if count_tail_bits:
+            value = (int.from_bytes(packed[:-1], byteorder="big") << count_tail_bits) | packed[-1]
+        else:
+            value = int.from_bytes(packed, byteorder="big")
+
+    return color_format_code, size, value, count_bits
+
+
+# Связанный метод int.from_bytes для быстрого пути get_hamming_distance: поиск атрибута classmethod
+#   и разбор именованного byteorder на каждом вызове сопоставимы со временем самого преобразования
+_int_from_bytes = int.from_bytes
+
+# Разобранные заголовки для быстрого пути get_hamming_distance:
+#   (код формата, версия, длина хэша) -> (количество бит тела, количество значащих бит) или None
+_HASH_DISTANCE_HEADERS = {}
+
+
+def _get_distance_header(a: bytearray):
+    """
+        Количество бит тела и значащих бит хэша для быстрого пути (с кэшированием по заголовку и длине)
+    """
+
+    key = (a[0], a[1], len(a))
+    if key not in _HASH_DISTANCE_HEADERS:
+        header = _get_hash_header(a)
+        if header is None:
+            _HASH_DISTANCE_HEADERS[key] = None
+        else:
+            header_len = _HASH_V1_HEADER_LEN if header[0] == HASH_VERSION_V1 else _HASH_V2_HEADER_LEN
+            _HASH_DISTANCE_HEADERS[key] = ((len(a) - header_len) * 8, header[3])
+    return _HASH_DISTANCE_HEADERS[key]
+
+
+def get_hamming_distance(a: bytearray, b: bytearray):
+    """
+        Нахождение побитового расстояния Хэмминга для двух хэшей (XOR + popcount)
+        args:
+            a - bytearray 1 (хэш формата v1 или v2)
+            b - bytearray 2 (хэш формата v1 или v2)
+        returns:
+            -2 - для ошибки разных форматов хэшей
+            -1 - для ошибки размерности хэшей
+            tuple - (расстояние в битах, значение от 0 до 100) - где:
+                                        0 - разные изображения
+                                        100 - одинаковые изображения
+    """
+
+    # Быстрый путь - одинаковая длина: хэши сравниваются целиком как числа без разбора заголовка
+    #   и копирования тела; если после XOR в битах заголовка нули, заголовки совпадают,
+    #   а нулевые байты v1 не влияют на XOR
+    count_bytes = len(a)
+    if count_bytes == len(b) and count_bytes > _HASH_V1_HEADER_LEN:
+        header = _HASH_DISTANCE_HEADERS.get((a[0], a[1], count_bytes)) or _get_distance_header(a)
+        xor = _int_from_bytes(a, "big") ^ _int_from_bytes(b, "big")
+        if header is not None and not xor >> header[0]:
+            distance = xor.bit_count()
+            return distance, 100 - (distance / header[1]) * 100
+
+    # Хэши разных версий или размеров - приведение к числам из значащих бит
+    a_int = _get_hash_int(a)
+    b_int = _get_hash_int(b)
+
+    # Проверка на форматы хэшей
+    if a_int is None or b_int is None or a_int[0] != b_int[0]: return -2
+
+    # Проверка на размерность хэшей
+    if a_int[1] != b_int[1]: return -1
+
+    distance = (a_int[2] ^ b_int[2]).bit_count()
+    return distance, 100 - (distance / a_int[3]) * 100
+
+
+# Количество строк, обрабатываемых за один проход XOR в пакетных функциях
+_BATCH_ROWS_PER_BLOCK = 65536
+
+
+def _get_hash_layout(a: bytearray):
+    """
+        Раскладка хэша для пакетного сравнения
+        returns:
+            tuple - (байты заголовка, длина хэша, количество значащих бит)
+            None - если хэш не распознан
+    """
+
+    count_bits = _get_hash_count_bits(a)
+    if count_bits < 0:
+        return None
+    header_len = _HASH_V1_HEADER_LEN if a[1] == 0 else _HASH_V2_HEADER_LEN
+    return bytes(a[:header_len]), len(a), count_bits
+
+
+def _iter_packed_distances(packed, query_row: bytes, row_len: int, mask_row: bytes = None):
+    """
+        Побитовые расстояния Хэмминга от строки запроса до строк непрерывного массива, по блокам
+        args:
+            packed: буфер (bytes/memoryview/mmap) из строк по row_len байт
+            query_row: строка запроса (row_len байт)
+            row_len: длина строки в байтах
+            mask_row: маска строки (row_len байт) - биты с нулем маски не учитываются
+                      (например, id записи в файле хранилища); None - учитываются все биты
+        yields:
+            tuple - (номер первой строки блока, список расстояний в битах для строк блока)
+    """
+
+    from operator import add
+
+    block_len = _BATCH_ROWS_PER_BLOCK * row_len
+    end = len(packed) - len(packed) % row_len
+    # Строка запроса повторяется на длину блока (или всего массива, если он меньше блока)
+    count_rows = min(_BATCH_ROWS_PER_BLOCK, end // row_len)
+    query_block = int.from_bytes(query_row * count_rows, byteorder="little")
+    mask_block = int.from_bytes(mask_row * count_rows, byteorder="little") if mask_row else None
+    words_per_row = row_len // 8 if row_len % 8 == 0 else 0
+
+    for start in range(0, end, block_len):
+        block = packed[start:min(start + block_len, end)]
+        block_bytes = len(block)
+        if block_bytes != count_rows * row_len:
+            query_block = int.from_bytes(query_row * (block_bytes // row_len), byteorder="little")
+            if mask_row:
+                mask_block = int.from_bytes(mask_row * (block_bytes // row_len), byteorder="little")
+
+        # XOR (и маска) всего блока одной операцией над длинными числами
+        xored = int.from_bytes(block, byteorder="little") ^ query_block
+        if mask_block is not None:
+            xored &= mask_block
+        xored = xored.to_bytes(block_bytes, byteorder="little")
+
+        # Popcount по 64-битным словам, если строка выровнена по 8 байт и короткая;
+        #   суммы по строкам - поэлементным сложением срезов слов
+        if 0 < words_per_row <= 4:
+            counts = [word.bit_count() for word in memoryview(xored).cast('Q')]
+            distances = counts[0::words_per_row]
+            for i in range(1, words_per_row):
+                distances = list(map(add, distances, counts[i::words_per_row]))
+        else:
+            distances = [
+                int.from_bytes(xored[i:i + row_len], byteorder="little").bit_count()
+                for i in range(0, block_bytes, row_len)
+            ]
+
+        yield start // row_len, distances
+
+
+def _get_packed_distances(packed, query_body: bytes, row_len: int):
+    """
+        Побитовые расстояния Хэмминга от тела хэша запроса до каждой строки непрерывного массива
+        args:
+            packed: буфер (bytes/memoryview/mmap) из строк по row_len байт - тела хэшей без заголовков
+            query_body: тело хэша запроса (row_len байт)
+            row_len: длина строки в байтах
+        returns:
+            list - расстояние в битах для каждой строки
+    """
+
+    distances = []
+    for _, block_distances in _iter_packed_distances(packed, query_body, row_len):
+        distances.extend(block_distances)
+    return distances
+
+
+def _get_batch_distances(layout: tuple, a: bytearray, hashes: list, packed_rows: dict):
+    """
+        Расстояния от хэша запроса до каждого хэша массива с проверкой формата/размерности каждой строки
+        Строки той же раскладки, что и запрос, собираются в непрерывный массив (один раз на раскладку)
+        returns:
+            tuple - (индексы строк той же раскладки, их расстояния в битах,
+                     список (индекс, результат get_hamming_distance) для остальных строк)
+    """
+
+    header, hash_len, count_bits = layout
+    header_len = len(header)
+
+    if layout not in packed_rows:
+        indexes = []
+        other_indexes = []
+        for i, b in enumerate(hashes):
+            if len(b) == hash_len and b[:header_len] == header:
+                indexes.append(i)
+            else:
+                other_indexes.append(i)
+        packed = b''.join([hashes[i][header_len:] for i in indexes])
+        packed_rows[layout] = indexes, other_indexes, packed
+    indexes, other_indexes, packed = packed_rows[layout]
+
+    # Строки другой раскладки (другая версия, формат или размер) - попарное сравнение
+    others = [(i, get_hamming_distance(a, hashes[i])) for i in other_indexes]
+    distances = _get_packed_distances(packed, bytes(a[header_len:]), hash_len - header_len)
+
+    return indexes, distances, others
+
+
+def _get_batch_results(layout: tuple, batch: tuple, count_rows: int, top_k: int, max_distance: int):
+    """
+        Формирование результата пакетного сравнения
+        returns:
+            list - без фильтров: для каждой строки (расстояние в битах, значение от 0 до 100) / -2 / -1
+            list - с фильтрами: (индекс, расстояние в битах, значение от 0 до 100)
+                        по возрастанию расстояния, строки с ошибками -2/-1 пропускаются
+    """
+
+    count_bits = layout[2]
+    indexes, distances, others = batch
+
+    if top_k <= 0 and max_distance < 0:
+        results = [None] * count_rows
+        for i, result in others:
+            results[i] = result
+        for i, distance in zip(indexes, distances):
+            results[i] = (distance, 100 - (distance / count_bits) * 100)
+        return results
+
+    # Отбор по порогу расстояния и/или top_k ближайших
+    found = [(distance, i) for i, distance in zip(indexes, distances) if max_distance < 0 or distance <= max_distance]
+    found.extend(
+        (result[0], i) for i, result in others
+        if result.__class__ == tuple and (max_distance < 0 or result[0] <= max_distance)
+    )
+    if top_k > 0:
+        from heapq import nsmallest
+        found = nsmallest(top_k, found)
+    else:
+        found.sort()
+
+    return [(i, distance, 100 - (distance / count_bits) * 100) for distance, i in found]
+
+
+def get_hamming_distances(a: bytearray, hashes: list, top_k: int = 0, max_distance: int = -1):
+    """
+        Пакетное нахождение побитового расстояния Хэмминга от одного хэша до массива хэшей
+        args:
+            a - хэш запроса (формата v1 или v2)
+            hashes - массив хэшей (bytea[])
+            top_k - если > 0, вернуть только top_k ближайших хэшей
+            max_distance - если >= 0, вернуть только хэши с расстоянием в битах <= max_distance
+        returns:
+            -2 - для хэша запроса нераспознанного формата
+            list - без фильтров: для каждого хэша массива результат как у get_hamming_distance:
+                        (расстояние в битах, значение от 0 до 100) / -2 / -1
+            list - с фильтрами: (индекс, расстояние в битах, значение от 0 до 100)
+                        по возрастанию расстояния, хэши с ошибками -2/-1 пропускаются
+    """
+
+    layout = _get_hash_layout(a)
+    if layout is None: return -2
+
+    batch = _get_batch_distances(layout, a, hashes, {})
+    return _get_batch_results(layout, batch, len(hashes), top_k, max_distance)
+
+
+def get_hamming_distance_matrix(queries: list, hashes: list, top_k: int = 0, max_distance: int = -1):
+    """
+        Пакетное нахождение побитового расстояния Хэмминга для матрицы N x M хэшей
+        args:
+            queries - массив N хэшей запросов
+            hashes - массив M хэшей (bytea[])
+            top_k - если > 0, для каждого запроса вернуть только top_k ближайших хэшей
+            max_distance - если >= 0, вернуть только хэши с расстоянием в битах <= max_distance
+        returns:
+            list - N строк, каждая как результат get_hamming_distances для соответствующего запроса
+                   (-2 для нераспознанного хэша запроса)
+    """
+
+    # Непрерывные массивы строк собираются один раз на каждую раскладку хэшей запросов
+    packed_rows = {}
+    matrix = []
+    for a in queries:
+        layout = _get_hash_layout(a)
+        if layout is None:
+            matrix.append(-2)
+            continue
+        batch = _get_batch_distances(layout, a, hashes, packed_rows)
+        matrix.append(_get_batch_results(layout, batch, len(hashes), top_k, max_distance))
+
+    return matrix
+
+
+def get_simple_hamming_distance(a: bytearray, b:bytearray):
+    """
+        Нахождение простого расстояния Хэмминга для двух хэшей - доля совпавших бит хэша,
+        то же значение, что get_hamming_distance(a, b)[1]
+        (прежняя реализация из-за пустого цикла сравнения возвращала 0 для любых хэшей одного формата и размера)
+        args:
+            a - bytearray 1 (хэш формата v1 или v2)
+            b - bytearray 2 (хэш формата v1 или v2)
+        returns:
+            -2 - для ошибки разных форматов хэшей
+            -1 - для ошибки размерности хэшей
+            значение от 0 до 100 - где:
+                                        0 - разные изображения
+                                        100 - одинаковые изображения
+    """
+
+    # Побитовое сравнение хэшей
+    result = get_hamming_distance(a, b)
+    if result.__class__ == int:
+        return result
+
+    # Возврат рейтинга совпадения
+    return result[1]
+
+
+def get_detail_hamming_distance(a: bytearray, b:bytearray):
+    """
+        Нахождение точного расстояния Хэмминга для двух хэшей
+        args:
+            a - bytearray 1 (хэш формата v1 или v2)
+            b - bytearray 2 (хэш формата v1 или v2)
+        returns:
+            -2 - для ошибки разных форматов хэшей
+            -1 - для ошибки размерности хэшей
+            значение от 0 до 100 - где:
+                                        0 - разные изображения
+                                        100 - одинаковые изображения
+    """
+
+    # Приведение хэшей формата v2 к формату v1
+    a = _get_hash_v1(a)
+    b = _get_hash_v1(b)
+
+    # Проверка на форматы хэшей
+    if a[0:2] != b[0:2]: return -2
+    
+    # Проверка на размерность хэшей
+    count_vals = len(a)
+    if count_vals != len(b): return -1
+
+    # Текущая разница изображений
+    current_diff = 0
+
+    # Максимальная разница изображений
+    total_diff = count_vals * 255
+
+    # Цикл по сравнению битов
+    for i in range(count_vals-2):
+        current_diff += abs(a[i+2] - b[i+2])
+
+    # Возврат рейтинга совпадения
+    return 100 - (current_diff / total_diff) * 100
+
+
+# Преобразования диэдральной группы квадрата (имена Image.Transpose) - порядок вариантов хэша:
+#   вариант i - хэш изображения, преобразованного HASH_TRANSFORMS[i] (0 - исходное изображение)
+HASH_TRANSFORMS = (
+    None, 'ROTATE_90', 'ROTATE_180', 'ROTATE_270', 'FLIP_LEFT_RIGHT', 'FLIP_TOP_BOTTOM', 'TRANSPOSE', 'TRANSVERSE',
+)
+
+# Кэш перестановок бит по (код формата, размер сжатия)
+_TRANSFORM_PERMUTATIONS = {}
+
+
+def _get_transform_sources(size: int, transform: str):
+    """
+        Индексы пикселей сетки size x size (по строкам), из которых берутся пиксели
+        сетки после преобразования transform (по строкам)
+    """
+
+    from PIL import Image
+
+    grid = Image.new('I', (size, size))
+    grid.putdata(range(size * size))
+    if transform is not None:
+        grid = grid.transpose(getattr(Image.Transpose, transform))
+    return list(grid.getdata())
+
+
+def _get_transform_permutations(color_format_code: int, size: int):
+    """
+        Перестановки бит хэша для каждого преобразования HASH_TRANSFORMS
+        Только для average hash grs и rgb: его биты - пороги пикселей сетки по среднему,
+        которое не меняется при преобразовании, поэтому хэш преобразованного изображения -
+        перестановка бит исходного хэша (в bnw пиксели сетки зависят от направления дизеринга)
+        returns:
+            list - для каждого преобразования список индексов исходных бит
+            None - для форматов bnw, dhash и phash
+    """
+
+    if color_format_code not in (2, 3):
+        return None
+
+    key = (color_format_code, size)
+    if key not in _TRANSFORM_PERMUTATIONS:
+        count_bands = _HASH_FORMAT_BANDS[color_format_code]
+        permutations = []
+        for transform in HASH_TRANSFORMS:
+            sources = _get_transform_sources(size, transform)
+            # Биты average hash идут по столбцам, а внутри пикселя - по каналам
+            permutation = []
+            for x in range(size):
+                for y in range(size):
+                    source = sources[y * size + x]
+                    first_bit = ((source % size) * size + source // size) * count_bands
+                    permutation.extend(range(first_bit, first_bit + count_bands))
+            permutations.append(permutation)
+        _TRANSFORM_PERMUTATIONS[key] = permutations
+    return _TRANSFORM_PERMUTATIONS[key]
+
+
+def get_hash_transforms(a: bytearray):
+    """
+        Хэши 8 вариантов изображения (повороты и отражения, см. HASH_TRANSFORMS)
+        из одного хэша перестановкой бит - без изображения
+        Поддерживается average hash grs и rgb; для bnw, dhash и phash варианты
+        считаются по изображению (get_image_hash_transforms_bypath)
+        args:
+            a - хэш (формата v1 или v2)
+        returns:
+            list - 8 хэшей той же версии, первый совпадает с исходным
+            -2 - для хэша нераспознанного формата, bnw, dhash и phash
+    """
+
+    hash_int = _get_hash_int(a)
+    if hash_int is None:
+        return -2
+    color_format_code, size, value, count_bits = hash_int
+    permutations = _get_transform_permutations(color_format_code, size)
+    if permutations is None:
+        return -2
+
+    bits = format(value, '0%db' % count_bits).encode()
+    hash_version = _get_hash_header(a)[0]
+    return [
+        _get_hash_from_bits(bytes(map(bits.__getitem__, permutation)), color_format_code, size, hash_version)
+        for permutation in permutations
+    ]
+
+
+def get_canonical_hash(a: bytearray):
+    """
+        Каноническая форма хэша - наименьший по значению бит из 8 вариантов get_hash_transforms
+        У повернутых и отраженных копий одного изображения каноническая форма совпадает,
+        поэтому одного хэша достаточно для поиска точных повторов с учетом ориентации;
+        для поиска похожих изображений - get_transform_hamming_distance(s)
+        args:
+            a - хэш (формата v1 или v2, grs или rgb)
+        returns:
+            tuple - (канонический хэш той же версии, индекс преобразования в HASH_TRANSFORMS)
+            -2 - для хэша нераспознанного формата, bnw, dhash и phash
+    """
+
+    transforms = get_hash_transforms(a)
+    if transforms == -2:
+        return -2
+
+    values = [_get_hash_int(transform)[2] for transform in transforms]
+    index = values.index(min(values))
+    return transforms[index], index
+
+
+def _get_query_transforms(a):
+    """
+        Хэши вариантов запроса: готовый список (get_image_hash_transforms_*) или get_hash_transforms
+    """
+
+    if isinstance(a, (list, tuple)):
+        return list(a)
+    return get_hash_transforms(a)
+
+
+def get_transform_hamming_distance(a, b: bytearray):
+    """
+        Побитовое расстояние Хэмминга без учета ориентации - наименьшее по 8 вариантам запроса
+        args:
+            a - хэш запроса (grs или rgb) или список хэшей вариантов
+                из get_hash_transforms / get_image_hash_transforms_* (любой формат)
+            b - хэш (формата v1 или v2)
+        returns:
+            -2 - для ошибки разных форматов хэшей или хэша запроса bnw/dhash/phash без вариантов
+            -1 - для ошибки размерности хэшей
+            tuple - (расстояние в битах, значение от 0 до 100, индекс преобразования в HASH_TRANSFORMS)
+    """
+
+    transforms = _get_query_transforms(a)
+    if transforms == -2 or not transforms:
+        return -2
+
+    best = None
+    for index, transform in enumerate(transforms):
+        result = get_hamming_distance(transform, b)
+        if result.__class__ != tuple:
+            return result
+        if best is None or result[0] < best[0]:
+            best = result + (index,)
+    return best
+
+
+def get_transform_hamming_distances(a, hashes: list, top_k: int = 0, max_distance: int = -1):
+    """
+        Пакетное расстояние Хэмминга без учета ориентации от одного запроса до массива хэшей
+        (get_hamming_distance_matrix по 8 вариантам запроса, наименьшее расстояние по каждому хэшу)
+        args:
+            a - хэш запроса или список хэшей вариантов (см. get_transform_hamming_distance)
+            hashes - массив хэшей (bytea[])
+            top_k - если > 0, вернуть только top_k ближайших хэшей
+            max_distance - если >= 0, вернуть только хэши с расстоянием в битах <= max_distance
+        returns:
+            -2 - для хэша запроса нераспознанного формата или bnw/dhash/phash без вариантов
+            list - без фильтров: для каждого хэша массива
+                        (расстояние в битах, значение от 0 до 100, индекс преобразования) / -2 / -1
+            list - с фильтрами: (индекс, расстояние в битах, значение от 0 до 100, индекс преобразования)
+                        по возрастанию расстояния, хэши с ошибками -2/-1 пропускаются
+    """
+
+    transforms = _get_query_transforms(a)
+    if transforms == -2 or not transforms:
+        return -2
+
+    matrix = get_hamming_distance_matrix(transforms, hashes)
+    if -2 in matrix:
+        return -2
+
+    results = []
+    for row_results in zip(*matrix):
+        best = row_results[0]
+        if best.__class__ == tuple:
+            best += (0,)
+            for index in range(1, len(row_results)):
+                if row_results[index][0] < best[0]:
+                    best = row_results[index] + (index,)
+        results.append(best)
+
+    if top_k <= 0 and max_distance < 0:
+        return results
+
+    found = [
+        (result[0], i) for i, result in enumerate(results)
+        if result.__class__ == tuple and (max_distance < 0 or result[0] <= max_distance)
+    ]
+    if top_k > 0:
+        from heapq import nsmallest
+        found = nsmallest(top_k, found)
+    else:
+        found.sort()
+
+    return [(i,) + results[i] for _, i in found]
+
+
+def _get_sequence_hashes(frames: list):
+    """
+        Хэши кадров последовательности: список хэшей или пар (номер кадра, хэш)
+    """
+
+    return [frame[1] if frame.__class__ == tuple else frame for frame in frames]
+
+
+def get_sequence_signature(frames: list):
+    """
+        Сигнатура последовательности кадров - хэш того же формата и размера,
+        бит которого равен 1, если он равен 1 в большинстве кадров (побитовое голосование)
+        Сигнатура сравнивается и индексируется как обычный хэш (get_hamming_distance, HashIndex)
+        args:
+            frames - список хэшей кадров или пар (номер кадра, хэш)
+        returns:
+            bytearray(bytea) - сигнатура версии первого хэша
+            -2 - для пустого списка или хэшей нераспознанного или разных форматов
+            -1 - для хэшей разной размерности
+    """
+
+    from operator import add
+
+    hashes = _get_sequence_hashes(frames)
+    if not hashes:
+        return -2
+    first = _get_hash_int(hashes[0])
+    if first is None:
+        return -2
+    color_format_code, size, _, count_bits = first
+
+    # Счетчики символов битов: '0' - 48, '1' - 49
+    counts = [0] * count_bits
+    for a in hashes:
+        hash_int = _get_hash_int(a)
+        if hash_int is None or hash_int[0] != color_format_code:
+            return -2
+        if hash_int[1] != size:
+            return -1
+        counts = list(map(add, counts, format(hash_int[2], '0%db' % count_bits).encode()))
+
+    # Бит 1, если единиц больше половины: count - 48 * n > n / 2
+    threshold = 97 * len(hashes)
+    bits = bytes(49 if 2 * count > threshold else 48 for count in counts)
+    return _get_hash_from_bits(bits, color_format_code, size, _get_hash_header(hashes[0])[0])
+
+
+def get_sequence_distance(a: list, b: list):
+    """
+        Расстояние между последовательностями кадров - среднее по кадрам обеих последовательностей
+        расстояние до ближайшего кадра другой последовательности (симметричное расстояние Чамфера)
+        Не зависит от шага выборки, порядка и повторов кадров; матрица расстояний считается
+        пакетно (get_hamming_distance_matrix)
+        args:
+            a - список хэшей кадров или пар (номер кадра, хэш)
+            b - список хэшей кадров или пар (номер кадра, хэш)
+        returns:
+            -2 - для пустой последовательности или ошибки разных форматов хэшей
+            -1 - для ошибки размерности хэшей
+            tuple - (среднее расстояние в битах, значение от 0 до 100)
+    """
+
+    a = _get_sequence_hashes(a)
+    b = _get_sequence_hashes(b)
+    if not a or not b:
+        return -2
+
+    result = get_hamming_distance(a[0], b[0])
+    if result.__class__ != tuple:
+        return result
+    count_bits = _get_hash_int(a[0])[3]
+
+    row_distances = []
+    column_distances = [count_bits] * len(b)
+    for row in get_hamming_distance_matrix(a, b):
+        if row.__class__ != list:
+            return row
+        best = count_bits
+        for j, result in enumerate(row):
+            if result.__class__ != tuple:
+                return result
+            distance = result[0]
+            if distance < best:
+                best = distance
+            if distance < column_distances[j]:
+                column_distances[j] = distance
+        row_distances.append(best)
+
+    distance = (sum(row_distances) + sum(column_distances)) / (len(a) + len(b))
+    return distance, 100 - (distance / count_bits) * 100
+
+
+# Размер корзины, начиная с которого хэши корзины сравниваются пакетно (_iter_packed_distances)
+_CLUSTER_PACKED_MIN_ROWS = 32
+
+
+def _find_root(parent, i: int):
+    """
+        Корень множества элемента i (union-find, с сокращением пути вдвое)
+    """
+
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _union_roots(parent, i: int, j: int):
+    """
+        Объединение множеств элементов i и j: корнем становится меньший номер (первый элемент во входных данных)
+    """
+
+    i = _find_root(parent, i)
+    j = _find_root(parent, j)
+    if i < j:
+        parent[j] = i
+    elif j < i:
+        parent[i] = j
+
+
+def _get_band_flips(width: int, radius: int):
+    """
+        Все ненулевые маски полосы шириной width не более чем с radius единичными битами
+    """
+
+    from itertools import combinations
+
+    return [
+        sum(1 << bit for bit in bits) for count in range(1, radius + 1) for bits in combinations(range(width), count)
+    ]
+
+
+# Оценка стоимости операций при выборе количества полос (относительно одной операции цикла Python):
+#   проба корзины соседней полосы выполняется пакетно (XOR длинных чисел и пересечение множеств)
+_CLUSTER_PROBE_COST = 0.05
+
+
+def _get_cluster_bands(count_bits: int, count: int, max_distance: int):
+    """
+        Выбор количества полос по оценке работы на каждую полосу: раскладка по корзинам,
+        пакетные пробы соседних корзин и побитовое сравнение кандидатов из совпавших корзин
+    """
+
+    from math import comb
+
+    best_bands, best_cost = 1, None
+    for bands in range(1, min(max_distance + 1, count_bits) + 1):
+        width = count_bits // bands
+        radius = max_distance // bands
+        if radius and width > 64:
+            continue
+        flips = sum(comb(width, k) for k in range(radius + 1))
+        count_keys = min(count, 2 ** width)
+        cost = bands * (
+            count + (flips - 1) * count_keys * _CLUSTER_PROBE_COST + count * count / 2 ** width * flips / 2
+        )
+        if best_cost is None or cost < best_cost:
+            best_bands, best_cost = bands, cost
+    return best_bands
+
+
+def _union_bucket(parent, values, bucket: list, max_distance: int, row_len: int):
+    """
+        Объединение всех пар одной корзины в пределах max_distance
+        Маленькие корзины - попарно, большие - строка против остатка корзины пакетно
+    """
+
+    if len(bucket) < _CLUSTER_PACKED_MIN_ROWS:
+        for position, i in enumerate(bucket):
+            value = values[i]
+            for j in bucket[position + 1:]:
+                if (value ^ values[j]).bit_count() <= max_distance:
+                    _union_roots(parent, i, j)
+        return
+
+    packed = b''.join([values[i].to_bytes(row_len, byteorder="little") for i in bucket])
+    view = memoryview(packed)
+    for position, i in enumerate(bucket[:-1]):
+        first = position + 1
+        for start, distances in _iter_packed_distances(
+                                    view[first * row_len:], packed[position * row_len:first * row_len], row_len
+                                ):
+            for k in [k for k, distance in enumerate(distances) if distance <= max_distance]:
+                _union_roots(parent, i, bucket[first + start + k])
+
+
+def _iter_neighbor_buckets(buckets: dict, flips: list, width: int):
+    """
+        Пары ключей корзин, отличающихся на одну из масок flips
+        Для полос до 64 бит ключ каждой корзины изменяется на маску пакетно:
+            все ключи - одно длинное число, XOR с повторенной маской, пересечение с ключами корзин
+        yields:
+            tuple - (ключ, ключ соседней корзины), каждая пара один раз
+    """
+
+    from array import array
+
+    if width > 64:
+        for key in buckets:
+            for flip in flips:
+                if key ^ flip in buckets and key < key ^ flip:
+                    yield key, key ^ flip
+        return
 
-    # Загрузка файла
-    try:
-        img_to_analize = Image.open(                            # 3. Create Image object
-                                io.BytesIO(                     # 2. Create BytesIO format
-                                        b64decode(base64str)    # 1. Read file
-                                        )
-                                ).resize((size, size)           # 4. Resize Image
-                            ).convert(color_format)             # 5. Convert to color format
-    except:
-        return 0
-    
-    # Загрузка первого пикселя для анализа
-    #   Если указан формат Ч/Б или оттенки серого - 
-    #       будет всего 1 значения интенсивности цвета на пиксель
-    #       и такое значение нужно укомпоновать в список - в целях однотипности переменных
-    #   Если указан цветной формат - пропустить шаг, т.к.
-    #       для такого пикселя уже будет список 3 значений интенсивности:
-    #       для красного, зеленого и синего
-    first_pixel_val = img_to_analize.getpixel((0,0))
-    if first_pixel_val.__class__ == int:
-        first_pixel_val = [first_pixel_val]
-
-    # Нахождение среднего значения интенсивности для каждого типа интенсивности
-    avg_val = [0 for _ in first_pixel_val]
-    for i in range(size):
-        for j in range(size):
-
-            pixel_val_rgb = img_to_analize.getpixel((i,j))
-            if pixel_val_rgb.__class__ == int: 
-                pixel_val_rgb = [pixel_val_rgb]
-            for k, val in enumerate(pixel_val_rgb):
-                avg_val[k] += val
-
-    for n in range(len(avg_val)):         
-        avg_val[n] /= size ** 2
-
-    # Запись в первые 2 байта служебной информации
-    values = [color_format_to_write, '']
-    # Двойной цикл по каждому пикселю изображения
-    for i in range(size):
-        for j in range(size):
-            pixel_val_rgb = img_to_analize.getpixel((i,j))
-            if pixel_val_rgb.__class__ == int: 
-                pixel_val_rgb = [pixel_val_rgb]
-            
-            # Цикл по каждому значению интенсивности пикселя
-            for n, pixel_val in enumerate(pixel_val_rgb):
-                # Сравнение интенсивности пискеля с соответствующим значением средней интенсивности
-                #   и создание бита 1/0
-                if pixel_val >= avg_val[n]:
-                    k = '1'
-                else:
-                    k = '0'
-
-                # Если длина последнего элемента списка равна 8 - перевод битов в байты
-                #   и внесение нового бита в отлельный элемент
-                if len(values[-1]) == 8:
-                    values[-1] = int(values[-1], 2).to_bytes(2, byteorder="little")
-                    values.append(k)
-                else: 
-                    # Иначе - дополнение последнего элемента новым битом
-                    values[-1] += k
-
-    # Генерация байтов из последних необработанных битов
-    values[-1] = int(values[-1], 2).to_bytes(2, byteorder="little")
-
-    # Возврат 1 элемента bytearray из списка составленных элементов bytes
-    return bytearray(b''.join(values))
+    typecode = 'I' if width <= 32 else 'Q'
+    keys = array(typecode, buckets).tobytes()
+    count_keys = len(buckets)
+    keys_int = int.from_bytes(keys, byteorder="little")
+    keys_set = set(buckets)
+    for flip in flips:
+        flip_int = int.from_bytes(flip.to_bytes(len(keys) // count_keys, byteorder="little") * count_keys,
+                                  byteorder="little")
+        flipped = memoryview((keys_int ^ flip_int).to_bytes(len(keys), byteorder="little")).cast(typecode)
+        for neighbor in keys_set.intersection(flipped):
+            key = neighbor ^ flip
+            if key < neighbor:
+                yield key, neighbor
 
 
-def get_simple_hamming_distance(a: bytearray, b:bytearray):
+def _get_partition_roots(values, count_bits: int, max_distance: int, bands: int):
     """
-        Нахождение простого расстояния Хэмминга для двух хэшей
+        Кластеризация хэшей одного формата и размера (multi-index hashing)
+        Биты делятся на bands полос; у пары в пределах max_distance хотя бы одна полоса
+        отличается не более чем на max_distance // bands бит, поэтому для каждого хэша
+        достаточно сравнить его с хэшами своей корзины полосы и корзин, отличающихся на столько бит
         args:
-            a - bytearray 1
-            b - bytearray 2
+            values: значащие биты хэшей (array('Q') или список чисел)
+            bands: количество полос (0 - выбор по оценке работы)
         returns:
-            -2 - для ошибки разных форматов хэшей
-            -1 - для ошибки размерности хэшей
-            значение от 0 до 100 - где:
-                                        0 - разные изображения
-                                        100 - одинаковые изображения
+            array - корень (номер первого элемента кластера) для каждого хэша
     """
 
-    # Проверка на форматы хэшей
-    if a[0:2] != b[0:2]: return -2
+    from array import array
 
-    # Проверка на размерность хэшей
-    count_vals = len(a) - 2
-    if count_vals != len(b) - 2: return -1
+    count = len(values)
+    parent = array('q', range(count))
+    if max_distance < 0:
+        return parent
 
-    # Счетчик совпавших байт
-    matched_vals = 0
+    # Точные дубли объединяются сразу, в корзины попадают только уникальные значения
+    first_indexes = {}
+    unique = []
+    for i, value in enumerate(values):
+        first = first_indexes.setdefault(value, i)
+        if first != i:
+            parent[i] = first
+        else:
+            unique.append(i)
+    del first_indexes
 
-    # Цикл сравнения байт
-    for i in range(count_vals, 2):
-        if a[i] == b[i]:
-            matched_vals += 1
+    bands = min(bands or _get_cluster_bands(count_bits, len(unique), max_distance), count_bits)
+    bounds = [count_bits * k // bands for k in range(bands + 1)]
+    row_len = -(-count_bits // 64) * 8
+    flips = {}
 
-    # Возврат рейтинга совпадения
-    return (matched_vals / count_vals) * 100
+    # Корзины строятся по одной полосе за раз: в памяти одновременно только одна полоса
+    for band in range(bands):
+        shift, width = bounds[band], bounds[band + 1] - bounds[band]
+        mask = (1 << width) - 1
+        if width not in flips:
+            flips[width] = _get_band_flips(width, max_distance // bands)
 
+        buckets = {}
+        for i in unique:
+            buckets.setdefault((values[i] >> shift) & mask, []).append(i)
 
-def get_detail_hamming_distance(a: bytearray, b:bytearray):
+        # Пары внутри корзины
+        for bucket in buckets.values():
+            if len(bucket) > 1:
+                _union_bucket(parent, values, bucket, max_distance, row_len)
+
+        # Пары из корзин, ключи которых отличаются не более чем на max_distance // bands бит
+        for key, neighbor in _iter_neighbor_buckets(buckets, flips[width], width):
+            neighbors = buckets[neighbor]
+            for i in buckets[key]:
+                value = values[i]
+                for j in neighbors:
+                    if (value ^ values[j]).bit_count() <= max_distance:
+                        _union_roots(parent, i, j)
+        del buckets
+
+    for i in range(count):
+        parent[i] = _find_root(parent, i)
+    return parent
+
+
+def get_hash_clusters(rows, max_distance: int, bands: int = 0, min_cluster_size: int = 2):
     """
-        Нахождение точного расстояния Хэмминга для двух хэшей
+        Группировка похожих хэшей коллекции в кластеры (поиск дублей) без попарного сравнения всех хэшей
+        Пары в пределах max_distance ищутся по полосам бит (multi-index hashing): побитово сравниваются
+        только хэши, у которых одна из полос почти совпадает; найденные пары объединяются (union-find),
+        поэтому кластер - компонента связности (крайние элементы могут быть дальше max_distance)
+        Находятся все пары в пределах max_distance; хэши сравниваются только внутри своего формата и размера
+        Память - O(N) на значащие биты и номера хэшей одного формата и размера (без списка пар)
         args:
-            a - bytearray 1
-            b - bytearray 2
-        returns:
-            -2 - для ошибки разных форматов хэшей
-            -1 - для ошибки размерности хэшей
-            значение от 0 до 100 - где:
-                                        0 - разные изображения
-                                        100 - одинаковые изображения
+            rows: итерируемый объект пар (id, хэш) - хэши любой версии
+            max_distance: наибольшее расстояние в битах между дублями
+            bands: количество полос бит - влияет только на скорость:
+                        0 - выбор по размеру коллекции и max_distance (по умолчанию)
+                        max_distance + 1 - корзины точного совпадения полос
+                        меньше - шире полосы и больше проб соседних корзин на хэш
+                                 (C(ширина, max_distance // bands) - при малом количестве полос очень много)
+            min_cluster_size: наименьший размер выдаваемого кластера (1 - вместе с одиночными хэшами)
+        yields:
+            tuple - (id кластера, id) - id кластера равен id его первого элемента во входных данных;
+                    элементы кластера идут подряд; нераспознанные хэши пропускаются
     """
 
-    # Проверка на форматы хэшей
-    if a[0:2] != b[0:2]: return -2
-    
-    # Проверка на размерность хэшей
-    count_vals = len(a)
-    if count_vals != len(b): return -1
-
-    # Текущая разница изображений
-    current_diff = 0
+    from array import array
 
-    # Максимальная разница изображений
-    total_diff = count_vals * 255
+    # Разбиение по (формат, размер): id, значащие биты хэшей
+    partitions = {}
+    for row_id, a in rows:
+        hash_int = _get_hash_int(a)
+        if hash_int is None:
+            continue
+        color_format_code, size, value, count_bits = hash_int
+        key = (color_format_code, size, count_bits)
+        if key not in partitions:
+            partitions[key] = [], array('Q') if count_bits <= 64 else []
+        ids, values = partitions[key]
+        ids.append(row_id)
+        values.append(value)
 
-    # Цикл по сравнению битов
-    for i in range(count_vals-2):
-        current_diff += abs(a[i+2] - b[i+2])
+    for key in list(partitions):
+        ids, values = partitions.pop(key)
+        roots = _get_partition_roots(values, key[2], max_distance, bands)
+        del values
 
-    # Возврат рейтинга совпадения
-    return 100 - (current_diff / total_diff) * 100
+        sizes = {}
+        for root in roots:
+            sizes[root] = sizes.get(root, 0) + 1
+        for i in sorted(range(len(ids)), key=roots.__getitem__):
+            root = roots[i]
+            if sizes[root] >= min_cluster_size:
+                yield ids[root], ids[i]
 
 
 def get_base64_bypath(path: str):
@@ -572,3 +3702,1122 @@ def get_base64_byrequest(domain: str, qpath:str, method: str, payload:str, schem
     except:
         return -2
 
+
+
+class HashIndex:
+    """
+        Индекс хэшей для поиска похожих изображений быстрее полного перебора (BK-дерево)
+        Хэши разных форматов цвета и размеров хранятся в отдельных разделах (BK-деревьях),
+        ключ раздела - (код формата, размер сжатия) из заголовка хэша,
+        поэтому хэши v1 и v2 одного изображения попадают в один раздел
+        Узел BK-дерева - список [число хэша, список ключей, {расстояние: дочерний узел}]
+    """
+
+    # Версия формата файла индекса (1 - прежний формат pickle, не загружается)
+    FILE_VERSION = 2
+
+    def __init__(self):
+        # Корни BK-деревьев по разделам
+        self._roots = {}
+        # Ключ записи -> (ключ раздела, число хэша, количество бит)
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def insert(self, key, a: bytearray):
+        """
+            Добавление хэша в индекс (существующий ключ перезаписывается)
+            args:
+                key - ключ записи (например, id строки таблицы)
+                a - хэш (формата v1 или v2)
+            returns:
+                True - хэш добавлен
+                -2 - для хэша нераспознанного формата
+        """
+
+        hash_int = _get_hash_int(a)
+        if hash_int is None: return -2
+        color_format_code, size, value, count_bits = hash_int
+
+        if key in self._entries:
+            self.delete(key)
+
+        partition = (color_format_code, size)
+        self._entries[key] = (partition, value, count_bits)
+
+        node = self._roots.get(partition)
+        if node is None:
+            self._roots[partition] = [value, [key], {}]
+            return True
+
+        # Спуск по дереву до свободной ветки с тем же расстоянием
+        while True:
+            distance = (node[0] ^ value).bit_count()
+            if distance == 0:
+                node[1].append(key)
+                return True
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [key], {}]
+                return True
+            node = child
+
+    def delete(self, key):
+        """
+            Удаление хэша из индекса по ключу
+            Узел остается в дереве для навигации, из него удаляется только ключ
+            returns:
+                True - ключ удален
+                False - ключ не найден
+        """
+
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        partition, value, _ = entry
+
+        node = self._roots[partition]
+        while True:
+            distance = (node[0] ^ value).bit_count()
+            if distance == 0:
+                node[1].remove(key)
+                return True
+            node = node[2][distance]
+
+    def _get_query(self, a: bytearray):
+        """
+            Разбор хэша запроса
+            returns:
+                tuple - (корень раздела или None, число хэша, количество бит)
+                None - для хэша нераспознанного формата
+        """
+
+        hash_int = _get_hash_int(a)
+        if hash_int is None:
+            return None
+        color_format_code, size, value, count_bits = hash_int
+        return self._roots.get((color_format_code, size)), value, count_bits
+
+    def query_radius(self, a: bytearray, max_distance: int):
+        """
+            Поиск всех хэшей раздела на расстоянии в битах <= max_distance
+            args:
+                a - хэш запроса (формата v1 или v2)
+                max_distance - максимальное расстояние в битах
+            returns:
+                list - (ключ, расстояние в битах, значение от 0 до 100) по возрастанию расстояния
+                -2 - для хэша нераспознанного формата
+        """
+
+        query = self._get_query(a)
+        if query is None: return -2
+        root, value, count_bits = query
+
+        found = []
+        stack = [root] if root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = (node[0] ^ value).bit_count()
+            if distance <= max_distance:
+                found.extend((distance, key) for key in node[1])
+            # Неравенство треугольника: интересны только ветки в [d - r, d + r]
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+
+        found.sort(key=lambda row: row[0])
+        return [(key, distance, 100 - (distance / count_bits) * 100) for distance, key in found]
+
+    def query_knn(self, a: bytearray, k: int):
+        """
+            Поиск k ближайших хэшей раздела
+            args:
+                a - хэш запроса (формата v1 или v2)
+                k - количество ближайших хэшей
+            returns:
+                list - (ключ, расстояние в битах, значение от 0 до 100) по возрастанию расстояния
+                -2 - для хэша нераспознанного формата
+        """
+
+        query = self._get_query(a)
+        if query is None: return -2
+        root, value, count_bits = query
+        if root is None or k <= 0:
+            return []
+
+        from heapq import heappush, heapreplace
+
+        # Куча k лучших кандидатов (по убыванию расстояния - через отрицательное расстояние)
+        #   и текущий радиус поиска - расстояние до k-го кандидата
+        best = []
+        radius = count_bits
+        order = 0
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            distance = (node[0] ^ value).bit_count()
+            if distance <= radius:
+                for key in node[1]:
+                    order += 1
+                    if len(best) < k:
+                        heappush(best, (-distance, -order, key))
+                    elif distance < -best[0][0]:
+                        heapreplace(best, (-distance, -order, key))
+                if len(best) == k:
+                    radius = -best[0][0]
+            # Сначала обходятся ветки с расстоянием, близким к d - они чаще дают близкие хэши
+            children = [
+                (abs(child_distance - distance), child) for child_distance, child in node[2].items()
+                if distance - radius <= child_distance <= distance + radius
+            ]
+            children.sort(key=lambda row: row[0], reverse=True)
+            stack.extend(child for _, child in children)
+
+        found = sorted((-distance, -order, key) for distance, order, key in best)
+        return [(key, distance, 100 - (distance / count_bits) * 100) for distance, _, key in found]
+
+    def save(self, path: str):
+        """
+            Сохранение индекса в файл JSON (дерево сохраняется целиком, без перестроения при загрузке)
+            Формат: {"version", "partitions": [{"color_format_code", "size", "count_bits", "nodes"}]},
+            узел - [число хэша (hex), список ключей, индекс родителя (-1 - корень), расстояние до родителя];
+            ключи записей должны сохраняться в JSON без потерь (int, str)
+        """
+
+        import json
+
+        # Количество бит хэшей по разделам (у раздела без записей - 0, его дерево только для навигации)
+        partition_bits = {partition: count_bits for partition, _, count_bits in self._entries.values()}
+
+        # Узлы сохраняются плоским списком, чтобы глубина дерева не ограничивала сериализацию
+        partitions = []
+        for partition, root in self._roots.items():
+            nodes = []
+            stack = [(root, -1, 0)]
+            while stack:
+                node, parent, distance = stack.pop()
+                nodes.append(('%x' % node[0], node[1], parent, distance))
+                index = len(nodes) - 1
+                stack.extend((child, index, child_distance) for child_distance, child in node[2].items())
+            partitions.append({
+                'color_format_code': partition[0], 'size': partition[1],
+                'count_bits': partition_bits.get(partition, 0), 'nodes': nodes
+            })
+
+        with open(path, 'w', encoding='utf-8') as fw:
+            json.dump({'version': self.FILE_VERSION, 'partitions': partitions}, fw, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path: str):
+        """
+            Загрузка индекса из файла, сохраненного методом save
+            returns:
+                HashIndex - загруженный индекс
+                None(NULL) - если файл не существует
+                0 - ошибка чтения файла или файл другого формата
+        """
+
+        import os
+        if not os.path.exists(path):
+            return None
+
+        import json
+        index = cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as fr:
+                data = json.load(fr)
+            if data['version'] != cls.FILE_VERSION:
+                return 0
+
+            for row in data['partitions']:
+                partition = (int(row['color_format_code']), int(row['size']))
+                count_bits = int(row['count_bits'])
+                built = []
+                for value, keys, parent, distance in row['nodes']:
+                    node = [int(value, 16), list(keys), {}]
+                    # Родитель всегда сохранен раньше потомка, корень - первый узел
+                    if (parent < 0) != (not built) or parent >= len(built):
+                        return 0
+                    if parent >= 0:
+                        built[parent][2][int(distance)] = node
+                    built.append(node)
+                    for key in node[1]:
+                        index._entries[key] = (partition, node[0], count_bits)
+                if built:
+                    index._roots[partition] = built[0]
+        except Exception:
+            return 0
+
+        return index
+
+
+# Минимальная доля бит меньшинства в хэше тайла: у однотонных тайлов (фон, поля) хэш почти
+#   из одних единиц или нулей и совпадает с любым другим однотонным тайлом
+_TILE_MIN_DETAIL = 1 / 8
+
+
+def _is_detailed_tile(value: int, count_bits: int):
+    """
+        Тайл содержит детали (не однотонный) - см. _TILE_MIN_DETAIL
+    """
+
+    ones = value.bit_count()
+    return min(ones, count_bits - ones) >= count_bits * _TILE_MIN_DETAIL
+
+
+def _get_tile_hashes(tiles: list):
+    """
+        Хэши тайлов: список хэшей или кортежей (..., хэш), как в get_image_tile_hashes_*
+    """
+
+    return [tile[-1] if tile.__class__ == tuple else tile for tile in tiles]
+
+
+def _get_tile_bands(count_bits: int, count_bands: int):
+    """
+        Разбиение хэша на count_bands непересекающихся полос бит
+        returns:
+            list - (сдвиг, маска) полосы в числе хэша
+    """
+
+    bands = []
+    shift = 0
+    for band in range(count_bands):
+        width = count_bits // count_bands + (band < count_bits % count_bands)
+        bands.append((shift, (1 << width) - 1))
+        shift += width
+    return bands
+
+
+class TileIndex:
+    """
+        Инвертированный индекс хэшей тайлов (get_image_tile_hashes_*) для поиска изображений,
+        содержащих общий фрагмент: кадрирование, наложение, вставка в коллаж
+        Хэш тайла делится на max_distance + 1 полос бит; хэши на расстоянии <= max_distance
+        совпадают хотя бы в одной полосе (принцип Дирихле), поэтому кандидаты берутся
+        из списков (раздел, номер полосы, значение полосы) -> номера тайлов без полного перебора
+        Раздел - (код формата, размер сжатия) из заголовка хэша, как в HashIndex
+        Однотонные тайлы не индексируются и не ищутся (см. _TILE_MIN_DETAIL)
+    """
+
+    def __init__(self, max_distance: int = 4):
+        self.max_distance = max_distance
+        # (раздел, номер полосы, значение полосы) -> список номеров тайлов
+        self._postings = {}
+        # Номер тайла -> (ключ изображения, число хэша)
+        self._tiles = {}
+        # Ключ изображения -> список (номер тайла, ключи списков)
+        self._keys = {}
+        self._bands = {}
+        self._next_tile = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def _get_posting_keys(self, hash_int: tuple):
+        """
+            Ключи списков тайла
+            returns:
+                list - (раздел, номер полосы, значение полосы)
+                None - для однотонного тайла
+        """
+
+        color_format_code, size, value, count_bits = hash_int
+        if not _is_detailed_tile(value, count_bits):
+            return None
+        bands = self._bands.get(count_bits)
+        if bands is None:
+            bands = self._bands[count_bits] = _get_tile_bands(count_bits, self.max_distance + 1)
+        partition = (color_format_code, size)
+        return [(partition, band, (value >> shift) & mask) for band, (shift, mask) in enumerate(bands)]
+
+    def insert(self, key, tiles: list):
+        """
+            Добавление тайлов изображения в индекс (существующий ключ перезаписывается)
+            args:
+                key - ключ изображения (например, id строки таблицы)
+                tiles - список хэшей тайлов или кортежей (..., хэш), как в get_image_tile_hashes_*
+            returns:
+                int - количество проиндексированных (неоднотонных) тайлов
+                -2 - для хэша нераспознанного формата
+        """
+
+        hash_ints = []
+        for a in _get_tile_hashes(tiles):
+            hash_int = _get_hash_int(a)
+            if hash_int is None: return -2
+            hash_ints.append(hash_int)
+
+        if key in self._keys:
+            self.delete(key)
+
+        entries = []
+        for hash_int in hash_ints:
+            posting_keys = self._get_posting_keys(hash_int)
+            if posting_keys is None:
+                continue
+            tile_id = self._next_tile
+            self._next_tile += 1
+            self._tiles[tile_id] = (key, hash_int[2])
+            for posting_key in posting_keys:
+                self._postings.setdefault(posting_key, []).append(tile_id)
+            entries.append((tile_id, posting_keys))
+
+        self._keys[key] = entries
+        return len(entries)
+
+    def delete(self, key):
+        """
+            Удаление тайлов изображения из индекса по ключу
+            returns:
+                True - ключ удален
+                False - ключ не найден
+        """
+
+        entries = self._keys.pop(key, None)
+        if entries is None:
+            return False
+        for tile_id, posting_keys in entries:
+            del self._tiles[tile_id]
+            for posting_key in posting_keys:
+                posting = self._postings[posting_key]
+                posting.remove(tile_id)
+                if not posting:
+                    del self._postings[posting_key]
+        return True
+
+    def query(self, tiles: list, top_k: int = 0, min_matches: int = 1):
+        """
+            Поиск изображений с общими тайлами
+            Тайл запроса совпал с изображением, если у изображения есть тайл любого масштаба
+            на расстоянии <= max_distance бит
+            args:
+                tiles - список хэшей тайлов или кортежей (..., хэш), как в get_image_tile_hashes_*
+                top_k - количество лучших изображений (0 - все)
+                min_matches - минимальное количество совпавших тайлов запроса
+            returns:
+                list - (ключ, количество совпавших тайлов запроса, значение от 0 до 100 -
+                       доля совпавших среди неоднотонных тайлов запроса) по убыванию совпадений
+                -2 - для хэша нераспознанного формата
+        """
+
+        from collections import Counter
+
+        hash_ints = []
+        for a in _get_tile_hashes(tiles):
+            hash_int = _get_hash_int(a)
+            if hash_int is None: return -2
+            hash_ints.append(hash_int)
+
+        matches = Counter()
+        count_detailed = 0
+        for hash_int in hash_ints:
+            posting_keys = self._get_posting_keys(hash_int)
+            if posting_keys is None:
+                continue
+            count_detailed += 1
+            value = hash_int[2]
+
+            candidates = set()
+            for posting_key in posting_keys:
+                candidates.update(self._postings.get(posting_key, ()))
+            # Тайл запроса засчитывается изображению один раз, даже если совпал с несколькими его тайлами
+            matches.update({
+                key for key, tile_value in map(self._tiles.__getitem__, candidates)
+                if (tile_value ^ value).bit_count() <= self.max_distance
+            })
+
+        found = [(key, count) for key, count in matches.items() if count >= min_matches]
+        found.sort(key=lambda row: row[1], reverse=True)
+        if top_k > 0:
+            found = found[:top_k]
+        return [(key, count, count / count_detailed * 100) for key, count in found]
+
+
+def get_tile_similarity(a: list, b: list, max_distance: int = 4):
+    """
+        Наибольшее перекрытие двух изображений по тайлам - доля неоднотонных тайлов a,
+        для которых среди тайлов b (любого масштаба) есть тайл на расстоянии <= max_distance бит
+        Несимметрично: для фрагмента a и полного изображения b значение близко к 100
+        args:
+            a - список хэшей тайлов или кортежей (..., хэш), как в get_image_tile_hashes_*
+            b - список хэшей тайлов или кортежей (..., хэш)
+            max_distance - максимальное расстояние в битах между совпадающими тайлами
+        returns:
+            -2 - для пустого списка или ошибки разных форматов хэшей
+            -1 - для ошибки размерности хэшей
+            tuple - (количество совпавших тайлов a, значение от 0 до 100)
+    """
+
+    a = _get_tile_hashes(a)
+    b = _get_tile_hashes(b)
+    if not a or not b:
+        return -2
+
+    result = get_hamming_distance(a[0], b[0])
+    if result.__class__ != tuple:
+        return result
+
+    index = TileIndex(max_distance)
+    if index.insert(0, b) == -2:
+        return -2
+    found = index.query(a)
+    if found == -2:
+        return -2
+    return found[0][1:] if found else (0, 0.0)
+
+
+class HashStore:
+    """
+        Файловое хранилище хэшей для массового сканирования без создания объекта на каждую строку
+        Хранилище - директория с файлом на каждый раздел (код формата, размер сжатия): '<код>_<размер>.imts'
+        Файл раздела: заголовок 16 байт и записи фиксированной длины:
+            [id строки uint64 little endian][тело хэша v2, дополненное нулями до кратности 8 байт]
+        Поиск выполняется прямо по буферу mmap без копирования записей;
+        незавершенный обход видит записи на момент своего начала, дозапись во время обхода допустима
+    """
+
+    FILE_MAGIC = b'IMTS'
+    FILE_VERSION = 1
+    _FILE_HEADER_LEN = 16
+    _ROW_ID_LEN = 8
+
+    def __init__(self, path: str):
+        """
+            args:
+                path - директория хранилища (создается, если не существует)
+        """
+
+        import os
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        # Раздел -> файл, открытый на дозапись
+        self._writers = {}
+        # Раздел -> (mmap, файл, длина отображения)
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        count_rows = 0
+        for partition in self.partitions():
+            self._flush(partition)
+            count_rows += self._get_count_rows(partition)
+        return count_rows
+
+    def close(self):
+        """
+            Закрытие всех открытых файлов и отображений
+        """
+
+        for fw in self._writers.values():
+            fw.close()
+        for mapped in self._maps.values():
+            self._close_map(mapped)
+        self._writers = {}
+        self._maps = {}
+
+    def _get_file_path(self, partition: tuple):
+        import os
+        return os.path.join(self.path, f"{partition[0]}_{partition[1]}.imts")
+
+    def _get_row_len(self, count_bits: int):
+        """
+            Длина записи: id строки + тело хэша, выровненное по 8 байт
+        """
+
+        return self._ROW_ID_LEN + (count_bits + 63) // 64 * 8
+
+    def partitions(self):
+        """
+            Список разделов хранилища
+            returns:
+                list - (код формата, размер сжатия)
+        """
+
+        import os
+        found = []
+        for name in os.listdir(self.path):
+            stem, ext = os.path.splitext(name)
+            code, _, size = stem.partition('_')
+            if ext == '.imts' and code.isdigit() and size.isdigit():
+                found.append((int(code), int(size)))
+        return sorted(found)
+
+    def _get_row(self, hash_int: tuple):
+        """
+            Раздел и тело записи для разобранного хэша
+            returns:
+                tuple - (раздел, тело хэша с выравниванием, длина записи)
+        """
+
+        color_format_code, size, value, count_bits = hash_int
+        row_len = self._get_row_len(count_bits)
+        body_len = row_len - self._ROW_ID_LEN
+        body = (value << (body_len * 8 - count_bits)).to_bytes(body_len, byteorder="big")
+        return (color_format_code, size), body, row_len
+
+    def append(self, row_id: int, a: bytearray):
+        """
+            Добавление хэша в хранилище
+            args:
+                row_id - id строки (целое 0..2^64-1)
+                a - хэш (формата v1 или v2), например результат get_image_hash_bypath
+            returns:
+                True - хэш добавлен
+                -2 - для хэша нераспознанного формата
+        """
+
+        hash_int = _get_hash_int(a)
+        if hash_int is None: return -2
+        partition, body, row_len = self._get_row(hash_int)
+
+        fw = self._writers.get(partition)
+        if fw is None:
+            fw = open(self._get_file_path(partition), 'ab')
+            # Заголовок файла нового раздела
+            if fw.tell() == 0:
+                fw.write(
+                    self.FILE_MAGIC
+                    + bytes((self.FILE_VERSION, partition[0]))
+                    + partition[1].to_bytes(2, byteorder="little")
+                    + row_len.to_bytes(4, byteorder="little")
+                    + bytes(4)
+                )
+            self._writers[partition] = fw
+
+        fw.write(row_id.to_bytes(self._ROW_ID_LEN, byteorder="little") + body)
+        return True
+
+    def append_many(self, rows):
+        """
+            Добавление множества хэшей
+            args:
+                rows - итерируемый объект пар (id строки, хэш)
+            returns:
+                int - количество добавленных хэшей (нераспознанные хэши пропускаются)
+        """
+
+        count_rows = 0
+        for row_id, a in rows:
+            if self.append(row_id, a) is True:
+                count_rows += 1
+        return count_rows
+
+    def _flush(self, partition: tuple):
+        fw = self._writers.get(partition)
+        if fw is not None:
+            fw.flush()
+
+    def _get_count_rows(self, partition: tuple):
+        import os
+        file_len = os.path.getsize(self._get_file_path(partition))
+        if file_len < self._FILE_HEADER_LEN:
+            return 0
+        with open(self._get_file_path(partition), 'rb') as fr:
+            header = fr.read(self._FILE_HEADER_LEN)
+        row_len = int.from_bytes(header[8:12], byteorder="little")
+        return (file_len - self._FILE_HEADER_LEN) // row_len
+
+    def _get_map(self, partition: tuple):
+        """
+            Отображение файла раздела в память (переотображается, если файл вырос)
+            returns:
+                tuple - (mmap, длина записи, количество записей)
+                None - если раздела нет или файл поврежден
+        """
+
+        import os
+        import mmap
+
+        file_path = self._get_file_path(partition)
+        if not os.path.exists(file_path):
+            return None
+        self._flush(partition)
+        file_len = os.path.getsize(file_path)
+        if file_len < self._FILE_HEADER_LEN:
+            return None
+
+        mapped = self._maps.get(partition)
+        if mapped is None or mapped[2] != file_len:
+            if mapped is not None:
+                self._close_map(mapped)
+            fr = open(file_path, 'rb')
+            mm = mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ)
+            mapped = mm, fr, file_len
+            self._maps[partition] = mapped
+
+        mm = mapped[0]
+        if mm[0:4] != self.FILE_MAGIC or mm[4] != self.FILE_VERSION:
+            return None
+        row_len = int.from_bytes(mm[8:12], byteorder="little")
+        return mm, row_len, (file_len - self._FILE_HEADER_LEN) // row_len
+
+    @staticmethod
+    def _close_map(mapped: tuple):
+        """
+            Закрытие отображения раздела
+            Отображение, на буфер которого еще ссылается незавершенный обход (scan, query_*),
+            не закрывается явно (mmap.close вызвал бы BufferError) - оно закрывается при освобождении
+            последней ссылки, после завершения обхода; файл отображения закрывается сразу (mmap держит свою копию)
+        """
+
+        mm, fr, _ = mapped
+        try:
+            mm.close()
+        except BufferError:
+            pass
+        fr.close()
+
+    def _iter_distances(self, a: bytearray):
+        """
+            Расстояния от хэша запроса до всех записей его раздела, по блокам
+            yields:
+                tuple - (id строк блока (memoryview uint64), список расстояний в битах)
+        """
+
+        hash_int = _get_hash_int(a)
+        partition, body, row_len = self._get_row(hash_int)
+        mapped = self._get_map(partition)
+        if mapped is None:
+            return
+        mm, file_row_len, count_rows = mapped
+        if file_row_len != row_len:
+            return
+
+        # В строке запроса и маске байты id нулевые - id не участвует в расстоянии
+        query_row = bytes(self._ROW_ID_LEN) + body
+        mask_row = bytes(self._ROW_ID_LEN) + b'\xff' * len(body)
+        words_per_row = row_len // 8
+
+        with memoryview(mm) as view:
+            records = view[self._FILE_HEADER_LEN:self._FILE_HEADER_LEN + count_rows * row_len]
+            row_ids = records.cast('Q')[::words_per_row]
+            try:
+                for start, distances in _iter_packed_distances(records, query_row, row_len, mask_row):
+                    yield row_ids[start:start + len(distances)], distances
+            finally:
+                row_ids.release()
+                records.release()
+
+    def scan(self, a: bytearray):
+        """
+            Последовательный обход всех записей раздела хэша запроса
+            args:
+                a - хэш запроса (формата v1 или v2)
+            yields:
+                tuple - (id строки, расстояние в битах, значение от 0 до 100)
+            returns:
+                -2 - для хэша нераспознанного формата
+        """
+
+        hash_int = _get_hash_int(a)
+        if hash_int is None: return -2
+        return self._scan(a, hash_int[3])
+
+    def _scan(self, a: bytearray, count_bits: int):
+        for row_ids, distances in self._iter_distances(a):
+            for row_id, distance in zip(row_ids, distances):
+                yield row_id, distance, 100 - (distance / count_bits) * 100
+
+    def query_radius(self, a: bytearray, max_distance: int):
+        """
+            Поиск всех хэшей раздела на расстоянии в битах <= max_distance
+            args:
+                a - хэш запроса (формата v1 или v2)
+                max_distance - максимальное расстояние в битах
+            returns:
+                list - (id строки, расстояние в битах, значение от 0 до 100) по возрастанию расстояния
+                -2 - для хэша нераспознанного формата
+        """
+
+        hash_int = _get_hash_int(a)
+        if hash_int is None: return -2
+        count_bits = hash_int[3]
+
+        found = []
+        for row_ids, distances in self._iter_distances(a):
+            found.extend(
+                (distance, row_ids[i]) for i, distance in enumerate(distances) if distance <= max_distance
+            )
+
+        found.sort()
+        return [(row_id, distance, 100 - (distance / count_bits) * 100) for distance, row_id in found]
+
+    def query_knn(self, a: bytearray, k: int):
+        """
+            Поиск k ближайших хэшей раздела
+            args:
+                a - хэш запроса (формата v1 или v2)
+                k - количество ближайших хэшей
+            returns:
+                list - (id строки, расстояние в битах, значение от 0 до 100) по возрастанию расстояния
+                -2 - для хэша нераспознанного формата
+        """
+
+        hash_int = _get_hash_int(a)
+        if hash_int is None: return -2
+        count_bits = hash_int[3]
+        if k <= 0:
+            return []
+
+        from heapq import nsmallest
+
+        # Слияние k лучших кандидатов каждого блока - память ограничена размером блока
+        best = []
+        for row_ids, distances in self._iter_distances(a):
+            block_best = nsmallest(k, zip(distances, range(len(distances))))
+            best = nsmallest(k, best + [(distance, row_ids[i]) for distance, i in block_best])
+
+        return [(row_id, distance, 100 - (distance / count_bits) * 100) for distance, row_id in best]
+
+
+class HashCache:
+    """
+        Постоянный кэш перцептивных хэшей (SQLite), чтобы не декодировать неизмененные файлы повторно
+        Хэш хранится по дайджесту содержимого файла и параметрам хэширования
+        (формат цвета, размер сжатия, версия формата, быстрое декодирование).
+        Для файлов дополнительно хранится соответствие (путь, размер, mtime) -> дайджест,
+        поэтому для неизмененного файла хэш возвращается без чтения файла;
+        если mtime изменился, файл читается, и хэш ищется по дайджесту содержимого
+        При превышении max_entries вытесняются давно не использованные записи (LRU)
+        Время использования при попаданиях записывается пакетами по _TOUCH_BATCH_SIZE в отдельной
+        транзакции, поэтому между вызовами транзакция не остается открытой и база не блокируется
+        для других процессов
+    """
+
+    # Количество отложенных обновлений времени использования, записываемых одной транзакцией
+    _TOUCH_BATCH_SIZE = 1000
+
+    def __init__(self, path: str, max_entries: int = 1000000):
+        """
+            args:
+                path - путь до файла базы SQLite (':memory:' - кэш в памяти)
+                max_entries - максимальное количество хэшей в кэше
+        """
+
+        import sqlite3
+
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(
+            """
+                CREATE TABLE IF NOT EXISTS hashes (
+                    digest BLOB NOT NULL,
+                    color_format INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    hash_version INTEGER NOT NULL,
+                    fast_decode INTEGER NOT NULL,
+                    hash BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (digest, color_format, size, hash_version, fast_decode)
+                );
+                CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used);
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    file_size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    digest BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used);
+            """
+        )
+        self._count_entries = self._connection.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+        # Отложенные обновления времени использования: ключ хэша / путь файла -> время
+        self._touched_hashes = {}
+        self._touched_files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._count_entries
+
+    def close(self):
+        self._flush_touched()
+        self._connection.commit()
+        self._connection.close()
+
+    def _touch(self, touched: dict, key):
+        """
+            Отложенное обновление времени использования (запись - при накоплении пакета)
+        """
+
+        from time import time
+
+        touched[key] = time()
+        if len(self._touched_hashes) + len(self._touched_files) >= self._TOUCH_BATCH_SIZE:
+            self._flush_touched()
+            self._connection.commit()
+
+    def _flush_touched(self):
+        """
+            Запись отложенных обновлений времени использования в текущую транзакцию
+        """
+
+        if self._touched_hashes:
+            self._connection.executemany(
+                "UPDATE hashes SET last_used = ? "
+                "WHERE digest = ? AND color_format = ? AND size = ? AND hash_version = ? AND fast_decode = ?",
+                [(last_used,) + key for key, last_used in self._touched_hashes.items()]
+            )
+            self._touched_hashes = {}
+        if self._touched_files:
+            self._connection.executemany(
+                "UPDATE files SET last_used = ? WHERE path = ?",
+                [(last_used, path) for path, last_used in self._touched_files.items()]
+            )
+            self._touched_files = {}
+
+    @staticmethod
+    def get_digest(data: bytes):
+        """
+            Дайджест содержимого файла - ключ кэша
+        """
+
+        from hashlib import blake2b
+        return blake2b(data, digest_size=16).digest()
+
+    def stats(self):
+        """
+            Счетчики кэша
+            returns:
+                dict - {'hits', 'misses', 'entries', 'max_entries'}
+        """
+
+        return {'hits': self.hits, 'misses': self.misses, 'entries': self._count_entries, 'max_entries': self.max_entries}
+
+    def _get_key(self, digest: bytes, size: int, color_format: str, hash_version: int, fast_decode: bool,
+                 preprocess: int = 0):
+        # Флаги нормализации и код конвейера сжатия хранятся в старших битах столбца fast_decode -
+        #   прежние записи (preprocess = 0, режим совместимости) остаются действительными без изменения схемы
+        return (
+            digest, _get_color_format_params(color_format)[1], size, hash_version,
+            int(bool(fast_decode)) | preprocess << 1 | _get_resize_pipeline_code() << 5
+        )
+
+    def get(self, digest: bytes, size: int, color_format: str = 'bnw', hash_version: int = 1, fast_decode: bool = False,
+            preprocess: int = 0):
+        """
+            Поиск хэша по дайджесту содержимого и параметрам хэширования (счетчики не меняются)
+            returns:
+                bytearray(bytea) - Перцептивный хэш
+                None(NULL) - если хэша нет в кэше
+        """
+
+        key = self._get_key(digest, size, color_format, hash_version, fast_decode, preprocess)
+        row = self._connection.execute(
+            "SELECT hash FROM hashes WHERE digest = ? AND color_format = ? AND size = ? AND hash_version = ? AND fast_decode = ?",
+            key
+        ).fetchone()
+        if row is None:
+            return None
+
+        self._touch(self._touched_hashes, key)
+        return bytearray(row[0])
+
+    def put(self, digest: bytes, size: int, color_format: str, hash_version: int, fast_decode: bool, a: bytearray,
+            preprocess: int = 0):
+        """
+            Сохранение хэша по дайджесту содержимого и параметрам хэширования
+        """
+
+        from time import time
+
+        key = self._get_key(digest, size, color_format, hash_version, fast_decode, preprocess)
+        inserted = self._connection.execute(
+            "INSERT OR IGNORE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)", key + (bytes(a), time())
+        ).rowcount
+        if inserted:
+            self._count_entries += 1
+        else:
+            self._connection.execute(
+                "UPDATE hashes SET hash = ?, last_used = ? "
+                "WHERE digest = ? AND color_format = ? AND size = ? AND hash_version = ? AND fast_decode = ?",
+                (bytes(a), time()) + key
+            )
+        self._flush_touched()
+        self._evict()
+        self._connection.commit()
+
+    def _evict(self):
+        """
+            Вытеснение давно не использованных хэшей и записей файлов сверх max_entries
+        """
+
+        count_extra = self._count_entries - self.max_entries
+        if count_extra <= 0:
+            return
+        self._connection.execute(
+            "DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes ORDER BY last_used LIMIT ?)", (count_extra,)
+        )
+        self._connection.execute(
+            "DELETE FROM files WHERE rowid IN (SELECT rowid FROM files ORDER BY last_used LIMIT "
+            "MAX((SELECT COUNT(*) FROM files) - ?, 0))",
+            (self.max_entries,)
+        )
+        self._count_entries = self._connection.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def invalidate(self, path: str = None, digest: bytes = None):
+        """
+            Удаление записей кэша
+            args:
+                path - путь до файла: удаляется соответствие файла дайджесту и хэши его содержимого
+                digest - дайджест содержимого: удаляются все хэши этого содержимого
+            returns:
+                int - количество удаленных хэшей
+        """
+
+        self._flush_touched()
+        if path is not None:
+            row = self._connection.execute("SELECT digest FROM files WHERE path = ?", (path,)).fetchone()
+            self._connection.execute("DELETE FROM files WHERE path = ?", (path,))
+            if row is not None and digest is None:
+                digest = row[0]
+
+        count_deleted = 0
+        if digest is not None:
+            count_deleted = self._connection.execute("DELETE FROM hashes WHERE digest = ?", (digest,)).rowcount
+            self._count_entries -= count_deleted
+
+        self._connection.commit()
+        return count_deleted
+
+    def clear(self):
+        """
+            Полная очистка кэша и счетчиков
+        """
+
+        self._touched_hashes = {}
+        self._touched_files = {}
+        self._connection.execute("DELETE FROM hashes")
+        self._connection.execute("DELETE FROM files")
+        self._connection.commit()
+        self._count_entries = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _get_image_hash_bydata(self, data: bytes, size: int, color_format: str, hash_version: int, fast_decode: bool,
+                               digest: bytes = None, preprocess: int = 0):
+        """
+            Поиск хэша по дайджесту содержимого, при промахе - хэширование и сохранение
+        """
+
+        if digest is None:
+            digest = self.get_digest(data)
+        cached = self.get(digest, size, color_format, hash_version, fast_decode, preprocess)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        result = get_image_hash_bybytes(data, size, color_format, hash_version, fast_decode, preprocess)
+        # Ошибки чтения и превышения ограничений ресурсов не кэшируются
+        if result.__class__ == bytearray:
+            self.put(digest, size, color_format, hash_version, fast_decode, result, preprocess)
+        return result
+
+    def get_image_hash_bypath(self, filepath: str, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                              fast_decode: bool = False, preprocess: int = 0):
+        """
+            get_image_hash_bypath через кэш
+            returns:
+                bytearray(bytea) - Перцептивный хэш
+                None(NULL) - Если файл не существует
+                0 - Ошибка чтения файла
+                LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+        """
+
+        import os
+        from time import time
+
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+
+        # Неизмененный файл (путь, размер, mtime) - хэш по сохраненному дайджесту без чтения файла
+        row = self._connection.execute(
+            "SELECT digest FROM files WHERE path = ? AND file_size = ? AND mtime_ns = ?",
+            (filepath, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        if row is not None:
+            self._touch(self._touched_files, filepath)
+            cached = self.get(row[0], size, color_format, hash_version, fast_decode, preprocess)
+            if cached is not None:
+                self.hits += 1
+                return cached
+
+        # Файл изменен или неизвестен - чтение и поиск по дайджесту содержимого
+        if _LIMIT_BYTES and stat.st_size > _LIMIT_BYTES:
+            return LIMIT_EXCEEDED
+        try:
+            with open(filepath, 'rb') as fr:
+                data = fr.read()
+        except OSError:
+            return 0
+        digest = self.get_digest(data)
+        self._touched_files.pop(filepath, None)
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (filepath, stat.st_size, stat.st_mtime_ns, digest, time())
+            )
+
+        return self._get_image_hash_bydata(data, size, color_format, hash_version, fast_decode, digest, preprocess)
+
+    def get_image_hash_bybase64(self, base64str: str, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                                fast_decode: bool = False, preprocess: int = 0):
+        """
+            get_image_hash_bybase64 через кэш (ключ - дайджест декодированного содержимого)
+            returns:
+                bytearray(bytea) - Перцептивный хэш
+                0 - Ошибка чтения файла
+                LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+        """
+
+        from base64 import b64decode
+
+        try:
+            data = b64decode(base64str)
+        except:
+            return 0
+
+        return self._get_image_hash_bydata(data, size, color_format, hash_version, fast_decode, preprocess=preprocess)
+
+    def get_image_hash_byurl(self, url: str, size: int, color_format: str = 'bnw', hash_version: int = 1,
+                             fast_decode: bool = False, preprocess: int = 0):
+        """
+            get_image_hash_byurl через кэш (ключ - дайджест загруженного содержимого, декодирование пропускается)
+            returns:
+                bytearray(bytea) - Перцептивный хэш
+                0 - Ошибка загрузки или чтения файла
+                LIMIT_EXCEEDED - Превышено ограничение ресурсов (см. set_limits)
+        """
+
+        try:
+            data = _get_url_content(url)
+        except _LimitExceeded:
+            return LIMIT_EXCEEDED
+        except:
+            return 0
+
+        return self._get_image_hash_bydata(data, size, color_format, hash_version, fast_decode, preprocess=preprocess)
@@ -0,0 +1,565 @@
+"""
+    Замеры производительности функций ImAnTool (без сети, на синтетических изображениях и хэшах)
+
+    Запуск:
+        python bench.py                             -- полный набор, результат в JSON на stdout
+        python bench.py --quick -o before.json      -- сокращенный набор, результат в файл
+        python bench.py --hashes 10000 10000000     -- пакетный поиск по 10k и 10M хэшам
+        python bench.py --compare before.json after.json  -- сравнение двух запусков (p50 и пропускная способность)
+
+    Каждая группа замеров выполняется в отдельном процессе, поэтому peak_rss_kb - пиковая память группы.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ImAnTool as imt
+
+# Разрешения и форматы синтетических изображений
+IMAGE_RESOLUTIONS = ((64, 64), (640, 480), (1920, 1080), (4000, 3000))
+IMAGE_RESOLUTIONS_QUICK = ((64, 64), (640, 480), (1920, 1080))
+IMAGE_FORMATS = (('JPEG', 'jpg'), ('PNG', 'png'), ('WEBP', 'webp'), ('BMP', 'bmp'))
+
+# Изображение, на котором замеряются все точки входа (остальные - только через get_image_hash_bypath)
+REFERENCE_IMAGE = ((640, 480), 'JPEG')
+
+COLOR_FORMATS = ('bnw', 'grs', 'rgb', 'dhash', 'phash')
+SIZES = (8, 16, 32)
+
+# Количество хэшей для пакетного поиска (HashIndex строится только до --index-max)
+HASH_COUNTS = (10000, 100000, 1000000)
+HASH_COUNTS_QUICK = (10000, 100000)
+INDEX_MAX = 100000
+
+# Конвейеры сжатия и конвертации (imt.set_resize_pipeline) для группы pipeline
+PIPELINES = (
+    ('compat', {}),
+    ('box', {'resample': 'box'}),
+    ('bilinear', {'resample': 'bilinear'}),
+    ('reduce', {'resample': 'reduce'}),
+    ('convert_first', {'convert_first': True}),
+    ('no_dither', {'dither': False}),
+    ('fast', imt.RESIZE_PIPELINE_FAST),
+)
+
+# Количество пар для замера одиночных функций расстояния и вызовов в одном замере
+DISTANCE_PAIRS = 10000
+DISTANCE_NUMBER = 1000
+
+
+def _get_percentile(samples: list, percent: float):
+    """
+        Перцентиль по упорядоченному списку замеров (метод ближайшего ранга)
+    """
+
+    index = max(0, -(-len(samples) * percent // 100) - 1)
+    return samples[int(index)]
+
+
+def _get_result(group: str, name: str, params: dict, samples: list, rows: int = 1):
+    """
+        Запись результата: пропускная способность и перцентили задержки, мкс
+        args:
+            samples: время одного вызова, нс
+            rows: количество обработанных строк/изображений за вызов
+    """
+
+    samples = sorted(samples)
+    mean = sum(samples) / len(samples)
+    result = {
+        'group': group,
+        'name': name,
+        'params': params,
+        'samples': len(samples),
+        'ops_per_sec': 1e9 / mean if mean else None,
+        'latency_us': {
+            'min': samples[0] / 1e3,
+            'p50': _get_percentile(samples, 50) / 1e3,
+            'p90': _get_percentile(samples, 90) / 1e3,
+            'p99': _get_percentile(samples, 99) / 1e3,
+            'max': samples[-1] / 1e3,
+            'mean': mean / 1e3,
+        },
+    }
+    if rows != 1:
+        result['rows'] = rows
+        result['rows_per_sec'] = rows * 1e9 / mean if mean else None
+    return result
+
+
+def _measure(func, args: tuple = (), repeat: int = 5, number: int = 1, warmup: int = 1):
+    """
+        Замер времени вызова функции
+        returns:
+            list - время одного вызова по каждому повтору, нс (среднее по number вызовам)
+    """
+
+    from time import perf_counter_ns
+
+    for _ in range(warmup):
+        func(*args)
+
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter_ns()
+        for _ in range(number):
+            func(*args)
+        samples.append((perf_counter_ns() - start) / number)
+    return samples
+
+
+def _get_peak_rss():
+    """
+        Пиковый объем резидентной памяти процесса, КБ (None - если недоступно на платформе)
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS возвращает байты, Linux - килобайты
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+""" Синтетические данные """
+
+
+def _make_images(path: str, resolutions: tuple, seed: int):
+    """
+        Генерация воспроизводимых изображений: случайный шум низкого разрешения, увеличенный бикубически
+        returns:
+            list - [(имя файла, (ширина, высота), формат)]
+    """
+
+    from PIL import Image, features
+
+    rnd = random.Random(seed)
+    images = []
+    for width, height in resolutions:
+        base = Image.frombytes('RGB', (16, 12), rnd.randbytes(16 * 12 * 3))
+        img = base.resize((width, height), getattr(Image, 'Resampling', Image).BICUBIC)
+        for image_format, extension in IMAGE_FORMATS:
+            if image_format == 'WEBP' and not features.check('webp'):
+                continue
+            name = f"{width}x{height}.{extension}"
+            img.save(os.path.join(path, name), image_format)
+            images.append((name, (width, height), image_format))
+    return images
+
+
+def _make_hashes(count: int, hash_version: int, seed: int, size: int = 8):
+    """
+        Генерация воспроизводимых случайных хэшей формата bnw
+    """
+
+    rnd = random.Random(seed)
+    count_bytes = size * size // 8
+    hashes = []
+    for _ in range(count):
+        body = rnd.randbytes(count_bytes)
+        if hash_version == 2:
+            hashes.append(imt._get_hash_v2_header(1, size) + body)
+        else:
+            a = bytearray(2 + 2 * count_bytes)
+            a[0] = 1
+            a[2::2] = body
+            hashes.append(a)
+    return hashes
+
+
+def _start_server(path: str):
+    """
+        Локальный HTTP сервер с директорией изображений (замеры по url без внешней сети)
+    """
+
+    import threading
+    from functools import partial
+    from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=path))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+""" Группы замеров (каждая выполняется в отдельном процессе) """
+
+
+def _bench_hash(entry: str, path: str, images: list, repeat: int):
+    """
+        Замер точки входа get_image_hash_* для каждого color_format и size
+    """
+
+    from base64 import b64encode
+
+    results = []
+    server = None
+    if entry in ('byurl', 'byrequest', 'byurls'):
+        server = _start_server(path)
+        host = f"127.0.0.1:{server.server_port}"
+
+    name = next(name for name, resolution, image_format in images
+                if (resolution, image_format) == REFERENCE_IMAGE)
+    filepath = os.path.join(path, name)
+    with open(filepath, 'rb') as fr:
+        data = fr.read()
+    base64str = b64encode(data).decode('ascii')
+
+    def byfile(size, color_format):
+        with open(filepath, 'rb') as fr:
+            return imt.get_image_hash_byfile(fr, size, color_format)
+
+    calls = {
+        'bypath_fast_decode': lambda size, color_format: imt.get_image_hash_bypath(filepath, size, color_format,
+                                                                                   fast_decode=True),
+        'bybytes': lambda size, color_format: imt.get_image_hash_bybytes(data, size, color_format),
+        'byfile': byfile,
+        'bybase64': lambda size, color_format: imt.get_image_hash_bybase64(base64str, size, color_format),
+        'bybase64_stream': lambda size, color_format: imt.get_image_hash_bybase64_stream(base64str, size,
+                                                                                        color_format),
+        'byurl': lambda size, color_format: imt.get_image_hash_byurl(f"http://{host}/{name}", size, color_format),
+        'byrequest': lambda size, color_format: imt.get_image_hash_byrequest(host, name, 'GET', '', 'http',
+                                                                             size, color_format),
+    }
+
+    params = {'image': name, 'bytes': len(data)}
+    if entry == 'bypath':
+        # Все изображения, все форматы и размеры
+        for name, resolution, image_format in images:
+            filepath_image = os.path.join(path, name)
+            for color_format in COLOR_FORMATS:
+                for size in SIZES:
+                    samples = _measure(imt.get_image_hash_bypath, (filepath_image, size, color_format), repeat)
+                    results.append(_get_result(
+                        'hash', 'get_image_hash_bypath',
+                        {'image': name, 'resolution': resolution, 'format': image_format,
+                         'color_format': color_format, 'size': size},
+                        samples
+                    ))
+    elif entry in calls:
+        for color_format in COLOR_FORMATS:
+            for size in SIZES:
+                samples = _measure(calls[entry], (size, color_format), repeat)
+                results.append(_get_result(
+                    'hash', f"get_image_hash_{entry}", dict(params, color_format=color_format, size=size), samples
+                ))
+    elif entry == 'hashes_bypath':
+        for size in SIZES:
+            formats = [(color_format, size) for color_format in COLOR_FORMATS]
+            samples = _measure(imt.get_image_hashes_bypath, (filepath, formats), repeat)
+            results.append(_get_result(
+                'hash', 'get_image_hashes_bypath', dict(params, color_formats=list(COLOR_FORMATS), size=size),
+                samples
+            ))
+    elif entry == 'bypaths':
+        for workers in (1, None):
+            for color_format in COLOR_FORMATS:
+                samples = _measure(
+                    lambda: list(imt.get_image_hash_bypaths(path, 8, color_format, workers=workers)), (), repeat
+                )
+                results.append(_get_result(
+                    'hash', 'get_image_hash_bypaths',
+                    {'images': len(images), 'workers': workers, 'color_format': color_format,
+                     'size': 8},
+                    samples, len(images)
+                ))
+    elif entry == 'byurls':
+        urls = [f"http://{host}/{name}" for name, resolution, image_format in images]
+        for color_format in COLOR_FORMATS:
+            samples = _measure(lambda: list(imt.get_image_hash_byurls(urls, 8, color_format)), (), repeat)
+            results.append(_get_result(
+                'hash', 'get_image_hash_byurls', {'images': len(urls), 'color_format': color_format, 'size': 8},
+                samples, len(urls)
+            ))
+
+    if server is not None:
+        server.shutdown()
+    return results
+
+
+def _make_edited_images(path: str, images: list):
+    """
+        Измененные копии изображений для оценки устойчивости хэша: уменьшение до 90% и JPEG качества 40
+        returns:
+            dict - {имя файла: имя измененной копии}
+    """
+
+    from PIL import Image
+
+    edited = {}
+    for name, (width, height), image_format in images:
+        with Image.open(os.path.join(path, name)) as img:
+            img = img.convert('RGB').resize((width * 9 // 10, height * 9 // 10))
+        edited[name] = f"edited_{name}.jpg"
+        img.save(os.path.join(path, edited[name]), 'JPEG', quality=40)
+    return edited
+
+
+def _bench_pipeline(path: str, images: list, repeat: int):
+    """
+        Замер get_image_hash_bypath для каждого конвейера сжатия и конвертации (PIPELINES)
+        Кроме времени для каждого формата считаются (среднее по изображениям, бит):
+            compat_bits - расстояние до хэша в режиме совместимости
+            edited_bits - расстояние до хэша измененной копии (меньше - устойчивее)
+    """
+
+    images = [image for image in images if image[2] in ('JPEG', 'PNG')]
+    edited = _make_edited_images(path, images)
+    size = 16
+
+    compat_hashes = {}
+    results = []
+    for pipeline, options in PIPELINES:
+        imt.set_resize_pipeline(**options)
+        for color_format in COLOR_FORMATS:
+            compat_bits = []
+            edited_bits = []
+            for name, resolution, image_format in images:
+                filepath = os.path.join(path, name)
+                a = imt.get_image_hash_bypath(filepath, size, color_format)
+                compat_hashes.setdefault((name, color_format), a)
+                compat_bits.append(imt.get_hamming_distance(compat_hashes[(name, color_format)], a)[0])
+                b = imt.get_image_hash_bypath(os.path.join(path, edited[name]), size, color_format)
+                edited_bits.append(imt.get_hamming_distance(a, b)[0])
+
+                samples = _measure(imt.get_image_hash_bypath, (filepath, size, color_format), repeat)
+                results.append(_get_result(
+                    'pipeline', 'get_image_hash_bypath',
+                    {'pipeline': pipeline, 'image': name, 'resolution': resolution, 'format': image_format,
+                     'color_format': color_format, 'size': size},
+                    samples
+                ))
+            results.append({
+                'group': 'pipeline',
+                'name': 'accuracy',
+                'params': {'pipeline': pipeline, 'color_format': color_format, 'size': size},
+                'compat_bits': sum(compat_bits) / len(compat_bits),
+                'edited_bits': sum(edited_bits) / len(edited_bits),
+            })
+    imt.set_resize_pipeline()
+    return results
+
+
+def _bench_distance(repeat: int, seed: int):
+    """
+        Замер одиночных функций расстояния Хэмминга на парах случайных хэшей
+    """
+
+    results = []
+    for hash_version in (1, 2):
+        hashes = _make_hashes(DISTANCE_PAIRS * 2, hash_version, seed)
+        pairs = list(zip(hashes[::2], hashes[1::2]))
+        functions = [imt.get_hamming_distance]
+        if hash_version == 1:
+            # Функции исходного формата
+            functions += [imt.get_simple_hamming_distance, imt.get_detail_hamming_distance]
+        for func in functions:
+            def run():
+                for a, b in pairs[:DISTANCE_NUMBER]:
+                    func(a, b)
+            samples = [sample / DISTANCE_NUMBER for sample in _measure(run, (), repeat * 10)]
+            results.append(_get_result(
+                'distance', func.__name__, {'hash_version': hash_version, 'size': 8}, samples
+            ))
+    return results
+
+
+def _bench_batch(count: int, repeat: int, seed: int):
+    """
+        Замер пакетного сравнения и матрицы расстояний по count случайным хэшам
+    """
+
+    results = []
+    for hash_version in (1, 2):
+        hashes = _make_hashes(count, hash_version, seed)
+        queries = _make_hashes(8, hash_version, seed + 1)
+        params = {'hashes': count, 'hash_version': hash_version, 'size': 8}
+        for top_k, max_distance in ((0, -1), (10, -1), (0, 10)):
+            samples = _measure(imt.get_hamming_distances, (queries[0], hashes, top_k, max_distance), repeat)
+            results.append(_get_result(
+                'batch', 'get_hamming_distances', dict(params, top_k=top_k, max_distance=max_distance),
+                samples, count
+            ))
+        samples = _measure(imt.get_hamming_distance_matrix, (queries, hashes, 10), repeat)
+        results.append(_get_result(
+            'batch', 'get_hamming_distance_matrix', dict(params, queries=len(queries), top_k=10),
+            samples, count * len(queries)
+        ))
+    return results
+
+
+def _bench_search(count: int, repeat: int, seed: int, index: bool):
+    """
+        Замер построения и поиска по HashStore (и HashIndex, если index) на count случайных хэшах
+    """
+
+    from time import perf_counter_ns
+    from tempfile import TemporaryDirectory
+
+    results = []
+    hashes = _make_hashes(count, 2, seed)
+    queries = _make_hashes(repeat, 2, seed + 1)
+    params = {'hashes': count, 'hash_version': 2, 'size': 8}
+
+    with TemporaryDirectory() as path:
+        with imt.HashStore(path) as hash_store:
+            start = perf_counter_ns()
+            hash_store.append_many(enumerate(hashes))
+            hash_store.close()
+            results.append(_get_result('search', 'HashStore.append_many', params,
+                                       [perf_counter_ns() - start], count))
+        with imt.HashStore(path) as hash_store:
+            for name, method, arg in (('query_knn', hash_store.query_knn, 10),
+                                      ('query_radius', hash_store.query_radius, 10)):
+                samples = []
+                for query in queries:
+                    samples += _measure(method, (query, arg), 1)
+                results.append(_get_result('search', f"HashStore.{name}", dict(params, arg=arg), samples, count))
+
+    if index:
+        hash_index = imt.HashIndex()
+        start = perf_counter_ns()
+        for key, a in enumerate(hashes):
+            hash_index.insert(key, a)
+        results.append(_get_result('search', 'HashIndex.insert', params, [perf_counter_ns() - start], count))
+        for name, method, arg in (('query_knn', hash_index.query_knn, 10),
+                                  ('query_radius', hash_index.query_radius, 10)):
+            samples = []
+            for query in queries:
+                samples += _measure(method, (query, arg), 1, warmup=0)
+            results.append(_get_result('search', f"HashIndex.{name}", dict(params, arg=arg), samples, count))
+    return results
+
+
+def _run_group(group: tuple):
+    """
+        Выполнение группы замеров и добавление пиковой памяти процесса
+    """
+
+    kind, args = group
+    results = globals()[f"_bench_{kind}"](*args)
+    peak_rss = _get_peak_rss()
+    for result in results:
+        result['peak_rss_kb'] = peak_rss
+    return results
+
+
+""" Запуск и сравнение """
+
+
+def _get_meta(args):
+    import platform
+    import subprocess
+    import PIL
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'pillow': PIL.__version__,
+        'args': vars(args),
+    }
+
+
+def _get_key(result: dict):
+    return result['group'], result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(before_path: str, after_path: str):
+    """
+        Вывод сравнения двух запусков: отношение p50 и пропускной способности (after / before)
+    """
+
+    with open(before_path) as fr:
+        before = {_get_key(result): result for result in json.load(fr)['results']}
+    with open(after_path) as fr:
+        after = json.load(fr)['results']
+
+    print(f"{'name':<40} {'params':<70} {'p50 before':>12} {'p50 after':>12} {'speedup':>8}")
+    for result in after:
+        old = before.get(_get_key(result))
+        # Строки без времени (accuracy группы pipeline) не сравниваются
+        if old is None or 'latency_us' not in result:
+            continue
+        p50_before, p50_after = old['latency_us']['p50'], result['latency_us']['p50']
+        speedup = p50_before / p50_after if p50_after else float('inf')
+        print(f"{result['name']:<40} {_get_key(result)[2][:70]:<70} {p50_before:>12.2f} {p50_after:>12.2f} {speedup:>7.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замеры производительности ImAnTool')
+    parser.add_argument('-o', '--output', help='файл для результата JSON (по умолчанию stdout)')
+    parser.add_argument('--quick', action='store_true', help='сокращенный набор (без 4000x3000 и 1M хэшей)')
+    parser.add_argument('--repeat', type=int, default=5, help='количество замеров на каждый случай')
+    parser.add_argument('--hashes', type=int, nargs='+', help='количества хэшей для пакетного поиска')
+    parser.add_argument('--index-max', type=int, default=INDEX_MAX, help='максимум хэшей для построения HashIndex')
+    parser.add_argument('--groups', nargs='+', choices=('hash', 'pipeline', 'distance', 'batch', 'search'),
+                        default=('hash', 'pipeline', 'distance', 'batch', 'search'), help='группы замеров')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='сравнить два файла результатов')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    from tempfile import TemporaryDirectory
+
+    counts = args.hashes or (HASH_COUNTS_QUICK if args.quick else HASH_COUNTS)
+    resolutions = IMAGE_RESOLUTIONS_QUICK if args.quick else IMAGE_RESOLUTIONS
+
+    with TemporaryDirectory() as path:
+        groups = []
+        if 'hash' in args.groups or 'pipeline' in args.groups:
+            images = _make_images(path, resolutions, args.seed)
+        if 'pipeline' in args.groups:
+            groups.append(('pipeline', (path, images, args.repeat)))
+        if 'hash' in args.groups:
+            for entry in ('bypath', 'bypath_fast_decode', 'bybytes', 'byfile', 'bybase64', 'bybase64_stream',
+                          'byurl', 'byrequest', 'hashes_bypath', 'bypaths', 'byurls'):
+                groups.append(('hash', (entry, path, images, args.repeat)))
+        if 'distance' in args.groups:
+            groups.append(('distance', (args.repeat, args.seed)))
+        for count in counts:
+            if 'batch' in args.groups:
+                groups.append(('batch', (count, args.repeat, args.seed)))
+            if 'search' in args.groups:
+                groups.append(('search', (count, args.repeat, args.seed, count <= args.index_max)))
+
+        results = []
+        for group in groups:
+            print(f"{group[0]}: {group[1][0]}", file=sys.stderr)
+            # Новый процесс на каждую группу: пиковая память не накапливается между группами
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                results += executor.submit(_run_group, group).result()
+
+    report = json.dumps({'meta': _get_meta(args), 'results': results}, ensure_ascii=False, indent=1)
+    if args.output:
+        with open(args.output, 'w') as fw:
+            fw.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
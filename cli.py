@@ -0,0 +1,288 @@
+"""
+    Командная строка ImAnTool: хэширование, сравнение хэшей и поиск по файлу хэшей
+    Результаты пишутся в stdout построчно (JSON Lines или CSV) по мере готовности, в постоянной памяти;
+    Pillow и requests импортируются только командами, которым они нужны
+
+    Запуск:
+        python cli.py hash source_img photo.jpg -s 16 -c dhash          -- файлы и директории (пул процессов)
+        python cli.py hash --urls urls.txt -o csv                       -- список url (файл или '-' - stdin)
+        python cli.py hash --base64 < images.txt                        -- строки base64 или "id<TAB>base64" из stdin
+        python cli.py compare HASH HASH [HASH ...]                      -- расстояние от первого хэша до остальных
+        python cli.py query HASH hashes.jsonl --top-k 10 --radius 8     -- поиск по файлу хэшей (вывод hash/sync)
+
+    Строки hash: path, status (ok / missing / error / limit), hash (hex) - формат CsvHashSink / JsonlHashSink
+"""
+
+import argparse
+import sys
+
+import ImAnTool as imt
+
+# Количество хэшей файла, сравниваемых за один пакетный вызов в query
+QUERY_BATCH_SIZE = 10000
+
+
+class _RowWriter:
+    """
+        Построчный вывод словарей в stdout в JSON Lines или CSV (заголовок - по полям fields)
+    """
+
+    def __init__(self, output_format: str, fields: tuple, file=None):
+        self._file = file or sys.stdout
+        self._fields = fields
+        self._writer = None
+        if output_format == 'csv':
+            import csv
+
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(fields)
+
+    def write(self, row: dict):
+        if self._writer is None:
+            from json import dumps
+
+            self._file.write(dumps(row, ensure_ascii=False) + '\n')
+        else:
+            self._writer.writerow(['' if row[field] is None else row[field] for field in self._fields])
+        self._file.flush()
+
+
+def _get_status(a):
+    """
+        Статус строки результата хэширования
+    """
+
+    if a.__class__ == bytearray:
+        return 'ok'
+    elif a is None:
+        return 'missing'
+    elif a == imt.LIMIT_EXCEEDED:
+        return 'limit'
+    return 'error'
+
+
+def _iter_lines(path: str):
+    """
+        Непустые строки файла или stdin ('-') без перевода строки
+    """
+
+    file = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield line
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def _get_base64_hash(line: str, size: int, color_format: str, hash_version: int, fast_decode: bool,
+                     preprocess: int):
+    """
+        Хэш строки base64 в процессе-обработчике
+    """
+
+    return imt.get_image_hash_bybase64(line, size, color_format, hash_version, fast_decode, preprocess)
+
+
+def _iter_base64_hashes(lines, workers: int, **params):
+    """
+        Хэширование строк "base64" или "id<TAB>base64" (id по умолчанию - номер строки с 1)
+        Количество строк в обработке ограничено, чтобы не читать весь stdin заранее
+        yields:
+            tuple - (id, результат get_image_hash_bybase64) в порядке строк
+    """
+
+    def split(number, line):
+        source, _, data = line.rpartition('\t')
+        return source or str(number), data
+
+    rows = (split(number, line) for number, line in enumerate(lines, 1))
+    if workers is not None and workers <= 1:
+        for source, data in rows:
+            yield source, _get_base64_hash(data, **params)
+        return
+
+    import os
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    settings = imt._get_worker_settings()
+    with ProcessPoolExecutor(max_workers=workers, initializer=imt._set_worker_settings, initargs=settings) as executor:
+        pending = deque()
+        for source, data in rows:
+            pending.append((source, executor.submit(_get_base64_hash, data, **params)))
+            if len(pending) >= workers * 4:
+                source, future = pending.popleft()
+                yield source, future.result()
+        while pending:
+            source, future = pending.popleft()
+            yield source, future.result()
+
+
+def command_hash(args):
+    params = {
+        'size': args.size, 'color_format': args.color_format, 'hash_version': args.hash_version,
+        'fast_decode': args.fast_decode, 'preprocess': args.preprocess,
+    }
+
+    if args.urls:
+        results = imt.get_image_hash_byurls(_iter_lines(args.urls), concurrency=args.concurrency, **params)
+    elif args.base64:
+        results = _iter_base64_hashes(_iter_lines('-'), args.workers, **params)
+    else:
+        results = imt.get_image_hash_bypaths(
+            args.paths, workers=args.workers, recursive=not args.no_recursive, **params
+        )
+
+    sink_class = imt.CsvHashSink if args.output_format == 'csv' else imt.JsonlHashSink
+    with sink_class(sys.stdout) as sink:
+        for source, a in results:
+            sink.write([(source, _get_status(a), a)])
+
+
+def _parse_hash(text: str):
+    try:
+        return bytearray.fromhex(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('хэш должен быть в hex: %r' % text)
+
+
+def command_compare(args):
+    writer = _RowWriter(args.output_format, ('hash', 'distance', 'score'))
+    for b in args.hashes:
+        result = imt.get_hamming_distance(args.hash, b)
+        if result.__class__ == tuple:
+            writer.write({'hash': b.hex(), 'distance': result[0], 'score': result[1]})
+        else:
+            # -2 / -1 - разные форматы или размерности хэшей
+            writer.write({'hash': b.hex(), 'distance': result, 'score': None})
+
+
+def _iter_hash_rows(path: str):
+    """
+        Строки файла хэшей (вывод команды hash или sync_image_hashes, JSON Lines или CSV)
+        yields:
+            tuple - (path, bytearray хэша); строки без хэша пропускаются
+    """
+
+    import csv
+    from itertools import chain
+    from json import loads
+
+    lines = _iter_lines(path)
+    first = next(lines, None)
+    if first is None:
+        return
+    lines = chain((first,), lines)
+
+    if first.startswith('{'):
+        rows = ((row.get('path'), row.get('hash')) for row in map(loads, lines))
+    else:
+        rows = ((row.get('path'), row.get('hash')) for row in csv.DictReader(lines))
+
+    for source, text in rows:
+        if text:
+            yield source, bytearray.fromhex(text)
+
+
+def command_query(args):
+    from heapq import heappush, heappushpop
+    from itertools import islice
+
+    writer = _RowWriter(args.output_format, ('path', 'hash', 'distance', 'score'))
+    rows = _iter_hash_rows(args.file)
+    # Без радиуса - любое расстояние (не больше количества бит хэша): результат всегда с индексами
+    max_distance = args.radius if args.radius >= 0 else len(args.hash) * 8
+
+    # Куча top-k лучших по всем пакетам (по убыванию расстояния - через отрицательное расстояние)
+    best = []
+    order = 0
+    while True:
+        batch = list(islice(rows, QUERY_BATCH_SIZE))
+        if not batch:
+            break
+        found = imt.get_hamming_distances(args.hash, [a for _, a in batch], args.top_k, max_distance)
+        if found == -2:
+            sys.exit('хэш запроса нераспознанного формата')
+
+        for i, distance, score in found:
+            source, a = batch[i]
+            if args.top_k <= 0:
+                # Без top-k совпадения выводятся сразу, без накопления
+                writer.write({'path': source, 'hash': a.hex(), 'distance': distance, 'score': score})
+                continue
+            order += 1
+            item = (-distance, -order, source, a, score)
+            if len(best) < args.top_k:
+                heappush(best, item)
+            elif item > best[0]:
+                heappushpop(best, item)
+
+    for distance, _, source, a, score in sorted(best, reverse=True):
+        writer.write({'path': source, 'hash': a.hex(), 'distance': -distance, 'score': score})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Перцептивные хэши изображений ImAnTool')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('-o', '--output-format', choices=('jsonl', 'csv'), default='jsonl', help='формат вывода')
+
+    hash_parser = subparsers.add_parser('hash', parents=[output], help='хэширование изображений')
+    hash_parser.add_argument('paths', nargs='*', help='файлы и директории')
+    sources = hash_parser.add_mutually_exclusive_group()
+    sources.add_argument('--urls', metavar='FILE', help="файл со списком url ('-' - stdin)")
+    sources.add_argument('--base64', action='store_true', help='строки base64 или "id<TAB>base64" из stdin')
+    hash_parser.add_argument('-s', '--size', type=int, default=16, help='размер сжатия изображения')
+    hash_parser.add_argument('-c', '--color-format', choices=('bnw', 'grs', 'rgb', 'dhash', 'phash'), default='bnw')
+    hash_parser.add_argument('-v', '--hash-version', type=int, choices=(1, 2), default=1)
+    hash_parser.add_argument('--fast-decode', action='store_true', help='декодирование в уменьшенном разрешении')
+    hash_parser.add_argument('--preprocess', type=int, default=0, help='сумма флагов PREPROCESS_*')
+    hash_parser.add_argument('-w', '--workers', type=int, help='количество процессов (по умолчанию - по числу ядер)')
+    hash_parser.add_argument('--concurrency', type=int, default=16, help='одновременных загрузок url')
+    hash_parser.add_argument('--no-recursive', action='store_true', help='не обходить поддиректории')
+    hash_parser.add_argument('--resample', choices=imt.RESIZE_FILTERS,
+                             help='фильтр сжатия (по умолчанию - как в прежних версиях, set_resize_pipeline)')
+    hash_parser.add_argument('--convert-first', action='store_true', help='конвертация в режим хэша до сжатия')
+    hash_parser.add_argument('--no-dither', action='store_true', help="'bnw' по порогу, без дизеринга")
+    hash_parser.add_argument('--max-bytes', type=int, default=0, help='ограничение размера файла (set_limits)')
+    hash_parser.add_argument('--max-pixels', type=int, default=0, help='ограничение пикселей (set_limits)')
+    hash_parser.add_argument('--max-seconds', type=float, default=0, help='ограничение времени (set_limits)')
+
+    compare_parser = subparsers.add_parser('compare', parents=[output], help='расстояние между хэшами')
+    compare_parser.add_argument('hash', type=_parse_hash, help='хэш (hex)')
+    compare_parser.add_argument('hashes', type=_parse_hash, nargs='+', help='хэши для сравнения (hex)')
+
+    query_parser = subparsers.add_parser('query', parents=[output], help='поиск похожих хэшей в файле хэшей')
+    query_parser.add_argument('hash', type=_parse_hash, help='хэш запроса (hex)')
+    query_parser.add_argument('file', help="файл хэшей JSON Lines / CSV ('-' - stdin)")
+    query_parser.add_argument('-k', '--top-k', type=int, default=0, help='количество ближайших (0 - все)')
+    query_parser.add_argument('-r', '--radius', type=int, default=-1, help='максимальное расстояние в битах')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'hash':
+        if not (args.paths or args.urls or args.base64):
+            parser.error('hash: нужны пути, --urls или --base64')
+        # Ограничения и конвейер сжатия передаются процессам-обработчикам через initializer пула
+        imt.set_limits(args.max_bytes, args.max_pixels, args.max_seconds)
+        imt.set_resize_pipeline(args.resample, args.convert_first, not args.no_dither)
+        command_hash(args)
+    elif args.command == 'compare':
+        command_compare(args)
+    else:
+        command_query(args)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except BrokenPipeError:
+        # Вывод закрыт раньше времени (например, '| head') - без трассировки
+        import os
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
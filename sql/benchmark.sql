@@ -0,0 +1,121 @@
+-- Замер накладных расходов на вызов функций ImAnTool из PostgreSQL: "до" и "после" кэширования в SD/GD
+--
+-- Запуск из корня репозитория:
+--   psql -d mydb -v repo="$(pwd)" -v rows=100000 -f sql/benchmark.sql
+--
+-- "До" - функции в исходном виде: модули импортируются в теле функции на каждом вызове,
+--        поиск похожих - вызов функции расстояния на каждую строку таблицы
+-- "После" - обертки из sql/imantool.sql: модуль взят из SD, поиск похожих - одна функция над массивом
+
+\set ON_ERROR_STOP on
+\if :{?rows}
+\else
+    \set rows 100000
+\endif
+
+SET imantool.path = :'repo';
+\i sql/imantool.sql
+SELECT imantool_init();
+
+
+-- Функции "до": импорт модулей на каждом вызове, как в исходных функциях ImAnTool.py
+
+CREATE OR REPLACE FUNCTION imantool_bench_noop(a bytea, b bytea)
+RETURNS double precision AS $$
+    return 0
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_bench_naive_detail_hamming_distance(a bytea, b bytea)
+RETURNS double precision AS $$
+    import os
+    import io
+    import base64
+    import requests
+    from PIL import Image
+    import ImAnTool
+    return ImAnTool.get_detail_hamming_distance(a, b)
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_bench_naive_hash_bybase64(base64str text, size integer, color_format text)
+RETURNS bytea AS $$
+    import os
+    import io
+    import base64
+    import requests
+    from PIL import Image
+    import ImAnTool
+    result = ImAnTool.get_image_hash_bybase64(base64str, size, color_format)
+    return b'' if result == 0 else result
+$$ LANGUAGE plpython3u;
+
+
+-- Синтетические хэши v1 и v2 (bnw, размер 8) и тестовое изображение
+
+DROP TABLE IF EXISTS imantool_bench_hashes;
+CREATE TEMP TABLE imantool_bench_hashes AS
+SELECT
+    i AS id,
+    imantool_convert_hash_v2_to_v1(decode('01020800' || substr(md5(i::text), 1, 16), 'hex')) AS hash_v1,
+    decode('01020800' || substr(md5(i::text), 1, 16), 'hex') AS hash_v2
+FROM generate_series(1, :rows) AS i;
+
+DROP TABLE IF EXISTS imantool_bench_images;
+CREATE TEMP TABLE imantool_bench_images AS
+SELECT imantool_base64_bypath(:'repo' || '/source_img/a-let.jpg') AS base64str;
+
+
+DO $$
+DECLARE
+    count_rows integer := (SELECT count(*) FROM imantool_bench_hashes);
+    count_images integer := 200;
+    query_v1 bytea := (SELECT hash_v1 FROM imantool_bench_hashes WHERE id = 1);
+    query_v2 bytea := (SELECT hash_v2 FROM imantool_bench_hashes WHERE id = 1);
+    image text := (SELECT base64str FROM imantool_bench_images);
+    started timestamptz;
+
+    -- Время в микросекундах на вызов/строку
+    elapsed double precision;
+BEGIN
+    started := clock_timestamp();
+    PERFORM imantool_bench_noop(query_v1, hash_v1) FROM imantool_bench_hashes;
+    elapsed := extract(epoch FROM clock_timestamp() - started) * 1e6 / count_rows;
+    RAISE NOTICE 'Пустая функция PL/Python:                         % мкс/строку', round(elapsed::numeric, 3);
+
+    started := clock_timestamp();
+    PERFORM imantool_bench_naive_detail_hamming_distance(query_v1, hash_v1) FROM imantool_bench_hashes;
+    elapsed := extract(epoch FROM clock_timestamp() - started) * 1e6 / count_rows;
+    RAISE NOTICE 'До:    detail расстояние, импорт на каждом вызове: % мкс/строку', round(elapsed::numeric, 3);
+
+    started := clock_timestamp();
+    PERFORM imantool_detail_hamming_distance(query_v1, hash_v1) FROM imantool_bench_hashes;
+    elapsed := extract(epoch FROM clock_timestamp() - started) * 1e6 / count_rows;
+    RAISE NOTICE 'После: detail расстояние, модуль из SD:            % мкс/строку', round(elapsed::numeric, 3);
+
+    started := clock_timestamp();
+    PERFORM imantool_hamming_distance(query_v2, hash_v2) FROM imantool_bench_hashes;
+    elapsed := extract(epoch FROM clock_timestamp() - started) * 1e6 / count_rows;
+    RAISE NOTICE 'После: побитовое расстояние, модуль из SD:         % мкс/строку', round(elapsed::numeric, 3);
+
+    started := clock_timestamp();
+    PERFORM * FROM imantool_hamming_distances(query_v2, (SELECT array_agg(hash_v2) FROM imantool_bench_hashes), 10);
+    elapsed := extract(epoch FROM clock_timestamp() - started) * 1e6 / count_rows;
+    RAISE NOTICE 'После: пакетный top-10 одним вызовом над массивом: % мкс/строку', round(elapsed::numeric, 3);
+
+    started := clock_timestamp();
+    PERFORM imantool_bench_naive_hash_bybase64(image, 32, 'rgb') FROM generate_series(1, count_images);
+    elapsed := extract(epoch FROM clock_timestamp() - started) * 1e6 / count_images;
+    RAISE NOTICE 'До:    хэш из base64, импорт на каждом вызове:     % мкс/вызов', round(elapsed::numeric, 3);
+
+    started := clock_timestamp();
+    PERFORM imantool_hash_bybase64(image, 32, 'rgb') FROM generate_series(1, count_images);
+    elapsed := extract(epoch FROM clock_timestamp() - started) * 1e6 / count_images;
+    RAISE NOTICE 'После: хэш из base64, модуль из SD:                % мкс/вызов', round(elapsed::numeric, 3);
+END
+$$;
+
+
+DROP FUNCTION imantool_bench_noop(bytea, bytea);
+DROP FUNCTION imantool_bench_naive_detail_hamming_distance(bytea, bytea);
+DROP FUNCTION imantool_bench_naive_hash_bybase64(text, integer, text);
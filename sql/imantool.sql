@@ -0,0 +1,562 @@
+-- ImAnTool -- обертки PL/Python3u для функций модуля ImAnTool.py
+--
+-- Установка:
+--   1. Модуль ImAnTool.py и зависимости (requirements.txt) должны быть доступны python сервера PostgreSQL
+--   2. Путь до директории с ImAnTool.py задается параметром imantool.path
+--      (если модуль не установлен в site-packages), например:
+--          ALTER DATABASE mydb SET imantool.path = '/opt/ImAnTool';
+--   3. psql -d mydb -f sql/imantool.sql
+--   4. Права на выполнение выдаются только роли imantool_user (создается без права входа), например:
+--          GRANT imantool_user TO app_user;
+--      plpython3u - недоверенный язык: функции выполняются с правами процесса сервера и читают любые файлы
+--      сервера (*_bypath, *_bypaths), загружают любые url (*_byurl, *_byrequest, *_byurls), создают
+--      директории и файлы SQLite (imantool_store_append, imantool_cached_hash_bypath) и читают файлы индексов
+--      (imantool_index_load) по любому пути, поэтому право EXECUTE у PUBLIC отзывается для всех функций imantool_*
+--
+-- Модуль импортируется один раз за сессию (GD['imantool']), каждая функция хранит ссылку на него в SD.
+-- Функции форматов и расстояний объявлены STABLE, а не IMMUTABLE: первый вызов в сессии выполняет
+-- запрос imantool_init(), а путь к модулю зависит от параметра imantool.path.
+-- Загруженные индексы, хранилища и кэши хэшей хранятся в GD и переиспользуются между вызовами.
+--
+-- Соглашения о результатах (как в ImAnTool.py):
+--   NULL - файл не существует
+--   '\x' (пустой bytea) - ошибка чтения файла (0 в ImAnTool.py)
+--                         или превышение ограничения ресурсов (LIMIT_EXCEEDED, см. imantool_set_limits)
+--   -2 / -1 - ошибка разных форматов / размерности хэшей
+
+CREATE EXTENSION IF NOT EXISTS plpython3u;
+
+
+-- Загрузка модуля в GD (вызывается остальными функциями при первом обращении в сессии)
+CREATE OR REPLACE FUNCTION imantool_init()
+RETURNS boolean AS $$
+    if 'imantool' not in GD:
+        import sys
+        path = plpy.execute("SELECT current_setting('imantool.path', true) AS path")[0]['path']
+        if path and path not in sys.path:
+            sys.path.insert(0, path)
+        import ImAnTool
+        GD['imantool'] = ImAnTool
+        GD['imantool_indexes'] = {}
+        GD['imantool_stores'] = {}
+        GD['imantool_caches'] = {}
+    return True
+$$ LANGUAGE plpython3u;
+
+
+-- Хэширование
+-- preprocess - сумма флагов нормализации PREPROCESS_* модуля (1 - EXIF, 2 - прозрачность, 4 - поля,
+--              8 - выравнивание гистограммы, 15 - все), 0 - без нормализации
+
+-- Прежние сигнатуры без preprocess: иначе CREATE OR REPLACE добавит перегрузку,
+--   и вызовы без последних аргументов станут неоднозначными
+DROP FUNCTION IF EXISTS imantool_hash_bypath(text, integer, text, integer, boolean);
+DROP FUNCTION IF EXISTS imantool_hash_byurl(text, integer, text, integer, boolean);
+DROP FUNCTION IF EXISTS imantool_hash_byrequest(text, text, text, text, text, integer, text, integer, boolean);
+DROP FUNCTION IF EXISTS imantool_hash_bybase64(text, integer, text, integer, boolean);
+DROP FUNCTION IF EXISTS imantool_hash_bybytes(bytea, integer, text, integer, boolean);
+DROP FUNCTION IF EXISTS imantool_hashes_bypath(text, text[], integer[], integer, boolean);
+DROP FUNCTION IF EXISTS imantool_hashes_bybase64(text, text[], integer[], integer, boolean);
+DROP FUNCTION IF EXISTS imantool_hash_bypaths(text[], integer, text, integer, boolean, integer);
+DROP FUNCTION IF EXISTS imantool_hash_byurls(text[], integer, text, integer, boolean, integer, double precision);
+DROP FUNCTION IF EXISTS imantool_cached_hash_bypath(text, text, integer, text, integer, boolean);
+
+CREATE OR REPLACE FUNCTION imantool_hash_bypath(filepath text, size integer, color_format text DEFAULT 'bnw',
+                                                hash_version integer DEFAULT 1, fast_decode boolean DEFAULT false,
+                                                preprocess integer DEFAULT 0)
+RETURNS bytea AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.get_image_hash_bypath(filepath, size, color_format, hash_version, fast_decode, preprocess)
+    return b'' if result in (0, imt.LIMIT_EXCEEDED) else result
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_hash_byurl(url text, size integer, color_format text DEFAULT 'bnw',
+                                               hash_version integer DEFAULT 1, fast_decode boolean DEFAULT false,
+                                               preprocess integer DEFAULT 0)
+RETURNS bytea AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.get_image_hash_byurl(url, size, color_format, hash_version, fast_decode, preprocess)
+    return b'' if result in (0, imt.LIMIT_EXCEEDED) else result
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_hash_byrequest(domain text, qpath text, method text, payload text, schema text,
+                                                   size integer, color_format text DEFAULT 'bnw',
+                                                   hash_version integer DEFAULT 1, fast_decode boolean DEFAULT false,
+                                                   preprocess integer DEFAULT 0)
+RETURNS bytea AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.get_image_hash_byrequest(domain, qpath, method, payload, schema, size, color_format,
+                                          hash_version, fast_decode, preprocess)
+    return b'' if result in (0, imt.LIMIT_EXCEEDED) else result
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_hash_bybase64(base64str text, size integer, color_format text DEFAULT 'bnw',
+                                                  hash_version integer DEFAULT 1, fast_decode boolean DEFAULT false,
+                                                  preprocess integer DEFAULT 0)
+RETURNS bytea AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.get_image_hash_bybase64_stream(base64str, size, color_format, hash_version, fast_decode,
+                                                preprocess)
+    return b'' if result in (0, imt.LIMIT_EXCEEDED) else result
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_hash_bybytes(data bytea, size integer, color_format text DEFAULT 'bnw',
+                                                 hash_version integer DEFAULT 1, fast_decode boolean DEFAULT false,
+                                                 preprocess integer DEFAULT 0)
+RETURNS bytea AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.get_image_hash_bybytes(data, size, color_format, hash_version, fast_decode, preprocess)
+    return b'' if result in (0, imt.LIMIT_EXCEEDED) else result
+$$ LANGUAGE plpython3u;
+
+
+-- Набор хэшей за одно декодирование: пары (color_formats[i], sizes[i])
+CREATE OR REPLACE FUNCTION imantool_hashes_bypath(filepath text, color_formats text[], sizes integer[],
+                                                  hash_version integer DEFAULT 1, fast_decode boolean DEFAULT false,
+                                                  preprocess integer DEFAULT 0)
+RETURNS TABLE (color_format text, size integer, hash bytea) AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.get_image_hashes_bypath(filepath, list(zip(color_formats, sizes)), hash_version, fast_decode,
+                                         preprocess)
+    if result is None:
+        return []
+    if result in (0, imt.LIMIT_EXCEEDED):
+        return [(color_format, size, b'') for color_format, size in zip(color_formats, sizes)]
+    return [(color_format, size, value) for (color_format, size), value in result.items()]
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_hashes_bybase64(base64str text, color_formats text[], sizes integer[],
+                                                    hash_version integer DEFAULT 1, fast_decode boolean DEFAULT false,
+                                                    preprocess integer DEFAULT 0)
+RETURNS TABLE (color_format text, size integer, hash bytea) AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.get_image_hashes_bybase64(base64str, list(zip(color_formats, sizes)), hash_version, fast_decode,
+                                           preprocess)
+    if result in (0, imt.LIMIT_EXCEEDED):
+        return [(color_format, size, b'') for color_format, size in zip(color_formats, sizes)]
+    return [(color_format, size, value) for (color_format, size), value in result.items()]
+$$ LANGUAGE plpython3u;
+
+
+-- Пакетное хэширование файлов/директорий (workers > 1 запускает пул процессов из backend - осторожно)
+CREATE OR REPLACE FUNCTION imantool_hash_bypaths(paths text[], size integer, color_format text DEFAULT 'bnw',
+                                                 hash_version integer DEFAULT 1, fast_decode boolean DEFAULT false,
+                                                 workers integer DEFAULT 1, preprocess integer DEFAULT 0)
+RETURNS TABLE (path text, hash bytea) AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    for filepath, result in imt.get_image_hash_bypaths(paths, size, color_format, hash_version, fast_decode, workers,
+                                                       preprocess=preprocess):
+        yield filepath, (b'' if result in (0, imt.LIMIT_EXCEEDED) else result)
+$$ LANGUAGE plpython3u;
+
+
+-- Асинхронное хэширование списка url
+CREATE OR REPLACE FUNCTION imantool_hash_byurls(urls text[], size integer, color_format text DEFAULT 'bnw',
+                                                hash_version integer DEFAULT 1, fast_decode boolean DEFAULT false,
+                                                concurrency integer DEFAULT 16, timeout double precision DEFAULT 10,
+                                                preprocess integer DEFAULT 0)
+RETURNS TABLE (url text, hash bytea) AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    results = imt.get_image_hash_byurls(urls, size, color_format, hash_version, fast_decode=fast_decode,
+                                        concurrency=concurrency, timeout=timeout, preprocess=preprocess)
+    return [(result_url, b'' if result in (0, imt.LIMIT_EXCEEDED) else result) for result_url, result in results]
+$$ LANGUAGE plpython3u;
+
+
+-- Хэширование через постоянный кэш (кэш открывается один раз за сессию)
+CREATE OR REPLACE FUNCTION imantool_cached_hash_bypath(cache_path text, filepath text, size integer,
+                                                       color_format text DEFAULT 'bnw', hash_version integer DEFAULT 1,
+                                                       fast_decode boolean DEFAULT false, preprocess integer DEFAULT 0)
+RETURNS bytea AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    caches = GD['imantool_caches']
+    if cache_path not in caches:
+        caches[cache_path] = imt.HashCache(cache_path)
+    result = caches[cache_path].get_image_hash_bypath(filepath, size, color_format, hash_version, fast_decode,
+                                                      preprocess)
+    return b'' if result in (0, imt.LIMIT_EXCEEDED) else result
+$$ LANGUAGE plpython3u;
+
+
+-- base64 ('-2' - ошибка)
+
+CREATE OR REPLACE FUNCTION imantool_base64_bypath(path text)
+RETURNS text AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.get_base64_bypath(path)
+    return result.decode('ascii') if isinstance(result, bytes) else str(result)
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_base64_byurl(url text)
+RETURNS text AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.get_base64_byurl(url)
+    return result.decode('ascii') if isinstance(result, bytes) else str(result)
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_base64_byrequest(domain text, qpath text, method text, payload text, schema text)
+RETURNS text AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.get_base64_byrequest(domain, qpath, method, payload, schema)
+    return result.decode('ascii') if isinstance(result, bytes) else str(result)
+$$ LANGUAGE plpython3u;
+
+
+-- Форматы хэшей
+
+CREATE OR REPLACE FUNCTION imantool_convert_hash_v1_to_v2(a bytea)
+RETURNS bytea AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.convert_hash_v1_to_v2(a)
+    return None if result == -2 else result
+$$ LANGUAGE plpython3u STABLE STRICT;
+
+
+CREATE OR REPLACE FUNCTION imantool_convert_hash_v2_to_v1(a bytea)
+RETURNS bytea AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.convert_hash_v2_to_v1(a)
+    return None if result == -2 else result
+$$ LANGUAGE plpython3u STABLE STRICT;
+
+
+-- Расстояния
+
+CREATE OR REPLACE FUNCTION imantool_simple_hamming_distance(a bytea, b bytea)
+RETURNS double precision AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    return imt.get_simple_hamming_distance(a, b)
+$$ LANGUAGE plpython3u STABLE STRICT;
+
+
+CREATE OR REPLACE FUNCTION imantool_detail_hamming_distance(a bytea, b bytea)
+RETURNS double precision AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    return imt.get_detail_hamming_distance(a, b)
+$$ LANGUAGE plpython3u STABLE STRICT;
+
+
+-- Побитовое расстояние: (расстояние в битах, рейтинг 0..100); при ошибке оба поля равны -2 / -1
+CREATE OR REPLACE FUNCTION imantool_hamming_distance(a bytea, b bytea, OUT distance integer, OUT score double precision)
+AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    result = imt.get_hamming_distance(a, b)
+    return (result, result) if result.__class__ == int else result
+$$ LANGUAGE plpython3u STABLE STRICT;
+
+
+-- Пакетный поиск похожих: idx - индекс хэша в массиве hashes (с 1), строки с ошибками -2/-1 и NULL пропускаются
+CREATE OR REPLACE FUNCTION imantool_hamming_distances(a bytea, hashes bytea[], top_k integer DEFAULT 0,
+                                                      max_distance integer DEFAULT -1)
+RETURNS TABLE (idx integer, distance integer, score double precision) AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    # STRICT проверяет только сам массив: NULL элементы отбрасываются, индексы остальных сохраняются
+    positions = [i for i, h in enumerate(hashes) if h is not None]
+    results = imt.get_hamming_distances(a, [hashes[i] for i in positions], top_k, max_distance)
+    if results == -2:
+        return []
+    if top_k > 0 or max_distance >= 0:
+        return [(positions[i] + 1, distance, score) for i, distance, score in results]
+    return [(positions[i] + 1,) + result for i, result in enumerate(results) if result.__class__ == tuple]
+$$ LANGUAGE plpython3u STABLE STRICT;
+
+
+CREATE OR REPLACE FUNCTION imantool_hamming_distance_matrix(queries bytea[], hashes bytea[], top_k integer DEFAULT 0,
+                                                            max_distance integer DEFAULT -1)
+RETURNS TABLE (query_idx integer, idx integer, distance integer, score double precision) AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    # NULL элементы обоих массивов отбрасываются (см. imantool_hamming_distances)
+    query_positions = [i for i, q in enumerate(queries) if q is not None]
+    positions = [i for i, h in enumerate(hashes) if h is not None]
+    filtered = top_k > 0 or max_distance >= 0
+    matrix = imt.get_hamming_distance_matrix(
+                [queries[i] for i in query_positions], [hashes[i] for i in positions], top_k, max_distance
+            )
+    for query_idx, results in zip(query_positions, matrix):
+        if results == -2:
+            continue
+        if filtered:
+            for i, distance, score in results:
+                yield query_idx + 1, positions[i] + 1, distance, score
+        else:
+            for i, result in enumerate(results):
+                if result.__class__ == tuple:
+                    yield (query_idx + 1, positions[i] + 1) + result
+$$ LANGUAGE plpython3u STABLE STRICT;
+
+
+-- Индекс хэшей (BK-дерево), хранится в GD по имени до конца сессии
+
+CREATE OR REPLACE FUNCTION imantool_index_load(name text, path text)
+RETURNS boolean AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    index = imt.HashIndex.load(path)
+    if index is None or index == 0:
+        return False
+    GD['imantool_indexes'][name] = index
+    return True
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_index_save(name text, path text)
+RETURNS boolean AS $$
+    if 'imt' not in SD:
+        plpy.execute("SELECT imantool_init()")
+        SD['imt'] = GD['imantool']
+    index = GD['imantool_indexes'].get(name)
+    if index is None:
+        return False
+    index.save(path)
+    return True
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_index_insert(name text, key bigint, a bytea)
+RETURNS boolean AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    indexes = GD['imantool_indexes']
+    if name not in indexes:
+        indexes[name] = imt.HashIndex()
+    return indexes[name].insert(key, a) is True
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_index_delete(name text, key bigint)
+RETURNS boolean AS $$
+    if 'imt' not in SD:
+        plpy.execute("SELECT imantool_init()")
+        SD['imt'] = GD['imantool']
+    index = GD['imantool_indexes'].get(name)
+    return index is not None and index.delete(key)
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_index_radius(name text, a bytea, max_distance integer)
+RETURNS TABLE (key bigint, distance integer, score double precision) AS $$
+    if 'imt' not in SD:
+        plpy.execute("SELECT imantool_init()")
+        SD['imt'] = GD['imantool']
+    index = GD['imantool_indexes'].get(name)
+    if index is None:
+        return []
+    results = index.query_radius(a, max_distance)
+    return [] if results == -2 else results
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_index_knn(name text, a bytea, k integer)
+RETURNS TABLE (key bigint, distance integer, score double precision) AS $$
+    if 'imt' not in SD:
+        plpy.execute("SELECT imantool_init()")
+        SD['imt'] = GD['imantool']
+    index = GD['imantool_indexes'].get(name)
+    if index is None:
+        return []
+    results = index.query_knn(a, k)
+    return [] if results == -2 else results
+$$ LANGUAGE plpython3u;
+
+
+-- Файловое хранилище хэшей (mmap), открывается один раз за сессию
+
+CREATE OR REPLACE FUNCTION imantool_store_append(path text, row_id bigint, a bytea)
+RETURNS boolean AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    stores = GD['imantool_stores']
+    if path not in stores:
+        stores[path] = imt.HashStore(path)
+    return stores[path].append(row_id, a) is True
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_store_radius(path text, a bytea, max_distance integer)
+RETURNS TABLE (row_id bigint, distance integer, score double precision) AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    stores = GD['imantool_stores']
+    if path not in stores:
+        stores[path] = imt.HashStore(path)
+    results = stores[path].query_radius(a, max_distance)
+    return [] if results == -2 else results
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_store_knn(path text, a bytea, k integer)
+RETURNS TABLE (row_id bigint, distance integer, score double precision) AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    stores = GD['imantool_stores']
+    if path not in stores:
+        stores[path] = imt.HashStore(path)
+    results = stores[path].query_knn(a, k)
+    return [] if results == -2 else results
+$$ LANGUAGE plpython3u;
+
+
+-- Инструментирование хэширования (в пределах сессии)
+
+CREATE OR REPLACE FUNCTION imantool_enable_metrics(enabled boolean DEFAULT true)
+RETURNS jsonb AS $$
+    import json
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    if enabled:
+        imt.enable_metrics()
+        return None
+    return json.dumps(imt.disable_metrics())
+$$ LANGUAGE plpython3u;
+
+
+CREATE OR REPLACE FUNCTION imantool_metrics(reset boolean DEFAULT false)
+RETURNS jsonb AS $$
+    import json
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    return json.dumps(imt.get_metrics(reset))
+$$ LANGUAGE plpython3u;
+
+
+-- Ограничения ресурсов одного вызова хэширования (в пределах сессии, 0 - без ограничения)
+CREATE OR REPLACE FUNCTION imantool_set_limits(max_bytes bigint DEFAULT 0, max_pixels bigint DEFAULT 0,
+                                               max_seconds double precision DEFAULT 0)
+RETURNS jsonb AS $$
+    import json
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    imt.set_limits(max_bytes, max_pixels, max_seconds)
+    return json.dumps(imt.get_limits())
+$$ LANGUAGE plpython3u;
+
+
+-- Конвейер сжатия и конвертации перед хэшированием (в пределах сессии, без аргументов - режим совместимости)
+-- NULL - неизвестный фильтр (настройки не меняются)
+CREATE OR REPLACE FUNCTION imantool_set_resize_pipeline(resample text DEFAULT NULL, convert_first boolean DEFAULT false,
+                                                        dither boolean DEFAULT true)
+RETURNS jsonb AS $$
+    import json
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    if imt.set_resize_pipeline(resample, convert_first, dither) == -2:
+        return None
+    return json.dumps(imt.get_resize_pipeline())
+$$ LANGUAGE plpython3u;
+
+-- Группировка дублей коллекции: ids[i] - id хэша hashes[i], пары с NULL пропускаются
+CREATE OR REPLACE FUNCTION imantool_hash_clusters(ids bigint[], hashes bytea[], max_distance integer,
+                                                  min_cluster_size integer DEFAULT 2)
+RETURNS TABLE (cluster_id bigint, id bigint) AS $$
+    imt = SD.get('imt')
+    if imt is None:
+        plpy.execute("SELECT imantool_init()")
+        imt = SD['imt'] = GD['imantool']
+    rows = [(i, h) for i, h in zip(ids, hashes) if i is not None and h is not None]
+    return imt.get_hash_clusters(rows, max_distance, 0, min_cluster_size)
+$$ LANGUAGE plpython3u;
+
+
+-- Права: EXECUTE для всех функций imantool_* схемы установки (включая прежние перегрузки) только у imantool_user
+DO $$
+DECLARE
+    func regprocedure;
+BEGIN
+    IF NOT EXISTS (SELECT FROM pg_roles WHERE rolname = 'imantool_user') THEN
+        CREATE ROLE imantool_user NOLOGIN;
+    END IF;
+    FOR func IN
+        SELECT p.oid::regprocedure
+        FROM pg_proc p
+        WHERE p.proname LIKE 'imantool\_%' AND p.pronamespace = current_schema()::regnamespace
+    LOOP
+        EXECUTE format('REVOKE ALL ON FUNCTION %s FROM PUBLIC', func);
+        EXECUTE format('GRANT EXECUTE ON FUNCTION %s TO imantool_user', func);
+    END LOOP;
+END
+$$;
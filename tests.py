@@ -1,3 +1,4 @@
+import os
 import ImAnTool as imt
 
 # Пути к 3 тестовым изображениям
@@ -19,6 +20,10 @@ img_payload = ''
 color_format = 'rgb'
 zip_size = 32
 
+# Тесты изображения 4 по url требуют доступа в сеть: при IMANTOOL_TESTS_OFFLINE=1 они пропускаются,
+#   а вместо изображения 4 в остальных тестах используется изображение 3
+tests_offline = os.environ.get('IMANTOOL_TESTS_OFFLINE') == '1'
+
 
 
 """ Тестирование результатов """
@@ -26,24 +31,132 @@ zip_size = 32
 # Хэширование по пути в файловой системе
 a_1_hash = imt.get_image_hash_bypath(img_path, zip_size, color_format)
 
+# Хэширование с декодированием в уменьшенном разрешении
+a_1_fast_hash = imt.get_image_hash_bypath(img_path, zip_size, color_format, fast_decode=True)
+
+# Набор хэшей нескольких форматов и размеров за одно декодирование
+a_1_hashes = imt.get_image_hashes_bypath(img_path, [('bnw', 8), ('grs', 16), (color_format, zip_size)])
+
+# Хэширование через постоянный кэш (повторный вызов не декодирует файл)
+hash_cache = imt.HashCache(':memory:')
+hash_cache.get_image_hash_bypath(img_path, zip_size, color_format)
+a_1_cached_hash = hash_cache.get_image_hash_bypath(img_path, zip_size, color_format)
+hash_cache_stats = hash_cache.stats()
+hash_cache.close()
+
+# Пакетное хэширование директории с тестовыми изображениями (в текущем процессе)
+dir_hashes = dict(imt.get_image_hash_bypaths('source_img', zip_size, color_format, workers=1))
+
 # Хэширование по получению base64 из изображения в файловой системе
 a_2_b64 = imt.get_base64_bypath(img_colored_path)
 a_2_hash = imt.get_image_hash_bybase64(a_2_b64, zip_size, color_format)
 
+# Хэширование из байтов файла и потоковое декодирование base64 без промежуточных копий
+with open(img_colored_path, 'rb') as fr:
+    a_2_bytes_hash = imt.get_image_hash_bybytes(fr.read(), zip_size, color_format)
+a_2_stream_hash = imt.get_image_hash_bybase64_stream(a_2_b64, zip_size, color_format)
+
+# Разностный хэш (dHash) и перцептивный хэш на основе DCT (pHash)
+a_1_dhash = imt.get_image_hash_bypath(img_path, 8, 'dhash')
+a_2_dhash = imt.get_image_hash_bybase64(a_2_b64, 8, 'dhash')
+a_1_phash = imt.get_image_hash_bypath(img_path, 8, 'phash')
+a_2_phash = imt.get_image_hash_bybase64(a_2_b64, 8, 'phash')
+
+# Нормализация перед хэшированием (EXIF, прозрачность, поля, гистограмма)
+a_1_norm_hash = imt.get_image_hash_bypath(img_path, 16, 'grs', preprocess=imt.PREPROCESS_ALL)
+a_2_norm_hash = imt.get_image_hash_bybase64(a_2_b64, 16, 'grs', preprocess=imt.PREPROCESS_ALL)
+
+# Хэши повернутых и отраженных вариантов за одно декодирование и поиск без учета ориентации
+a_1_transforms = imt.get_image_hash_transforms_bypath(img_path, 16, 'grs')
+a_1_rotated_distance = imt.get_transform_hamming_distance(a_1_transforms[imt.HASH_TRANSFORMS.index('ROTATE_90')], a_1_transforms[0])
+
+# Ограничение ресурсов: изображение больше max_pixels не декодируется
+imt.set_limits(max_pixels=1000)
+a_1_limited_hash = imt.get_image_hash_bypath(img_path, zip_size, color_format)
+imt.set_limits()
+
+# Хэши кадров и сигнатура последовательности (для однокадрового изображения - один кадр)
+a_1_frames, a_1_signature = imt.get_image_frame_hashes_bypath(img_path, zip_size, color_format)
+a_2_frames, a_2_signature = imt.get_image_frame_hashes_bypath(img_colored_path, zip_size, color_format)
+
+# Быстрый конвейер сжатия: 'bnw' по порогу без дизеринга (set_resize_pipeline() - режим совместимости)
+imt.set_resize_pipeline(**imt.RESIZE_PIPELINE_FAST)
+a_1_fast_pipeline_hash = imt.get_image_hash_bypath(img_path, 16, 'bnw')
+a_2_fast_pipeline_hash = imt.get_image_hash_bybase64(a_2_b64, 16, 'bnw')
+imt.set_resize_pipeline()
+a_1_compat_pipeline_hash = imt.get_image_hash_bypath(img_path, 16, 'bnw')
+a_2_compat_pipeline_hash = imt.get_image_hash_bybase64(a_2_b64, 16, 'bnw')
+
+# Пакетное хэширование с быстрым конвейером и с ограничением пикселей в пуле процессов spawn (по умолчанию на macOS/Windows):
+#   запуск в отдельном интерпретаторе, чтобы процессы-обработчики не импортировали этот файл
+import subprocess
+import sys
+spawn_workers_check = subprocess.run([sys.executable, '-c', '''
+import multiprocessing
+import ImAnTool as imt
+multiprocessing.set_start_method('spawn')
+imt.set_resize_pipeline(**imt.RESIZE_PIPELINE_FAST)
+single = dict(imt.get_image_hash_bypaths('source_img', 16, 'bnw', workers=1))
+pooled = dict(imt.get_image_hash_bypaths('source_img', 16, 'bnw', workers=2, chunk_size=1))
+imt.set_resize_pipeline()
+imt.set_limits(max_pixels=1000)
+limited = dict(imt.get_image_hash_bypaths('source_img', 16, 'bnw', workers=2, chunk_size=1))
+print(single == pooled, set(limited.values()) == {imt.LIMIT_EXCEEDED})
+'''], capture_output=True, text=True).stdout.strip()
+
+# Хэши тайлов на нескольких масштабах и поиск фрагмента (левая верхняя четверть) по инвертированному индексу
+from PIL import Image
+import io
+a_1_quarter = io.BytesIO()
+Image.open(img_path).crop((0, 0, 234, 352)).save(a_1_quarter, 'PNG')
+a_1_tiles = imt.get_image_tile_hashes_bypath(img_path, 8, 'dhash')
+a_1_quarter_tiles = imt.get_image_tile_hashes_bybytes(a_1_quarter.getvalue(), 8, 'dhash')
+tile_index = imt.TileIndex()
+tile_index.insert(1, a_1_tiles)
+tile_index.insert(3, imt.get_image_tile_hashes_bypath('source_img/a-let_moved.jpg', 8, 'dhash'))
+a_1_quarter_found = tile_index.query(a_1_quarter_tiles, top_k=1)
+
+# Инструментирование: времена этапов и счетчики вызовов
+imt.enable_metrics()
+a_2_measured_hash = imt.get_image_hash_bybase64(a_2_b64, zip_size, color_format)
+imt.get_image_hash_bypath('source_img/missing.jpg', zip_size, color_format)
+hash_metrics = imt.disable_metrics()
+
 # Хэширование по url и сложносоставному запросу
-a_4_hash = imt.get_image_hash_byurl(img_url, zip_size, color_format)
-a_4_rhash = imt.get_image_hash_byrequest(   img_domain, 
-                                            img_qpath, 
-                                            img_method, 
-                                            img_payload, 
-                                            img_schema, 
-                                            zip_size, 
-                                            color_format
-                                        )
+if not tests_offline:
+    a_4_hash = imt.get_image_hash_byurl(img_url, zip_size, color_format)
+    a_4_rhash = imt.get_image_hash_byrequest(   img_domain, 
+                                                img_qpath, 
+                                                img_method, 
+                                                img_payload, 
+                                                img_schema, 
+                                                zip_size, 
+                                                color_format
+                                            )
+    assert isinstance(a_4_hash, bytearray) and isinstance(a_4_rhash, bytearray), \
+        f"{img_url} недоступен - запуск без сети: IMANTOOL_TESTS_OFFLINE=1 python tests.py"
+
+# Асинхронное хэширование списка url через локальный HTTP сервер с тестовыми изображениями
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+local_server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory='source_img'))
+threading.Thread(target=local_server.serve_forever, daemon=True).start()
+local_urls = [f"http://127.0.0.1:{local_server.server_port}/{name}" for name in ('a-let.jpg', 'a-let_colored.jpg', 'missing.jpg')]
+local_url_hashes = dict(imt.get_image_hash_byurls(local_urls, zip_size, color_format, timeout=5))
+local_server.shutdown()
 
 # Хэширование по base64 из url
-a_4_b64 = imt.get_base64_byurl(img_url)
-a_4_b64_hash = imt.get_image_hash_bybase64(a_4_b64, zip_size, color_format)
+if not tests_offline:
+    a_4_b64 = imt.get_base64_byurl(img_url)
+    a_4_b64_hash = imt.get_image_hash_bybase64(a_4_b64, zip_size, color_format)
+else:
+    a_4_hash = a_4_rhash = a_4_b64_hash = imt.get_image_hash_bypath(img_moved_path, zip_size, color_format)
 
 
 a1_a2 = imt.get_simple_hamming_distance(a_1_hash, a_2_hash)
@@ -51,7 +164,102 @@ a1_a2_d = imt.get_detail_hamming_distance(a_1_hash, a_2_hash)
 a2_a4 = imt.get_detail_hamming_distance(a_2_hash, a_4_hash)
 a4r_a4b64h = imt.get_detail_hamming_distance(a_4_rhash, a_4_b64_hash)
 
+# Хэширование в компактном формате v2 и сравнение с хэшем формата v1
+a_1_hash_v2 = imt.get_image_hash_bypath(img_path, zip_size, color_format, 2)
+a1v2_a2_d = imt.get_detail_hamming_distance(a_1_hash_v2, a_2_hash)
+a1v2_a1 = imt.convert_hash_v2_to_v1(a_1_hash_v2) == a_1_hash
+
+# Побитовое расстояние Хэмминга (XOR + popcount)
+a1_a2_bits, a1_a2_bits_score = imt.get_hamming_distance(a_1_hash, a_2_hash)
+
+# Пакетное сравнение одного хэша с массивом хэшей
+a1_top = imt.get_hamming_distances(a_1_hash, [a_2_hash, a_4_hash, a_4_rhash, a_1_hash_v2], top_k=2)
+
+# Поиск похожих хэшей по индексу (BK-дерево)
+hash_index = imt.HashIndex()
+for key, key_hash in (('a-let_colored', a_2_hash), ('url', a_4_hash), ('request', a_4_rhash)):
+    hash_index.insert(key, key_hash)
+a1_knn = hash_index.query_knn(a_1_hash, 2)
+
+# Группировка дублей коллекции (полосы бит + union-find)
+hash_clusters = list(imt.get_hash_clusters(
+                        [('a-let', a_1_hash), ('a-let_colored', a_2_hash), ('url', a_4_hash), ('v2', a_1_hash_v2)], 100
+                    ))
+
+# Поиск похожих хэшей в файловом хранилище (mmap)
+from tempfile import TemporaryDirectory
+with TemporaryDirectory() as store_path, imt.HashStore(store_path) as hash_store:
+    hash_store.append_many([(2, a_2_hash), (4, a_4_hash), (5, a_4_rhash)])
+    a1_store_knn = hash_store.query_knn(a_1_hash, 2)
+
+# Инкрементальная синхронизация директории: повторный запуск не хэширует неизмененные файлы,
+#   файл, входящий в несколько путей, хэшируется один раз
+with TemporaryDirectory() as sync_path:
+    sync_manifest = os.path.join(sync_path, 'manifest.sqlite')
+    with imt.JsonlHashSink(os.path.join(sync_path, 'hashes.jsonl')) as sync_sink:
+        sync_first = imt.sync_image_hashes('source_img', sync_manifest, sync_sink, zip_size, color_format, workers=1)
+        sync_second = imt.sync_image_hashes('source_img', sync_manifest, sync_sink, zip_size, color_format, workers=1)
+    with imt.JsonlHashSink(os.path.join(sync_path, 'overlap.jsonl')) as sync_sink:
+        sync_overlap = imt.sync_image_hashes(
+                        ['source_img', img_path], os.path.join(sync_path, 'overlap.sqlite'), sync_sink, zip_size,
+                        color_format, workers=2
+                    )
+
+# Некорректные входные данные: не буфер - ошибка чтения (0), base64 в URL-safe алфавите декодируется
+import base64
+a_2_invalid_bytes_hash = imt.get_image_hash_bybytes('не байты', zip_size, color_format)
+with open(img_colored_path, 'rb') as fr:
+    a_2_urlsafe_hash = imt.get_image_hash_bybase64_stream(base64.urlsafe_b64encode(fr.read()), zip_size, color_format)
+
+# Проверки результатов
+assert isinstance(a_1_hash, bytearray) and isinstance(a_2_hash, bytearray)
+assert a1v2_a2_d == a1_a2_d and a1v2_a1
+assert a1_a2 == a1_a2_bits_score
+assert dir_hashes[img_path] == a_1_hash
+assert a_1_hashes[(color_format, zip_size)] == a_1_hash
+assert local_url_hashes[local_urls[0]] == a_1_hash and local_url_hashes[local_urls[1]] == a_2_hash
+assert a_1_cached_hash == a_1_hash and hash_cache_stats['hits'] == 1
+assert a_2_bytes_hash == a_2_hash and a_2_stream_hash == a_2_hash and a_2_urlsafe_hash == a_2_hash
+assert a_2_invalid_bytes_hash == 0
+assert a_2_measured_hash == a_2_hash
+assert sync_second['unchanged'] == sum(sync_first.values()) and sync_second['added'] == 0
+assert sync_overlap == sync_first
+assert a_1_limited_hash == imt.LIMIT_EXCEEDED
+assert a_1_frames[0][1] == a_1_hash and a_1_signature == a_1_hash
+assert a_1_rotated_distance[0] == 0
+assert a_1_quarter_found[0][0] == 1
+assert spawn_workers_check == 'True True'
+assert a1_knn[0][1] <= a1_knn[1][1] and a1_store_knn[0][1] <= a1_store_knn[1][1]
+
 print(f"Одинаковые изображения, разного цвета, простое расстояние, из разных источников: {a1_a2}")
 print(f"Одинаковые изображения, разного цвета, детальное расстояние, из разных источников: {a1_a2_d}")
-print(f"Похожие изображения, похожего цвета, детальное расстояние, из разных источников: {a2_a4}")
-print(f"Одно и то же изображение, разные источники, детальное расстояние: {a4r_a4b64h}")
+if not tests_offline:
+    print(f"Похожие изображения, похожего цвета, детальное расстояние, из разных источников: {a2_a4}")
+    print(f"Одно и то же изображение, разные источники, детальное расстояние: {a4r_a4b64h}")
+print(f"Хэш v2 и хэш v1, детальное расстояние: {a1v2_a2_d} (совпадает с v1: {a1v2_a2_d == a1_a2_d})")
+print(f"Конвертация v2 -> v1 совпадает с исходным хэшем v1: {a1v2_a1}")
+print(f"Одинаковые изображения, разного цвета, побитовое расстояние: {a1_a2_bits} бит, рейтинг {a1_a2_bits_score}")
+print(f"Пакетное сравнение, 2 ближайших хэша (индекс, расстояние, рейтинг): {a1_top}")
+print(f"Поиск по индексу, 2 ближайших хэша (ключ, расстояние, рейтинг): {a1_knn}")
+print(f"Поиск в файловом хранилище, 2 ближайших хэша (id, расстояние, рейтинг): {a1_store_knn}")
+print(f"Пакетное хэширование директории совпадает с get_image_hash_bypath: {dir_hashes[img_path] == a_1_hash}")
+print(f"Полное и быстрое декодирование, побитовое расстояние: {imt.get_hamming_distance(a_1_hash, a_1_fast_hash)}")
+print(f"Набор хэшей за одно декодирование совпадает с get_image_hash_bypath: {a_1_hashes[(color_format, zip_size)] == a_1_hash}")
+print(f"Асинхронное хэширование url совпадает с get_image_hash_bypath: {local_url_hashes[local_urls[0]] == a_1_hash}, отсутствующий файл: {local_url_hashes[local_urls[2]]}")
+print(f"Хэш из кэша совпадает с get_image_hash_bypath: {a_1_cached_hash == a_1_hash}, счетчики кэша: {hash_cache_stats}")
+print(f"Хэш из байтов и потокового base64 совпадает с хэшем из base64: {a_2_bytes_hash == a_2_hash and a_2_stream_hash == a_2_hash}, URL-safe base64: {a_2_urlsafe_hash == a_2_hash}, не буфер: {a_2_invalid_bytes_hash}")
+print(f"Одинаковые изображения, разного цвета, dHash: {imt.get_hamming_distance(a_1_dhash, a_2_dhash)}, pHash: {imt.get_hamming_distance(a_1_phash, a_2_phash)}")
+print(f"Хэш с инструментированием совпадает: {a_2_measured_hash == a_2_hash}, результаты: {hash_metrics['results']}, этапы: {list(hash_metrics['stages'])}")
+print(f"Кластеры дублей (id кластера, id): {hash_clusters}")
+print(f"Одинаковые изображения, разного цвета, с нормализацией, побитовое расстояние: {imt.get_hamming_distance(a_1_norm_hash, a_2_norm_hash)}")
+print(f"Повернутый на 90 градусов вариант, расстояние без учета ориентации (бит, рейтинг, преобразование): {a_1_rotated_distance}")
+print(f"Синхронизация директории, первый запуск: {sync_first}, повторный: {sync_second}, пересекающиеся пути: {sync_overlap}")
+print(f"Превышение ограничения пикселей возвращает LIMIT_EXCEEDED: {a_1_limited_hash == imt.LIMIT_EXCEEDED}")
+print(f"Хэш первого кадра и сигнатура совпадают с get_image_hash_bypath: {a_1_frames[0][1] == a_1_hash and a_1_signature == a_1_hash}, расстояние последовательностей: {imt.get_sequence_distance(a_1_frames, a_2_frames)}")
+print(f"Фрагмент изображения по тайлам (совпавшие тайлы, рейтинг): {imt.get_tile_similarity(a_1_quarter_tiles, a_1_tiles)}, поиск по индексу: {a_1_quarter_found}")
+print(f"Пул spawn: хэши быстрого конвейера совпадают с workers=1, ограничение пикселей применяется: {spawn_workers_check}")
+print(f"Одинаковые изображения, разного цвета, 'bnw' с дизерингом: {imt.get_hamming_distance(a_1_compat_pipeline_hash, a_2_compat_pipeline_hash)}, быстрый конвейер без дизеринга: {imt.get_hamming_distance(a_1_fast_pipeline_hash, a_2_fast_pipeline_hash)}")
+
+# Командная строка: расстояние между хэшами в JSON Lines
+import cli
+cli.main(['compare', a_1_hash.hex(), a_2_hash.hex()])